@@ -3,14 +3,26 @@ NFCe Web Reader - Backend Flask
 Aplicação web para ler e processar notas fiscais NFCe
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 import os
 import sys
-import csv
 import json
-from datetime import datetime
-import subprocess
+import hmac
+import time
+from datetime import datetime, timedelta
 import logging
+import threading
+from collections import Counter
+
+from crawl_engine import create_engine
+from events import EventHub, TooManySubscribers
+from jobs import DrainLock, JobStore, WorkerPool
+from nfceReader.notes import NoteIndex, extract_access_key
+from nfceReader.profiles import profile_for_url
+from nfceReader.storage import ItemStore
+from nfceReader import export, metrics
+import qrdecode
+import timing
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -19,43 +31,349 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'nfce-reader-secret-key-2024'
 
-# Caminho do arquivo CSV
-CSV_FILE = "nfc_data.csv"
+# CSV legado: importado para o SQLite na primeira execução
+CSV_FILE = os.environ.get('CSV_FILE', "nfc_data.csv")
+
+# Motor de crawl: "inprocess" (reactor persistente) ou "subprocess" (scrapy crawl)
+CRAWL_ENGINE = os.environ.get('CRAWL_ENGINE', 'inprocess')
+PROCESS_TIMEOUT = int(os.environ.get('PROCESS_TIMEOUT', 30))
+
+# Crawls simultâneos por host SEFAZ (padrão: o perfil de cada portal,
+# ver nfceReader/profiles.py) e tamanho máximo de um lote
+HOST_CONCURRENCY = int(os.environ['HOST_CONCURRENCY']) if os.environ.get('HOST_CONCURRENCY') else None
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 1000))
+
+# Pool de workers da fila: roda dentro do processo web, a menos que
+# QUEUE_INLINE_WORKER=0 (nesse caso rode `python worker.py` com os mesmos
+# bancos). Os limites por host SEFAZ valem por processo, então só um
+# processo por banco de jobs drena a fila (DrainLock); os outros workers
+# do gunicorn ficam de reserva
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 4))
+QUEUE_INLINE_WORKER = os.environ.get('QUEUE_INLINE_WORKER', '1') == '1'
+
+# Token exigido (header X-Admin-Token) pelos endpoints /api/admin; sem ele,
+# a administração fica desativada
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Paginação do /api/data
+DATA_PAGE_SIZE = int(os.environ.get('DATA_PAGE_SIZE', 500))
+DATA_MAX_PAGE_SIZE = int(os.environ.get('DATA_MAX_PAGE_SIZE', 5000))
+
+job_store = JobStore()
+item_store = ItemStore()
+note_index = NoteIndex()
+event_hub = EventHub(item_store, job_store)
+store_collector = metrics.StoreCollector(item_store, job_store)
+profile_switch = timing.ProfileSwitch(job_store)
+worker_pool = None
+_worker_pool_lock = threading.Lock()
 
-def init_csv():
-    """Inicializa o arquivo CSV se não existir"""
+def migrate_legacy_csv():
+    """Importa o nfc_data.csv antigo para o SQLite e o renomeia"""
     if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, mode="w", newline="", encoding="utf-8-sig") as f:
-            writer = csv.writer(f, delimiter=';')
-            writer.writerow(["Estabelecimento", "Produto", "Quantidade", "Unidade", "Valor_Total", "Desconto"])
-        logger.info("CSV inicializado com sucesso")
+        return
+    try:
+        imported = item_store.import_csv(CSV_FILE)
+        os.replace(CSV_FILE, CSV_FILE + ".migrated")
+        logger.info(f"CSV legado migrado para o SQLite ({imported} linhas)")
+    except FileNotFoundError:
+        pass  # outro worker já migrou
+    except Exception as e:
+        logger.error(f"Erro ao migrar CSV legado: {str(e)}")
+
+def is_nfce_url(url):
+    """Validação simples de URL de NFCe: portal conhecido ou padrão do endereço"""
+    if profile_for_url(url, default=None) is not None:
+        return True
+    return 'fazenda' in url.lower() and 'nfce' in url.lower()
+
+def parse_date_param(value, end=False):
+    """Converte data/datahora ISO em timestamp; datas puras em `end` incluem o dia todo"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.timestamp()
+
+# As funções abaixo não dependem do Flask: o modo assíncrono (asgi.py)
+# usa as mesmas, para que as duas formas de servir respondam igual.
+
+def data_filters(args):
+    """Filtros do /api/data a partir da query string"""
+    return {
+        "store": args.get('store') or None,
+        "product": args.get('product') or None,
+        "since": parse_date_param(args.get('since')),
+        "until": parse_date_param(args.get('until'), end=True),
+    }
+
+def data_params(args):
+    """Filtros, cursor e limite do /api/data; ValueError se algum for inválido"""
+    filters = data_filters(args)
+    filters["max_id"] = int(args['max_id']) if args.get('max_id') else None
+    cursor = int(args['cursor']) if args.get('cursor') else None
+    limit = int(args['limit']) if args.get('limit') else None
+    if limit is not None and limit < 1:
+        raise ValueError("limit deve ser positivo")
+    return filters, cursor, limit
+
+def data_page(filters, cursor, limit):
+    """Uma página do /api/data, com o cursor da próxima (ou None)"""
+    limit = min(limit or DATA_PAGE_SIZE, DATA_MAX_PAGE_SIZE)
+    # Busca um a mais para saber se existe próxima página
+    with timing.stage("query"):
+        rows = list(item_store.iter_rows(after_id=cursor, limit=limit + 1, **filters))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "success": True,
+        "data": [row for _, row in rows],
+        "next_cursor": str(rows[-1][0]) if has_more else None
+    }
+
+def iter_data_ndjson(filters, cursor, limit):
+    """Linhas do /api/data?format=ndjson, uma por linha"""
+    for _, row in item_store.iter_rows(after_id=cursor, limit=limit, **filters):
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+def known_note(url):
+    """Resposta imediata se a nota da URL já foi ingerida, ou None"""
+    access_key = extract_access_key(url)
+    with timing.stage("lookup"):
+        known = note_index.get(access_key) if access_key else None
+    if not known:
+        return None
+    return {
+        "success": True,
+        "duplicate": True,
+        "message": "NFCe já processada anteriormente",
+        "access_key": access_key,
+        "ingested_at": known["ingested_at"]
+    }
+
+def batch_error(urls):
+    """Corpo da resposta 400 se a lista de URLs do lote for inválida, ou None"""
+    if not isinstance(urls, list) or not urls:
+        return {"success": False, "message": "Lista de URLs não fornecida"}
+    if len(urls) > BATCH_MAX_URLS:
+        return {"success": False, "message": f"Lote excede o limite de {BATCH_MAX_URLS} URLs"}
+    with timing.stage("validation"):
+        invalid = [url for url in (str(url).strip() for url in urls) if not is_nfce_url(url)]
+    if invalid:
+        return {
+            "success": False,
+            "message": "URL inválida. Certifique-se de que é uma URL de NFCe",
+            "invalid": invalid
+        }
+    return None
+
+def split_duplicates(urls):
+    """Separa as notas novas das já ingeridas e das repetidas no próprio lote"""
+    pending, duplicates, seen = [], [], set()
+    with timing.stage("lookup"):
+        for url in urls:
+            access_key = extract_access_key(url)
+            if access_key and (access_key in seen or note_index.contains(access_key)):
+                duplicates.append(url)
+                continue
+            if access_key:
+                seen.add(access_key)
+            pending.append(url)
+    return pending, duplicates
+
+def create_job(urls, duplicates=None):
+    """Grava as URLs na fila durável e retorna o corpo da resposta 202"""
+    with timing.stage("enqueue"):
+        job_id = job_store.create_job(urls)
+    response = {
+        "success": True,
+        "message": "NFCe adicionada à fila de processamento",
+        "job_id": job_id,
+        "total": len(urls),
+        "status_url": f"/api/jobs/{job_id}"
+    }
+    if duplicates is not None:
+        response["duplicates"] = duplicates
+    return response
+
+def decode_upload(files):
+    """Decodifica as fotos de cupons enviadas e enfileira as NFCe encontradas.
+
+    `files` são pares (nome, arquivo binário): imagens ou zips de imagens.
+    Retorna o corpo da resposta, com o resultado de cada imagem em
+    "results"; UploadError se o envio for inválido.
+    """
+    if not qrdecode.available():
+        raise qrdecode.UploadError("Decodificação indisponível: instale pyzbar e Pillow")
+
+    with timing.stage("decode"):
+        results = list(qrdecode.decode_batch(qrdecode.iter_uploads(files)))
+    found = [text for result in results for text in result["codes"] if is_nfce_url(text)]
+    pending, duplicates = split_duplicates(found)
+
+    # Relatório por imagem; a primeira ocorrência de uma nota nova é a enfileirada
+    queued = Counter(pending)
+    for result in results:
+        codes = []
+        for text in result["codes"]:
+            if not is_nfce_url(text):
+                status = "invalid"
+            elif queued[text]:
+                status = "queued"
+                queued[text] -= 1
+            else:
+                status = "duplicate"
+            codes.append({"url": text, "status": status})
+        result["codes"] = codes
+        result["status"] = "error" if result["error"] else "decoded" if codes else "no_qr"
+
+    if pending:
+        response = create_job(pending, duplicates)
+    else:
+        response = {
+            "success": True,
+            "message": "Nenhuma NFCe nova encontrada nas imagens",
+            "job_id": None,
+            "total": 0,
+            "duplicates": duplicates
+        }
+    response["images"] = len(results)
+    response["decoded"] = sum(1 for result in results if result["status"] == "decoded")
+    response["results"] = results
+    return response
+
+def get_job(job_id):
+    """Job com o progresso por URL, ou None.
 
-def run_spider(url):
-    """Executa o spider Scrapy via subprocess"""
+    As etapas do crawl das URLs (espera na fila, partida, download, parse,
+    gravação), somadas, entram no Server-Timing do request como crawl_*.
+    """
+    job = job_store.get_job(job_id)
+    request_timing = timing.current()
+    if job is not None and request_timing is not None:
+        for url in job["urls"]:
+            for name, ms in url["timings"].items():
+                request_timing.add(f"crawl_{name}", ms / 1000)
+    return job
+
+def download_stream(args):
+    """Valida os parâmetros do /api/download e monta o stream da exportação.
+
+    Retorna (stream, mimetype, filename); ValueError com a mensagem de
+    erro se algum parâmetro for inválido.
+    """
+    fmt = args.get('format', 'csv')
+    compress = args.get('compress')
+    if fmt not in export.FORMATS:
+        raise ValueError(f"Formato inválido: {fmt}")
+    if compress not in (None, '', 'gzip') or (compress and fmt in export.COLUMNAR_FORMATS):
+        raise ValueError(f"Compressão inválida para {fmt}: {compress}")
+    if fmt in export.COLUMNAR_FORMATS and not export.columnar_available():
+        raise ValueError(f"Formato {fmt} indisponível: instale pyarrow")
     try:
-        # Comando Scrapy com proteção para Windows
-        comando = f'scrapy crawl nfcedata -a url="{url}"'
-        
-        # Executar Scrapy como subprocess
-        result = subprocess.run(
-            comando,
-            cwd="nfceReader/",
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=30
+        filters = data_filters(args)
+    except ValueError as e:
+        raise ValueError(f"Parâmetro inválido: {str(e)}")
+
+    if fmt == 'csv':
+        stream = item_store.iter_csv(**filters)
+    elif fmt == 'ndjson':
+        stream = export.iter_ndjson(item_store.iter_records(**filters))
+    elif fmt == 'parquet':
+        stream = export.iter_parquet(item_store.iter_records(**filters))
+    else:
+        stream = export.iter_arrow(item_store.iter_records(**filters))
+
+    mimetype, extension = export.FORMATS[fmt]
+    filename = f'nfce_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    if compress:
+        stream = export.gzip_stream(stream)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return stream, mimetype, filename
+
+# Sem cache nem buffer no proxy: cada evento sai assim que é gerado
+EVENT_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def last_event_id(headers):
+    """Cursor enviado pelo EventSource ao reconectar (Last-Event-ID), ou None"""
+    value = headers.get('Last-Event-ID', '')
+    return int(value) if value.isdigit() else None
+
+def start_worker_pool():
+    """Sobe o pool de workers da fila neste processo (uma vez só)"""
+    global worker_pool
+    if not QUEUE_INLINE_WORKER or worker_pool is not None:
+        return
+    with _worker_pool_lock:
+        if worker_pool is None:
+            engine = create_engine(CRAWL_ENGINE, host_concurrency=HOST_CONCURRENCY,
+                                   max_workers=WORKER_CONCURRENCY)
+            worker_pool = WorkerPool(engine, job_store, size=WORKER_CONCURRENCY,
+                                     timeout=PROCESS_TIMEOUT, note_index=note_index,
+                                     drain_lock=DrainLock(job_store.path))
+            worker_pool.start()
+
+def finish_request(request_timing, rule, method, path, status):
+    """Registra a latência do request (histograma e log) e devolve o header Server-Timing"""
+    metrics.HTTP_LATENCY.labels(rule or "<unmatched>", method, str(status)).observe(
+        time.perf_counter() - request_timing.started
+    )
+    return timing.finish(request_timing, method, path, rule, status)
+
+def admin_error(headers):
+    """(corpo, status) da recusa se o request não trouxer o ADMIN_TOKEN, ou None"""
+    if not ADMIN_TOKEN:
+        return {"success": False, "message": "Administração desativada: defina ADMIN_TOKEN"}, 403
+    token = headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return {"success": False, "message": "Token de administração inválido"}, 401
+    return None
+
+def profile_status():
+    """Requests ainda a perfilar e os perfis mais recentes deste servidor"""
+    return {
+        "success": True,
+        "remaining": profile_switch.remaining(),
+        "directory": os.path.abspath(timing.PROFILE_DIR),
+        "profiles": timing.list_profiles()
+    }
+
+def arm_profiler(data):
+    """Liga o profiler nos próximos `requests` requests (0 desliga); ValueError se inválido"""
+    try:
+        count = int(data.get('requests'))
+    except (TypeError, ValueError):
+        raise ValueError("requests deve ser um número inteiro")
+    if not 0 <= count <= timing.PROFILE_MAX_REQUESTS:
+        raise ValueError(f"requests deve estar entre 0 e {timing.PROFILE_MAX_REQUESTS}")
+    profile_switch.arm(count)
+    response = profile_status()
+    response["message"] = f"Profiler ligado nos próximos {count} requests" if count else "Profiler desligado"
+    return response
+
+def enqueue_urls(urls, duplicates=None):
+    """Grava as URLs na fila durável e retorna a resposta 202 com o job"""
+    return jsonify(create_job(urls, duplicates)), 202
+
+@app.before_request
+def start_request_timer():
+    g.timing = timing.begin(profile=profile_switch.take())
+
+@app.after_request
+def record_request_timing(response):
+    if 'timing' in g:
+        response.headers['Server-Timing'] = finish_request(
+            g.timing, request.url_rule.rule if request.url_rule else None,
+            request.method, request.path, response.status_code
         )
-        
-        if result.returncode == 0:
-            return {"success": True, "message": "NFCe processada com sucesso"}
-        else:
-            return {"success": False, "message": f"Erro ao processar: {result.stderr}"}
-            
-    except subprocess.TimeoutExpired:
-        return {"success": False, "message": "Timeout ao processar NFCe"}
-    except Exception as e:
-        logger.error(f"Erro ao processar NFCe: {str(e)}")
-        return {"success": False, "message": str(e)}
+    return response
+
+@app.before_request
+def ensure_worker_pool():
+    """Sobe o pool de workers da fila no primeiro request deste processo"""
+    start_worker_pool()
 
 @app.route('/')
 def index():
@@ -66,35 +384,28 @@ def index():
 def process_nfce():
     """Processa uma URL de NFCe"""
     try:
-        data = request.get_json()
-        url = data.get('url', '').strip()
+        with timing.stage("validation"):
+            data = request.get_json()
+            url = data.get('url', '').strip()
+            valid = is_nfce_url(url)
         
         if not url:
             return jsonify({"success": False, "message": "URL não fornecida"}), 400
         
         # Validar URL
-        if 'fazenda' not in url.lower() or 'nfce' not in url.lower():
+        if not valid:
             return jsonify({
                 "success": False, 
                 "message": "URL inválida. Certifique-se de que é uma URL de NFCe"
             }), 400
         
-        # Inicializar CSV se necessário
-        init_csv()
+        # Nota já ingerida: responde na hora, sem acessar a SEFAZ
+        known = known_note(url)
+        if known:
+            return jsonify(known)
         
-        # Executar o spider
-        result = run_spider(url)
-        
-        if result["success"]:
-            return jsonify({
-                "success": True,
-                "message": "NFCe processada com sucesso!"
-            })
-        else:
-            return jsonify({
-                "success": False,
-                "message": result["message"]
-            }), 500
+        # Enfileirar; o crawl roda no pool de workers
+        return enqueue_urls([url])
             
     except Exception as e:
         logger.error(f"Erro no endpoint /api/process: {str(e)}")
@@ -103,48 +414,157 @@ def process_nfce():
             "message": f"Erro interno: {str(e)}"
         }), 500
 
+@app.route('/api/process/batch', methods=['POST'])
+def process_batch():
+    """Agenda um lote de URLs de NFCe e retorna o id do job"""
+    try:
+        data = request.get_json() or {}
+        urls = data.get('urls')
+
+        error = batch_error(urls)
+        if error:
+            return jsonify(error), 400
+
+        # Descartar notas já ingeridas e repetições dentro do próprio lote
+        pending, duplicates = split_duplicates([str(url).strip() for url in urls])
+
+        if not pending:
+            return jsonify({
+                "success": True,
+                "message": "Todas as NFCe do lote já foram processadas",
+                "job_id": None,
+                "total": 0,
+                "duplicates": duplicates
+            })
+
+        return enqueue_urls(pending, duplicates)
+
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/process/batch: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Erro interno: {str(e)}"
+        }), 500
+
+@app.route('/api/decode', methods=['POST'])
+def decode_images():
+    """Lê os QR Codes de fotos de cupons (multipart: imagens ou zip) e enfileira as NFCe"""
+    try:
+        files = [(file.filename or field, file.stream) for field, file in request.files.items(multi=True)]
+        response = decode_upload(files)
+        return jsonify(response), 202 if response["job_id"] else 200
+    except qrdecode.UploadError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/decode: {str(e)}")
+        return jsonify({"success": False, "message": f"Erro interno: {str(e)}"}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@app.route('/api/process/batch/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Retorna o progresso de um job (URL única ou lote)"""
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "Job não encontrado"}), 404
+        return jsonify({"success": True, "job": job})
+    except Exception as e:
+        logger.error(f"Erro ao consultar job: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @app.route('/api/data', methods=['GET'])
 def get_data():
-    """Retorna os dados do CSV"""
+    """Retorna os itens armazenados, paginados por cursor.
+
+    Parâmetros: cursor, limit, store, product, since, until (ISO),
+    max_id (último id incluído, ver /api/events) e format=ndjson para
+    receber as linhas em streaming, uma por linha.
+    """
     try:
-        if not os.path.exists(CSV_FILE):
-            return jsonify({"success": True, "data": []})
-        
-        data = []
-        with open(CSV_FILE, mode="r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f, delimiter=';')
-            for row in reader:
-                data.append(row)
-        
-        return jsonify({"success": True, "data": data})
+        filters, cursor, limit = data_params(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Parâmetro inválido: {str(e)}"}), 400
+
+    try:
+        if request.args.get('format') == 'ndjson':
+            return Response(stream_with_context(iter_data_ndjson(filters, cursor, limit)),
+                            mimetype='application/x-ndjson')
+        return jsonify(data_page(filters, cursor, limit))
     except Exception as e:
         logger.error(f"Erro ao ler dados: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/api/download', methods=['GET'])
 def download_csv():
-    """Download do arquivo CSV"""
+    """Download dos dados em streaming.
+
+    Parâmetros: format=csv|ndjson|parquet|arrow (parquet/arrow exigem
+    pyarrow), compress=gzip (csv e ndjson) e os filtros do /api/data.
+    """
     try:
-        if not os.path.exists(CSV_FILE):
-            return jsonify({"success": False, "message": "Nenhum dado disponível"}), 404
-        
-        return send_file(
-            CSV_FILE,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'nfce_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        stream, mimetype, filename = download_stream(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
+        return Response(
+            stream_with_context(stream),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
     except Exception as e:
         logger.error(f"Erro ao fazer download: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route('/api/events', methods=['GET'])
+def events_stream():
+    """Eventos em tempo real (SSE): progresso dos jobs, linhas novas e estatísticas"""
+    try:
+        subscription = event_hub.subscribe(last_event_id(request.headers))
+    except TooManySubscribers as e:
+        # Cada conexão prende uma thread: recusar antes de esgotar as da API
+        response = jsonify({"success": False, "message": str(e)})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 503
+    response = Response(subscription.stream(), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+    # O gerador não iniciado não passa pelo finally: liberar a vaga no fechamento
+    response.call_on_close(lambda: event_hub.unsubscribe(subscription))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas no formato do Prometheus"""
+    if not metrics.available():
+        return jsonify({"success": False, "message": "Métricas indisponíveis: instale prometheus-client"}), 503
+    try:
+        body, content_type = metrics.exposition(store_collector)
+        return Response(body, content_type=content_type)
+    except Exception as e:
+        logger.error(f"Erro ao coletar métricas: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """Liga o profiler por amostragem nos próximos N requests (POST {"requests": N}) ou mostra o estado"""
+    denied = admin_error(request.headers)
+    if denied:
+        body, status = denied
+        return jsonify(body), status
+    try:
+        if request.method == 'POST':
+            return jsonify(arm_profiler(request.get_json(silent=True) or {}))
+        return jsonify(profile_status())
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Parâmetro inválido: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/admin/profile: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @app.route('/api/clear', methods=['POST'])
 def clear_data():
-    """Limpa todos os dados do CSV"""
+    """Limpa todos os dados (itens e índice de notas) numa transação"""
     try:
-        if os.path.exists(CSV_FILE):
-            os.remove(CSV_FILE)
-        init_csv()
+        item_store.clear()
         return jsonify({"success": True, "message": "Dados limpos com sucesso"})
     except Exception as e:
         logger.error(f"Erro ao limpar dados: {str(e)}")
@@ -154,68 +574,15 @@ def clear_data():
 def get_stats():
     """Retorna estatísticas dos dados"""
     try:
-        if not os.path.exists(CSV_FILE):
-            return jsonify({
-                "success": True,
-                "stats": {
-                    "total_items": 0,
-                    "total_value": 0,
-                    "total_discount": 0,
-                    "stores": []
-                }
-            })
-        
-        data = []
-        with open(CSV_FILE, mode="r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f, delimiter=';')
-            for row in reader:
-                data.append(row)
-        
-        # Calcular estatísticas
-        total_items = len(data)
-        total_value = 0
-        total_discount = 0
-        stores = {}
-        
-        for row in data:
-            # Processar valor
-            valor_str = row.get('Valor_Total', '0').replace('.', '').replace(',', '.')
-            try:
-                valor = float(valor_str) if valor_str else 0
-                total_value += valor
-            except:
-                pass
-            
-            # Processar desconto
-            desconto_str = row.get('Desconto', '0').replace('-', '').replace('.', '').replace(',', '.')
-            try:
-                desconto = float(desconto_str) if desconto_str else 0
-                total_discount += desconto
-            except:
-                pass
-            
-            # Contar por estabelecimento
-            store = row.get('Estabelecimento', 'Não identificado')
-            stores[store] = stores.get(store, 0) + 1
-        
-        store_list = [{"name": k, "count": v} for k, v in stores.items()]
-        store_list.sort(key=lambda x: x['count'], reverse=True)
-        
-        return jsonify({
-            "success": True,
-            "stats": {
-                "total_items": total_items,
-                "total_value": round(total_value, 2),
-                "total_discount": round(total_discount, 2),
-                "stores": store_list[:5]  # Top 5 estabelecimentos
-            }
-        })
+        stats = item_store.stats(top=5)  # Top 5 estabelecimentos
+        return jsonify({"success": True, "stats": stats})
     except Exception as e:
         logger.error(f"Erro ao calcular estatísticas: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+migrate_legacy_csv()
+
 if __name__ == '__main__':
-    init_csv()
     port = int(os.environ.get('PORT', 5000))
     print("\n" + "="*60)
     print("🚀 NFCe Web Reader - Servidor iniciado!")
@@ -0,0 +1,301 @@
+"""
+NFCe Web Reader - Modo assíncrono (ASGI)
+Mesmas rotas e respostas do app.py, servidas por um único event loop:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+O acesso ao SQLite roda em threads (asyncio.to_thread) e o crawl já
+acontece no pool de workers da fila, então nenhum request segura o loop;
+um processo atende centenas de requisições simultâneas.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from quart import Quart, Response, g, jsonify, render_template, request
+
+import app as web
+import qrdecode
+import timing
+from nfceReader import metrics
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.config['SECRET_KEY'] = web.app.config['SECRET_KEY']
+
+# Threads para as chamadas bloqueantes (SQLite); limitam quantas consultas
+# rodam ao mesmo tempo, não quantos requests o loop aceita
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+
+# Exportações grandes levam mais que o limite padrão do Quart (60 s)
+app.config['RESPONSE_TIMEOUT'] = None
+
+# Cada ida à thread de um stream lê até STREAM_BATCH pedaços ou ~64 KB
+STREAM_BATCH = 500
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _take(iterator):
+    chunk = []
+    size = 0
+    for part in iterator:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        chunk.append(part)
+        size += len(part)
+        if len(chunk) >= STREAM_BATCH or size >= STREAM_CHUNK_BYTES:
+            break
+    return b"".join(chunk)
+
+
+async def iterate_in_thread(iterator):
+    """Consome um gerador síncrono (SQLite, pyarrow) sem bloquear o loop.
+
+    O gerador inteiro roda numa thread própria, porque a conexão SQLite
+    aberta por ele só pode ser usada na thread que a criou.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream")
+    iterator = iter(iterator)
+    try:
+        while True:
+            data = await loop.run_in_executor(executor, _take, iterator)
+            if not data:
+                return
+            yield data
+    finally:
+        # Cliente desconectado no meio: fecha o gerador na thread dele
+        if hasattr(iterator, "close"):
+            executor.submit(iterator.close)
+        executor.shutdown(wait=False)
+
+
+@app.before_serving
+async def ensure_worker_pool():
+    """Sobe o pool de workers da fila junto com o servidor"""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+    )
+    await asyncio.to_thread(web.start_worker_pool)
+
+
+@app.before_request
+async def start_request_timer():
+    # O contador do profiler fica no SQLite: só sai do loop quando precisa consultá-lo
+    profile = await asyncio.to_thread(web.profile_switch.take) if web.profile_switch.pending() else False
+    g.timing = timing.begin(profile)
+
+
+@app.after_request
+async def record_request_timing(response):
+    if 'timing' in g:
+        finish = partial(web.finish_request, g.timing, request.url_rule.rule if request.url_rule else None,
+                         request.method, request.path, response.status_code)
+        # Com profiler, parar a amostragem e gravar o perfil bloqueiam
+        response.headers['Server-Timing'] = await asyncio.to_thread(finish) if g.timing.profiler else finish()
+    return response
+
+
+@app.route('/')
+async def index():
+    """Página principal"""
+    return await render_template('index.html')
+
+
+@app.route('/api/process', methods=['POST'])
+async def process_nfce():
+    """Processa uma URL de NFCe"""
+    try:
+        with timing.stage("validation"):
+            data = await request.get_json()
+            url = data.get('url', '').strip()
+            valid = web.is_nfce_url(url)
+
+        if not url:
+            return jsonify({"success": False, "message": "URL não fornecida"}), 400
+
+        if not valid:
+            return jsonify({
+                "success": False,
+                "message": "URL inválida. Certifique-se de que é uma URL de NFCe"
+            }), 400
+
+        # Nota já ingerida: responde na hora, sem acessar a SEFAZ
+        known = await asyncio.to_thread(web.known_note, url)
+        if known:
+            return jsonify(known)
+
+        return jsonify(await asyncio.to_thread(web.create_job, [url])), 202
+
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/process: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Erro interno: {str(e)}"
+        }), 500
+
+
+@app.route('/api/process/batch', methods=['POST'])
+async def process_batch():
+    """Agenda um lote de URLs de NFCe e retorna o id do job"""
+    try:
+        data = await request.get_json() or {}
+        urls = data.get('urls')
+
+        error = web.batch_error(urls)
+        if error:
+            return jsonify(error), 400
+
+        pending, duplicates = await asyncio.to_thread(
+            web.split_duplicates, [str(url).strip() for url in urls]
+        )
+        if not pending:
+            return jsonify({
+                "success": True,
+                "message": "Todas as NFCe do lote já foram processadas",
+                "job_id": None,
+                "total": 0,
+                "duplicates": duplicates
+            })
+
+        return jsonify(await asyncio.to_thread(web.create_job, pending, duplicates)), 202
+
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/process/batch: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Erro interno: {str(e)}"
+        }), 500
+
+
+@app.route('/api/decode', methods=['POST'])
+async def decode_images():
+    """Lê os QR Codes de fotos de cupons (multipart: imagens ou zip) e enfileira as NFCe"""
+    try:
+        uploads = await request.files
+        files = [(file.filename or field, file.stream) for field, file in uploads.items(multi=True)]
+        response = await asyncio.to_thread(web.decode_upload, files)
+        return jsonify(response), 202 if response["job_id"] else 200
+    except qrdecode.UploadError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/decode: {str(e)}")
+        return jsonify({"success": False, "message": f"Erro interno: {str(e)}"}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@app.route('/api/process/batch/<job_id>', methods=['GET'])
+async def job_status(job_id):
+    """Retorna o progresso de um job (URL única ou lote)"""
+    try:
+        job = await asyncio.to_thread(web.get_job, job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "Job não encontrado"}), 404
+        return jsonify({"success": True, "job": job})
+    except Exception as e:
+        logger.error(f"Erro ao consultar job: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/data', methods=['GET'])
+async def get_data():
+    """Retorna os itens armazenados, paginados por cursor (ver app.get_data)"""
+    try:
+        filters, cursor, limit = web.data_params(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Parâmetro inválido: {str(e)}"}), 400
+
+    try:
+        if request.args.get('format') == 'ndjson':
+            return Response(iterate_in_thread(web.iter_data_ndjson(filters, cursor, limit)),
+                            mimetype='application/x-ndjson')
+        return jsonify(await asyncio.to_thread(web.data_page, filters, cursor, limit))
+    except Exception as e:
+        logger.error(f"Erro ao ler dados: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/download', methods=['GET'])
+async def download_csv():
+    """Download dos dados em streaming (ver app.download_csv)"""
+    try:
+        stream, mimetype, filename = web.download_stream(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
+        return Response(
+            iterate_in_thread(stream),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+    except Exception as e:
+        logger.error(f"Erro ao fazer download: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/events', methods=['GET'])
+async def events_stream():
+    """Eventos em tempo real (SSE): progresso dos jobs, linhas novas e estatísticas"""
+    subscription = await asyncio.to_thread(
+        web.event_hub.subscribe, web.last_event_id(request.headers), asyncio.get_running_loop()
+    )
+    return Response(subscription.astream(), mimetype='text/event-stream', headers=web.EVENT_STREAM_HEADERS)
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Métricas no formato do Prometheus"""
+    if not metrics.available():
+        return jsonify({"success": False, "message": "Métricas indisponíveis: instale prometheus-client"}), 503
+    try:
+        body, content_type = await asyncio.to_thread(metrics.exposition, web.store_collector)
+        return Response(body, content_type=content_type)
+    except Exception as e:
+        logger.error(f"Erro ao coletar métricas: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+async def admin_profile():
+    """Liga o profiler por amostragem nos próximos N requests (POST {"requests": N}) ou mostra o estado"""
+    denied = web.admin_error(request.headers)
+    if denied:
+        body, status = denied
+        return jsonify(body), status
+    try:
+        if request.method == 'POST':
+            data = await request.get_json(silent=True) or {}
+            return jsonify(await asyncio.to_thread(web.arm_profiler, data))
+        return jsonify(await asyncio.to_thread(web.profile_status))
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Parâmetro inválido: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Erro no endpoint /api/admin/profile: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/clear', methods=['POST'])
+async def clear_data():
+    """Limpa todos os dados (itens e índice de notas) numa transação"""
+    try:
+        await asyncio.to_thread(web.item_store.clear)
+        return jsonify({"success": True, "message": "Dados limpos com sucesso"})
+    except Exception as e:
+        logger.error(f"Erro ao limpar dados: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/stats', methods=['GET'])
+async def get_stats():
+    """Retorna estatísticas dos dados"""
+    try:
+        stats = await asyncio.to_thread(web.item_store.stats, 5)  # Top 5 estabelecimentos
+        return jsonify({"success": True, "stats": stats})
+    except Exception as e:
+        logger.error(f"Erro ao calcular estatísticas: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
@@ -0,0 +1,310 @@
+"""
+NFCe Web Reader - Motor de crawl em processo
+Mantém um CrawlerRunner do Scrapy vivo numa thread dedicada ao reactor,
+evitando subir um interpretador novo a cada nota processada.
+"""
+
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRAPY_PROJECT_DIR = os.path.join(BASE_DIR, "nfceReader")
+
+# O projeto Scrapy não é um pacote instalado; expõe nfceReader.* para import
+if SCRAPY_PROJECT_DIR not in sys.path:
+    sys.path.insert(0, SCRAPY_PROJECT_DIR)
+
+from nfceReader.metrics import STAGE_STATS_PREFIX
+from nfceReader.profiles import HostThrottle, profile_for_host
+
+REACTOR_START_TIMEOUT = 15
+
+
+class CrawlError(Exception):
+    """Falha ao executar o spider; `cause` classifica a falha nas métricas"""
+
+    def __init__(self, message, cause="error"):
+        super().__init__(message)
+        self.cause = cause
+
+
+class CircuitOpenError(CrawlError):
+    """Portal rejeitado pelo disjuntor; vale tentar de novo após `retry_after` s"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, cause="circuit_open")
+        self.retry_after = retry_after
+
+
+class _CrawlJob:
+    """Acumula os itens de um único crawl e resolve o Future do chamador.
+
+    Antes de resolver, deixa em `future.timings` a duração (s) das etapas
+    do crawl registradas nas stats (startup, fetch, parse, write).
+    """
+
+    def __init__(self, crawler, future):
+        # crawler é None enquanto o crawl espera vaga e ritmo do host
+        self.crawler = crawler
+        self.future = future
+        self.items = []
+
+    def item_scraped(self, item):
+        self.items.append(dict(item))
+
+    def _record_timings(self):
+        stats = self.crawler.stats.get_stats() if self.crawler is not None and self.crawler.stats else {}
+        self.future.timings = {
+            key[len(STAGE_STATS_PREFIX):]: value
+            for key, value in stats.items() if key.startswith(STAGE_STATS_PREFIX)
+        }
+
+    def finished(self, _):
+        if self.future.done():
+            return
+        self._record_timings()
+        stats = self.crawler.stats
+        errors = stats.get_value("log_count/ERROR", 0) if stats else 0
+        # Motivo registrado pelo ResilienceMiddleware (disjuntor, orçamento, rede)
+        reason = stats.get_value("nfce/failure_reason") if stats else None
+        retry_after = stats.get_value("nfce/retry_after") if stats else None
+        cause = stats.get_value("nfce/failure_cause", "error") if stats else "error"
+        if self.items:
+            self.future.set_result(self.items)
+        elif retry_after is not None:
+            self.future.set_exception(CircuitOpenError(reason, retry_after))
+        elif reason or errors:
+            self.future.set_exception(CrawlError(reason or "Falha ao baixar ou interpretar a NFCe", cause))
+        else:
+            self.future.set_result(self.items)
+
+    def failed(self, failure):
+        if not self.future.done():
+            self._record_timings()
+            self.future.set_exception(CrawlError(str(failure.value)))
+
+    def expire(self):
+        if self.future.done():
+            return
+        self._record_timings()
+        self.future.set_exception(TimeoutError("Timeout ao processar NFCe"))
+        if self.crawler is not None and self.crawler.crawling:
+            self.crawler.stop()
+
+
+class CrawlEngine:
+    """Executa o NfcedataSpider num reactor Twisted persistente.
+
+    Concorrência e ritmo por host vêm do perfil do portal (profiles.py);
+    `host_concurrency`, se informado, substitui a concorrência dos perfis.
+    Os limites são desta instância (deste processo): outros processos que
+    drenam a mesma fila têm os seus.
+    """
+
+    def __init__(self, host_concurrency=None):
+        self.host_concurrency = host_concurrency
+        self._hosts = {}
+        self._reactor = None
+        self._runner = None
+        self._thread = None
+        self._start_error = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Sobe a thread do reactor (idempotente)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run_reactor, name="scrapy-reactor", daemon=True
+                )
+                self._thread.start()
+
+        if not self._ready.wait(REACTOR_START_TIMEOUT):
+            raise CrawlError("Reactor do Scrapy não iniciou a tempo")
+        if self._start_error is not None:
+            raise CrawlError(f"Falha ao iniciar o reactor: {self._start_error}")
+
+    def _build_settings(self):
+        from scrapy.settings import Settings
+
+        settings = Settings()
+        settings.setmodule("nfceReader.settings", priority="project")
+        # Vários crawlers convivem no mesmo processo: sem console telnet por crawl
+        settings.set("TELNETCONSOLE_ENABLED", False, priority="cmdline")
+        return settings
+
+    def _run_reactor(self):
+        try:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+
+            from twisted.internet import asyncioreactor
+            asyncioreactor.install(loop)
+            from twisted.internet import reactor
+            from scrapy.crawler import CrawlerRunner
+
+            logging.getLogger("scrapy").setLevel(os.environ.get("SCRAPY_LOG_LEVEL", "ERROR"))
+            self._runner = CrawlerRunner(self._build_settings())
+            self._reactor = reactor
+        except Exception as e:
+            logger.error(f"Erro ao iniciar o motor de crawl: {str(e)}")
+            self._start_error = e
+            self._ready.set()
+            return
+
+        reactor.callWhenRunning(self._ready.set)
+        reactor.run(installSignalHandlers=False)
+
+    def _host(self, url):
+        from twisted.internet.defer import DeferredSemaphore
+
+        host = urlparse(url).hostname or ""
+        state = self._hosts.get(host)
+        if state is None:
+            throttle = HostThrottle(profile_for_host(host), self.host_concurrency)
+            state = self._hosts[host] = (DeferredSemaphore(throttle.concurrency), throttle)
+        return host, state
+
+    def _schedule(self, url, future, deadline, on_start):
+        from nfceReader import metrics
+        from nfceReader.middlewares import circuit_retry_after
+
+        host, (semaphore, throttle) = self._host(url)
+        # Disjuntor aberto: rejeita na hora, sem esperar vaga nem ritmo do host
+        retry_after = circuit_retry_after(host, time.monotonic())
+        if retry_after is not None:
+            metrics.FETCHES.labels(host, "circuit_open").inc()
+            future.timings = {}
+            future.set_exception(CircuitOpenError(
+                f"Portal {host} indisponível; nova tentativa em {retry_after:.0f}s", retry_after
+            ))
+            return
+
+        # O timeout conta desde o submit(): inclui a espera pela vaga e pelo ritmo
+        job = _CrawlJob(None, future)
+        timer = self._reactor.callLater(max(0.0, deadline - time.monotonic()), job.expire)
+        # Limite de crawls simultâneos por host SEFAZ, independente do chamador
+        semaphore.run(self._throttled, throttle, url, job, timer, on_start)
+
+    def _throttled(self, throttle, url, job, timer, on_start):
+        from twisted.internet.task import deferLater
+
+        if job.future.done():  # expirou esperando a vaga
+            return None
+        # Espaça o início dos crawls no mesmo host conforme o atraso atual
+        wait = throttle.reserve(time.monotonic())
+        if wait > 0:
+            return deferLater(self._reactor, wait, self._crawl, throttle, url, job, timer, on_start)
+        return self._crawl(throttle, url, job, timer, on_start)
+
+    def _crawl(self, throttle, url, job, timer, on_start):
+        from scrapy import signals
+        from nfceReader.spiders.nfcedata import NfcedataSpider
+
+        future = job.future
+        if future.done() or not future.set_running_or_notify_cancel():
+            return None
+        if on_start is not None:
+            on_start()
+
+        try:
+            crawler = job.crawler = self._runner.create_crawler(NfcedataSpider)
+            crawler.signals.connect(job.item_scraped, signal=signals.item_scraped)
+            # started_at: o spider mede a partida do crawl (métrica "startup")
+            d = self._runner.crawl(crawler, url=url, started_at=time.time())
+        except Exception as e:
+            if timer.active():
+                timer.cancel()
+            future.set_exception(CrawlError(str(e)))
+            return None
+
+        started = time.monotonic()
+
+        def record(_):
+            # Rejeição do disjuntor não mede o host: não dobra o atraso dele
+            error = future.exception()
+            if not isinstance(error, CircuitOpenError):
+                throttle.record(time.monotonic() - started, error is None)
+
+        d.addCallbacks(job.finished, job.failed)
+        d.addBoth(lambda _: timer.cancel() if timer.active() else None)
+        d.addBoth(record)
+        return d
+
+    def submit(self, url, timeout=30, on_start=None):
+        """Agenda um crawl sem bloquear; devolve um Future com a lista de itens.
+
+        `timeout` vale desde agora, contando a espera pela vaga e pelo ritmo do host.
+        """
+        self.start()
+        future = Future()
+        self._reactor.callFromThread(self._schedule, url, future, time.monotonic() + timeout, on_start)
+        return future
+
+    def crawl(self, url, timeout=30):
+        """Roda o spider para uma URL e devolve a lista de itens extraídos"""
+        return self.submit(url, timeout=timeout).result()
+
+
+class SubprocessEngine:
+    """Fallback: executa `scrapy crawl` num subprocess por URL"""
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scrapy-subprocess")
+
+    def start(self):
+        pass
+
+    def _run(self, url, timeout, on_start):
+        if on_start is not None:
+            on_start()
+
+        # Lista de argumentos, sem shell: a URL vem do cliente e aspas, `$(...)`
+        # ou `|` nela chegam ao spider como texto. O Python do processo evita
+        # depender do `scrapy` no PATH (inclusive no Windows)
+        comando = [sys.executable, "-m", "scrapy", "crawl", "nfcedata",
+                   "-a", f"url={url}", "-a", f"started_at={time.time()}"]
+        try:
+            result = subprocess.run(
+                comando,
+                cwd=SCRAPY_PROJECT_DIR,
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise TimeoutError("Timeout ao processar NFCe")
+
+        if result.returncode != 0:
+            raise CrawlError(f"Erro ao processar: {result.stderr}", cause="subprocess")
+        # Os itens vão direto para o SQLite pelo pipeline; não há retorno por URL
+        return []
+
+    def submit(self, url, timeout=30, on_start=None):
+        """Agenda um crawl sem bloquear; devolve um Future"""
+        return self._executor.submit(self._run, url, timeout, on_start)
+
+    def crawl(self, url, timeout=30):
+        return self.submit(url, timeout=timeout).result()
+
+
+def create_engine(mode="inprocess", host_concurrency=None, max_workers=4):
+    """Cria o motor em processo, caindo para subprocess se o reactor não subir"""
+    if mode == "inprocess":
+        engine = CrawlEngine(host_concurrency=host_concurrency)
+        try:
+            engine.start()
+            return engine
+        except Exception as e:
+            logger.warning(f"Motor em processo indisponível, usando subprocess: {str(e)}")
+    return SubprocessEngine(max_workers=max_workers)
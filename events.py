@@ -0,0 +1,264 @@
+"""
+NFCe Web Reader - Eventos em tempo real (Server-Sent Events)
+Uma thread por processo observa os bancos de itens e de jobs e transmite a
+todos os clientes conectados em /api/events o progresso dos jobs, as linhas
+recém-ingeridas e as variações das estatísticas, no lugar de cada cliente
+reconsultar /api/stats e /api/data.
+
+A detecção usa PRAGMA data_version, que muda quando outro processo (worker
+da fila, outro worker do gunicorn) grava no banco; sem gravação, cada
+verificação custa uma consulta trivial, independente do número de clientes.
+
+Eventos:
+    hello  {"last_id"}                       conexão aberta (id = cursor)
+    rows   {"rows", "last_id"}               linhas novas (id = cursor)
+    stats  {"stats", "delta"}                estatísticas atuais e variação
+    job    {"id", contagens, "finished", "urls"}  URLs de um job alteradas
+    clear  {}                                dados apagados
+    reset  {"last_id"}                       muitas linhas: recarregar /api/data
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Intervalo entre verificações dos bancos e comentário de keep-alive (s)
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+EVENTS_KEEPALIVE = float(os.environ.get('EVENTS_KEEPALIVE', 15))
+# Máximo de linhas num evento "rows"; acima disso o cliente recebe "reset"
+EVENTS_MAX_ROWS = int(os.environ.get('EVENTS_MAX_ROWS', 500))
+# Eventos pendentes por cliente; um cliente lento demais é desconectado
+# (o EventSource reconecta e retoma do Last-Event-ID)
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 256))
+# Duração máxima de uma conexão no modo WSGI, que prende uma thread (s)
+EVENTS_MAX_AGE = float(os.environ.get('EVENTS_MAX_AGE', 300))
+# Conexões simultâneas no modo WSGI por processo; cada uma prende uma thread
+# do gunicorn e, sem limite, os painéis abertos esgotam as threads da API.
+# Acima do limite a conexão é recusada com 503 e Retry-After (s)
+EVENTS_MAX_WSGI_CLIENTS = int(os.environ.get('EVENTS_MAX_WSGI_CLIENTS', 8))
+EVENTS_RETRY_AFTER = int(os.environ.get('EVENTS_RETRY_AFTER', 30))
+
+# Folga para gravações de jobs com updated_at anterior à última verificação
+JOB_CLOCK_SKEW = 2.0
+
+STATS_DELTA_FIELDS = ("total_items", "total_value_cents", "total_discount_cents", "flagged_items", "store_count")
+
+
+def format_event(event, data, event_id=None):
+    """Serializa um evento no formato text/event-stream"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+KEEPALIVE = b": keepalive\n\n"
+# Tempo que o EventSource espera para reconectar (ms)
+RETRY = b"retry: 2000\n\n"
+
+
+class TooManySubscribers(Exception):
+    """Limite de conexões síncronas do processo atingido"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Subscription:
+    """Fila de eventos de um cliente conectado"""
+
+    def __init__(self, hub, loop=None):
+        self.hub = hub
+        self.loop = loop
+        self.queue = asyncio.Queue(EVENTS_QUEUE_SIZE) if loop else queue.Queue(EVENTS_QUEUE_SIZE)
+        self.lagged = False
+
+    def put(self, event):
+        """Entrega um evento já serializado (chamado na thread do hub)"""
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._put_nowait, event)
+        else:
+            self._put_nowait(event)
+
+    def _put_nowait(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except (queue.Full, asyncio.QueueFull):
+            self.lagged = True
+
+    def stream(self):
+        """Gerador síncrono (Flask) dos eventos, com keep-alive"""
+        deadline = time.monotonic() + EVENTS_MAX_AGE
+        try:
+            yield RETRY
+            while not self.lagged and time.monotonic() < deadline:
+                try:
+                    yield self.queue.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield KEEPALIVE
+        finally:
+            self.hub.unsubscribe(self)
+
+    async def astream(self):
+        """Gerador assíncrono (asgi.py) dos eventos, com keep-alive"""
+        try:
+            yield RETRY
+            while not self.lagged:
+                try:
+                    yield await asyncio.wait_for(self.queue.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+        finally:
+            self.hub.unsubscribe(self)
+
+
+class EventHub:
+    """Observa os bancos e transmite as mudanças aos clientes deste processo"""
+
+    def __init__(self, item_store, job_store, interval=EVENTS_POLL_INTERVAL):
+        self.item_store = item_store
+        self.job_store = job_store
+        self.interval = interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = None
+        self._last_id = 0
+        self._jobs_since = time.time()
+        self._jobs_seen = {}
+
+    def subscribe(self, last_event_id=None, loop=None):
+        """Registra um cliente; `last_event_id` retoma de onde a conexão anterior parou
+
+        Sem `loop` (modo WSGI) o cliente ocupa uma thread enquanto durar a
+        conexão: acima de EVENTS_MAX_WSGI_CLIENTS levanta TooManySubscribers.
+        """
+        subscription = Subscription(self, loop)
+        with self._lock:
+            if loop is None:
+                sync_clients = sum(1 for s in self._subscribers if s.loop is None)
+                if sync_clients >= EVENTS_MAX_WSGI_CLIENTS:
+                    raise TooManySubscribers(
+                        f"Limite de {EVENTS_MAX_WSGI_CLIENTS} conexões de eventos atingido neste processo",
+                        EVENTS_RETRY_AFTER,
+                    )
+            if not self._subscribers:
+                # Sem clientes a thread não acompanha os bancos: recomeça daqui
+                self._baseline()
+            self._start()
+            # Sob o lock, a thread do hub não publica: o que for lido aqui vai
+            # até self._last_id e as próximas publicações começam depois dele
+            for event in self._resume(last_event_id):
+                subscription.put(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _baseline(self):
+        self._stats = self.item_store.stats(top=5)
+        self._last_id = self.item_store.last_id()
+        self._jobs_since = time.time()
+        self._jobs_seen = {}
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+            self._thread.start()
+
+    def _resume(self, last_event_id):
+        events = []
+        if last_event_id is not None and last_event_id != self._last_id:
+            if last_event_id > self._last_id:
+                events.append(format_event("clear", {}))
+                last_event_id = 0
+            rows = list(self.item_store.iter_rows(after_id=last_event_id, limit=EVENTS_MAX_ROWS + 1))
+            rows = [(row_id, row) for row_id, row in rows if row_id <= self._last_id]
+            if len(rows) > EVENTS_MAX_ROWS:
+                events.append(format_event("reset", {"last_id": self._last_id}, self._last_id))
+            elif rows:
+                events.append(format_event("rows", {"rows": [row for _, row in rows],
+                                                    "last_id": self._last_id}, self._last_id))
+        events.append(format_event("hello", {"last_id": self._last_id}, self._last_id))
+        events.append(format_event("stats", {"stats": self._stats, "delta": {}}))
+        return events
+
+    def _publish(self, event):
+        for subscription in list(self._subscribers):
+            try:
+                subscription.put(event)
+            except RuntimeError:  # loop do cliente já encerrado
+                self._subscribers.discard(subscription)
+
+    def _run(self):
+        items_conn = sqlite3.connect(self.item_store.path, timeout=30)
+        self.job_store.init()
+        jobs_conn = sqlite3.connect(self.job_store.path, timeout=30)
+        items_version = jobs_version = None
+        while True:
+            time.sleep(self.interval)
+            if not self._subscribers:
+                continue
+            try:
+                version = items_conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != items_version:
+                    items_version = version
+                    with self._lock:
+                        self._publish_items()
+                version = jobs_conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != jobs_version:
+                    jobs_version = version
+                    with self._lock:
+                        self._publish_jobs()
+            except Exception as e:
+                logger.error(f"Erro ao publicar eventos: {str(e)}")
+
+    def _publish_items(self):
+        stats = self.item_store.stats(top=5)
+        last_id = self.item_store.last_id()
+        previous = self._stats
+        if stats == previous and last_id == self._last_id:
+            return
+        if last_id < self._last_id or stats["total_items"] < previous["total_items"]:
+            self._publish(format_event("clear", {}))
+            self._last_id = 0
+
+        rows = list(self.item_store.iter_rows(after_id=self._last_id, limit=EVENTS_MAX_ROWS + 1))
+        if len(rows) > EVENTS_MAX_ROWS:
+            self._last_id = last_id
+            self._publish(format_event("reset", {"last_id": last_id}, last_id))
+        elif rows:
+            self._last_id = rows[-1][0]
+            self._publish(format_event("rows", {"rows": [row for _, row in rows],
+                                                "last_id": self._last_id}, self._last_id))
+
+        delta = {field: stats[field] - previous[field] for field in STATS_DELTA_FIELDS}
+        self._stats = stats
+        self._publish(format_event("stats", {"stats": stats, "delta": delta}))
+
+    def _publish_jobs(self):
+        jobs = self.job_store.updates_since(self._jobs_since - JOB_CLOCK_SKEW)
+        for job in jobs.values():
+            # A janela de folga relê URLs já enviadas; só publica o que mudou
+            changed = [url for url in job["urls"]
+                       if self._jobs_seen.get((job["id"], url["position"])) != url["updated_at"]]
+            for url in changed:
+                self._jobs_seen[(job["id"], url["position"])] = url["updated_at"]
+                self._jobs_since = max(self._jobs_since, url["updated_at"])
+            if changed:
+                job["urls"] = changed
+                self._publish(format_event("job", job))
+
+        horizon = self._jobs_since - JOB_CLOCK_SKEW
+        self._jobs_seen = {key: updated for key, updated in self._jobs_seen.items() if updated > horizon}
@@ -0,0 +1,499 @@
+"""
+NFCe Web Reader - Fila durável de processamento
+Cada URL submetida vira uma linha em SQLite; um pool de workers drena a
+fila, reprocessa falhas transitórias e grava o resultado de cada URL.
+Qualquer worker do gunicorn consegue responder o status de um job.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from crawl_engine import CircuitOpenError, CrawlError
+from nfceReader import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, cada pool drena a fila
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB = os.environ.get('JOBS_DB', 'nfce_jobs.db')
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# Tentativas por URL e atraso base do backoff exponencial (segundos)
+MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+RETRY_BASE_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 5))
+# Após esse tempo em "running" a URL volta para a fila (worker morto)
+LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+# Intervalo com que um pool de reserva tenta assumir a fila (s)
+DRAIN_LOCK_RETRY = float(os.environ.get('JOB_DRAIN_LOCK_RETRY', 5))
+
+
+class JobStore:
+    """Persistência dos jobs e da fila de URLs"""
+
+    def __init__(self, path=JOBS_DB):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init(self):
+        """Cria as tabelas se não existirem"""
+        if self._initialized:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    total INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS job_urls (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    message TEXT NOT NULL DEFAULT '',
+                    items TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    claimed_at REAL,
+                    updated_at REAL NOT NULL,
+                    timings TEXT,
+                    PRIMARY KEY (job_id, position)
+                );
+                CREATE INDEX IF NOT EXISTS idx_job_urls_queue
+                    ON job_urls (status, next_attempt_at);
+                CREATE INDEX IF NOT EXISTS idx_job_urls_updated
+                    ON job_urls (updated_at);
+                CREATE TABLE IF NOT EXISTS flags (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+            # Bancos criados antes dos tempos por etapa
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(job_urls)")}
+            if "timings" not in columns:
+                conn.execute("ALTER TABLE job_urls ADD COLUMN timings TEXT")
+        finally:
+            conn.close()
+        self._initialized = True
+
+    def create_job(self, urls):
+        """Enfileira todas as URLs de um job e devolve o id"""
+        self.init()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN")
+                conn.execute("INSERT INTO jobs (id, created_at, total) VALUES (?, ?, ?)",
+                             (job_id, now, len(urls)))
+                conn.executemany(
+                    "INSERT INTO job_urls (job_id, position, url, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(job_id, position, url, STATUS_PENDING, now) for position, url in enumerate(urls)]
+                )
+        finally:
+            conn.close()
+        return job_id
+
+    def claim(self):
+        """Reserva a próxima URL pronta da fila, ou None se não houver"""
+        self.init()
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE serializa a reserva entre processos
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT job_id, position, url, attempts, updated_at, next_attempt_at FROM job_urls "
+                "WHERE status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (STATUS_PENDING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE job_urls SET status = ?, attempts = attempts + 1, claimed_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND position = ?",
+                (STATUS_RUNNING, now, now, row['job_id'], row['position'])
+            )
+            conn.execute("COMMIT")
+            return {
+                "job_id": row['job_id'],
+                "position": row['position'],
+                "url": row['url'],
+                "attempts": row['attempts'] + 1,
+                # Desde quando a URL está pronta para rodar (espera na fila)
+                "ready_at": max(row['updated_at'], row['next_attempt_at'])
+            }
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, task, items, message="NFCe processada com sucesso", timings=None):
+        """Grava o resultado de uma URL processada (e o tempo de cada etapa, em ms)"""
+        self._update(task, STATUS_DONE, message, items, timings=timings)
+
+    def fail(self, task, message, transient=True, timings=None):
+        """Reagenda a URL com backoff ou marca como falha definitiva"""
+        if transient and task['attempts'] < MAX_ATTEMPTS:
+            delay = RETRY_BASE_DELAY * 2 ** (task['attempts'] - 1)
+            self._update(task, STATUS_PENDING, message, next_attempt_at=time.time() + delay, timings=timings)
+        else:
+            self._update(task, STATUS_FAILED, message, timings=timings)
+
+    def defer(self, task, message, delay, timings=None):
+        """Devolve a URL à fila sem contar a tentativa (portal fora do ar)"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE job_urls SET status = ?, message = ?, attempts = MAX(attempts - 1, 0), "
+                "next_attempt_at = ?, updated_at = ?, timings = ? WHERE job_id = ? AND position = ?",
+                (STATUS_PENDING, message, time.time() + delay, time.time(),
+                 json.dumps(timings) if timings is not None else None, task['job_id'], task['position'])
+            )
+        finally:
+            conn.close()
+
+    def _update(self, task, status, message='', items=None, next_attempt_at=0, timings=None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE job_urls SET status = ?, message = ?, items = ?, next_attempt_at = ?, updated_at = ?, "
+                "timings = ? WHERE job_id = ? AND position = ?",
+                (status, message, json.dumps(items, ensure_ascii=False) if items is not None else None,
+                 next_attempt_at, time.time(), json.dumps(timings) if timings is not None else None,
+                 task['job_id'], task['position'])
+            )
+        finally:
+            conn.close()
+
+    def set_flag(self, name, value):
+        """Grava um contador compartilhado entre os processos (ex.: requests a perfilar)"""
+        self.init()
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO flags (name, value) VALUES (?, ?)", (name, value))
+        finally:
+            conn.close()
+
+    def get_flag(self, name):
+        self.init()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM flags WHERE name = ?", (name,)).fetchone()
+            return row['value'] if row else 0
+        finally:
+            conn.close()
+
+    def take_flag(self, name):
+        """Consome uma unidade do contador; retorna (conseguiu, quanto restou)"""
+        self.init()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            taken = conn.execute(
+                "UPDATE flags SET value = value - 1 WHERE name = ? AND value > 0", (name,)
+            ).rowcount == 1
+            row = conn.execute("SELECT value FROM flags WHERE name = ?", (name,)).fetchone()
+            conn.execute("COMMIT")
+            return taken, row['value'] if row else 0
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def requeue_stale(self, lease=LEASE_SECONDS):
+        """Devolve à fila URLs presas em "running" por workers que morreram"""
+        self.init()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE job_urls SET status = ?, updated_at = ? WHERE status = ? AND claimed_at < ?",
+                (STATUS_PENDING, time.time(), STATUS_RUNNING, time.time() - lease)
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def pending_count(self):
+        """Quantidade de URLs aguardando na fila"""
+        self.init()
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM job_urls WHERE status = ?", (STATUS_PENDING,)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def status_counts(self):
+        """Quantidade de URLs em cada status"""
+        self.init()
+        conn = self._connect()
+        try:
+            counts = {STATUS_PENDING: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+            counts.update(conn.execute("SELECT status, COUNT(*) FROM job_urls GROUP BY status").fetchall())
+            return counts
+        finally:
+            conn.close()
+
+    def updates_since(self, since):
+        """URLs alteradas depois de `since` (updated_at) e o progresso dos jobs delas.
+
+        Retorna {job_id: {"id", "total", contagens por status, "finished",
+        "urls": [url alterada com position e updated_at]}}.
+        """
+        self.init()
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT job_id, position, url, status, message, attempts, updated_at FROM job_urls "
+                "WHERE updated_at > ? ORDER BY updated_at", (since,)
+            ).fetchall()
+            jobs = {}
+            for row in rows:
+                job = jobs.get(row['job_id'])
+                if job is None:
+                    job = jobs[row['job_id']] = {"id": row['job_id'], "urls": []}
+                job["urls"].append({key: row[key] for key in
+                                    ("position", "url", "status", "message", "attempts", "updated_at")})
+            for job_id, job in jobs.items():
+                counts = {STATUS_PENDING: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+                counts.update(conn.execute(
+                    "SELECT status, COUNT(*) FROM job_urls WHERE job_id = ? GROUP BY status", (job_id,)
+                ).fetchall())
+                job["total"] = sum(counts.values())
+                job["finished"] = counts[STATUS_DONE] + counts[STATUS_FAILED] == job["total"]
+                job.update(counts)
+        finally:
+            conn.close()
+        return jobs
+
+    def get_job(self, job_id):
+        """Retorna o job com o progresso por URL, ou None se não existir"""
+        self.init()
+        conn = self._connect()
+        try:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            rows = conn.execute(
+                "SELECT * FROM job_urls WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        counts = {STATUS_PENDING: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+        urls = []
+        for row in rows:
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+            urls.append({
+                "url": row['url'],
+                "status": row['status'],
+                "message": row['message'],
+                "attempts": row['attempts'],
+                "items": json.loads(row['items']) if row['items'] else [],
+                # Duração de cada etapa da última tentativa (ms)
+                "timings": json.loads(row['timings']) if row['timings'] else {}
+            })
+
+        return {
+            "id": job['id'],
+            "created_at": job['created_at'],
+            "total": job['total'],
+            "finished": counts[STATUS_DONE] + counts[STATUS_FAILED] == job['total'],
+            **counts,
+            "urls": urls
+        }
+
+
+class DrainLock:
+    """Trava de quem drena a fila de um banco de jobs.
+
+    Os limites por host SEFAZ valem por processo; com um único processo
+    drenando (entre os workers do gunicorn e o worker.py que enxergam o
+    mesmo banco) o portal recebe uma cota só. A trava (flock) fica num
+    arquivo ao lado do banco e o sistema a solta quando o processo morre.
+    """
+
+    def __init__(self, path=JOBS_DB):
+        self.path = f"{path}.drain"
+        self._file = None
+
+    def acquire(self):
+        """Tenta assumir a fila sem bloquear; True se este processo a drena"""
+        if fcntl is None or self._file is not None:
+            return True
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+
+class WorkerPool:
+    """Drena a fila com até `size` crawls simultâneos no motor em processo.
+
+    O resultado de cada crawl é gravado numa thread própria: no motor em
+    processo o Future é resolvido na thread do reactor, que não pode
+    esperar por escritas no SQLite sem atrasar todos os crawls.
+
+    Com `drain_lock`, o pool só despacha enquanto tiver a trava; sem ela
+    fica de reserva e assume quando o processo que drena morrer.
+    """
+
+    def __init__(self, engine, store, size=4, timeout=30, poll_interval=1.0, note_index=None, drain_lock=None):
+        self.engine = engine
+        self.store = store
+        self.note_index = note_index
+        self.drain_lock = drain_lock
+        self.size = size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._slots = threading.BoundedSemaphore(size)
+        self._finisher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="job-finish")
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Inicia a thread de despacho (idempotente)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="job-dispatcher", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _wait_drain_lock(self):
+        if self.drain_lock is None or self.drain_lock.acquire():
+            return
+        logger.info("Outro processo drena a fila; este pool fica de reserva")
+        while not self._stop.wait(DRAIN_LOCK_RETRY):
+            if self.drain_lock.acquire():
+                logger.info("Pool assumiu a fila")
+                return
+
+    def _run(self):
+        self._wait_drain_lock()
+        last_requeue = 0
+        while not self._stop.is_set():
+            try:
+                if time.time() - last_requeue > LEASE_SECONDS / 10:
+                    requeued = self.store.requeue_stale()
+                    if requeued:
+                        logger.warning(f"{requeued} URL(s) devolvidas à fila após expirar a reserva")
+                    last_requeue = time.time()
+
+                if not self._slots.acquire(timeout=self.poll_interval):
+                    continue
+                if not self._dispatch():
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                logger.error(f"Erro no despacho da fila: {str(e)}")
+                self._stop.wait(self.poll_interval)
+
+    def _dispatch(self):
+        """Reserva uma URL e entrega ao motor com a vaga já adquirida.
+
+        A vaga passa para o _finish quando o crawl é entregue; em qualquer
+        outro caminho (fila vazia, nota repetida, erro no SQLite ou no
+        motor) é devolvida aqui. Retorna False se a fila estava vazia.
+        """
+        handed_off = False
+        try:
+            task = self.store.claim()
+            if task is None:
+                return False
+            task['queue_wait'] = time.time() - task['ready_at']
+            metrics.CRAWL_STAGE.labels("queue_wait").observe(task['queue_wait'])
+
+            # Outro job pode ter ingerido a mesma nota enquanto esta esperava
+            if self._already_ingested(task):
+                return True
+
+            try:
+                future = self.engine.submit(task['url'], timeout=self.timeout)
+            except Exception as e:
+                self.store.fail(task, str(e))
+                raise
+            future.add_done_callback(partial(self._finish_later, task, time.monotonic()))
+            handed_off = True
+            return True
+        finally:
+            if not handed_off:
+                self._slots.release()
+
+    def _already_ingested(self, task):
+        if self.note_index is None:
+            return False
+        if self.note_index.contains_url(task['url']):
+            self.store.complete(task, [], "NFCe já processada anteriormente")
+            metrics.CRAWLS.labels("duplicate").inc()
+            return True
+        return False
+
+    def _finish_later(self, task, submitted, future):
+        # Duração medida aqui, sem a espera pela thread de gravação; a vaga
+        # só volta quando o resultado estiver gravado
+        self._finisher.submit(self._finish, task, time.monotonic() - submitted, future)
+
+    def _finish(self, task, elapsed, future):
+        metrics.CRAWL_STAGE.labels("crawl").observe(elapsed)
+        # Etapas em ms: espera na fila, as medidas pelo Scrapy (só no motor
+        # em processo) e o crawl inteiro (total)
+        timings = {"queue_wait": task['queue_wait'], **getattr(future, "timings", {}), "total": elapsed}
+        timings = {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+        try:
+            items = future.result()
+            outcome = "success" if items else "empty"
+            self.store.complete(task, items, timings=timings)
+        except CircuitOpenError as e:
+            # Falha rápida do disjuntor: reagenda para quando o circuito reabrir
+            outcome = "circuit_open"
+            logger.warning(f"Job {task['job_id']} adiado: {str(e)}")
+            self.store.defer(task, str(e), max(e.retry_after, RETRY_BASE_DELAY), timings=timings)
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                outcome = "timeout"
+            else:
+                outcome = e.cause if isinstance(e, CrawlError) else "error"
+            message = str(e) or "Timeout ao processar NFCe"
+            logger.error(f"Erro no job {task['job_id']} (tentativa {task['attempts']}): {message}")
+            self.store.fail(task, message, timings=timings)
+        finally:
+            self._slots.release()
+        metrics.CRAWLS.labels(outcome).inc()
+        logger.info(json.dumps({
+            "event": "crawl", "job_id": task['job_id'], "position": task['position'], "url": task['url'],
+            "attempt": task['attempts'], "outcome": outcome, "timings_ms": timings
+        }, ensure_ascii=False))
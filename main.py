@@ -1,26 +1,20 @@
 import cv2
 from pyzbar import pyzbar
 import subprocess
-import csv
 import os
+import sys
 import time
 
+# Índice de notas já ingeridas (projeto Scrapy em nfceReader/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "nfceReader"))
+from nfceReader.notes import NoteIndex, extract_access_key
+
 # Configurações
 cap = cv2.VideoCapture(1) 
 reset_delay = 5 
 last_read_time = 0
-csv_file = "nfc_data.csv"
-
-def init_csv():
-    # Cria o arquivo com cabeçalho se ele não existir
-    if not os.path.exists(csv_file):
-        with open(csv_file, mode="w", newline="", encoding="utf-8-sig") as f:
-            writer = csv.writer(f, delimiter=';')
-            # Nova coluna "Desconto" adicionada ao final
-            writer.writerow(["Estabelecimento", "Produto", "Quantidade", "Unidade", "Valor_Total", "Desconto"])
-        print("[*] Planilha inicializada com a coluna Desconto.")
-
-init_csv()
+note_index = NoteIndex()
+
 print("Iniciando leitor... Pressione 'q' para sair.")
 
 while True:
@@ -35,19 +29,25 @@ while True:
         url = qrcode.data.decode('utf-8')
         
         if current_time - last_read_time > reset_delay:
-            print(f"[+] Lendo Nota Fiscal...")
             last_read_time = current_time
 
+            # Nota já ingerida: não precisa acessar a SEFAZ de novo
+            chave = extract_access_key(url)
+            if chave and note_index.contains(chave):
+                print(f"[=] Nota {chave} já registrada, ignorando.")
+                continue
+
+            print(f"[+] Lendo Nota Fiscal...")
+
             (x, y, w, h) = qrcode.rect
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 4)
 
-            # Proteção da URL com aspas para o Windows não travar no caractere '|'
-            comando = f'scrapy crawl nfcedata -a url="{url}"'
+            # Sem shell: o '|' e qualquer outro caractere da URL chegam ao spider como texto
+            comando = [sys.executable, "-m", "scrapy", "crawl", "nfcedata", "-a", f"url={url}"]
             
             subprocess.Popen(
                 comando,
-                cwd="nfceReader/",
-                shell=True
+                cwd="nfceReader/"
             )
 
     cv2.imshow("Leitor NFCe", frame)
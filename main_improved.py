@@ -4,26 +4,50 @@ Funcionalidades:
 - Leitura em Tela Cheia (Detecta em qualquer lugar)
 - Filtros de realce (Nitidez/Contraste) automáticos
 - Integração com Scrapy
+- Pipeline em threads: captura, detecção e tela em ritmos independentes
+- Detecção em camadas: passe barato primeiro, realce pesado só no recorte
+- Rastreamento do QR entre frames (fluxo óptico): processa só a região dele
+- Controlador adaptativo: escalas, técnicas e realce ajustados ao FPS alvo
 """
 
 import cv2
+import json
 import numpy as np
 import subprocess
-import csv
 import os
 import time
 import threading
 import re
+import sys
+from collections import Counter, deque
 from dataclasses import dataclass
-from typing import Tuple, Dict, Any, Optional
+from typing import Tuple, Dict, Any, Optional, List
 from qreader import QReader
 
+try:
+    from pyzbar import pyzbar
+    from pyzbar.pyzbar import ZBarSymbol
+except ImportError:  # pyzbar sem a libzbar do sistema também cai aqui
+    pyzbar = None
+# Helpers privados do qrdet (versão fixada em requirements.txt); em outra
+# versão a inferência em lote cai para uma chamada do QReader por nível
+try:
+    from qrdet._qrdet_helpers import _prepare_input, _yolo_v8_results_to_dict
+except ImportError as e:
+    _yolo_v8_results_to_dict = None
+    _QRDET_IMPORT_ERROR = str(e)
+else:
+    _QRDET_IMPORT_ERROR = None
+
+# Índice de notas já ingeridas (projeto Scrapy em nfceReader/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "nfceReader"))
+from nfceReader.notes import NoteIndex, extract_access_key
+
 # ================= CONFIGURAÇÕES =================
 
 @dataclass
 class Config:
     camera_index: int = 1  # 0 = Webcam Integrada, 1 = USB/Externa
-    csv_file: str = "nfc_data.csv"
     scrapy_folder: str = "nfceReader/"
     
     # Delay para evitar leituras duplicadas (em segundos)
@@ -31,9 +55,11 @@ class Config:
     
     # Processamento de Imagem Avançado
     sharpen_strength: float = 2.0  # Mais agressivo
-    use_adaptive_processing: bool = True
+    use_adaptive_processing: bool = True  # Controlador adaptativo: orçamento da detecção pesada segue o fps_target
     use_multiscale_detection: bool = True
     scales: Tuple[float, ...] = (0.5, 0.75, 1.0, 1.25, 1.5, 2.0)  # Escalas para QR pequenos
+    pyramid_max_tiles: int = 8  # Recortes da pirâmide por imagem, além da imagem inteira
+    nms_iou: float = 0.5  # Sobreposição (IoU) a partir da qual duas detecções são o mesmo QR
     use_upscaling: bool = True  # Upscale para cédulas pequenas
     upscale_factor: float = 2.0  # 2x upscaling para cores pequenas
     
@@ -42,7 +68,28 @@ class Config:
     cam_height: int = 1080
     
     # Performance
-    fps_target: int = 30  # FPS alvo da câmera
+    fps_target: int = 30  # FPS alvo da câmera (e da detecção, para o controlador adaptativo)
+    adapt_interval: float = 2.0  # Janela (s) entre ajustes do orçamento
+    stats_file: str = "detector_stats.json"  # Perfil aprendido da estação ("" = não persiste)
+    # Detecção em camadas: "tiered" roda o passe barato (frame reduzido em
+    # cinza + movimento) e só leva ao realce pesado o recorte de um candidato
+    # que ele não conseguiu ler; "full" realça e varre o frame inteiro sempre
+    detection_mode: str = "tiered"
+    fast_max_side: int = 960  # Lado maior do frame reduzido do passe barato
+    motion_threshold: int = 25  # Diferença de um pixel (0-255) que conta como movimento
+    motion_min_area: float = 0.002  # Fração do frame que precisa mudar
+    roi_margin: float = 0.3  # Margem em volta do candidato no recorte
+    full_scan_interval: float = 0.0  # Varredura pesada do frame inteiro, no máximo a cada N s (0 = nunca)
+    # Rastreamento: a região do QR acompanha o cupom por fluxo óptico e, com
+    # o rastreio confiável, só o recorte é processado
+    use_tracking: bool = True
+    track_redetect_interval: float = 1.0  # Passe barato no frame inteiro para confirmar/recuperar o rastreio (s)
+    track_min_points: int = 8  # Pontos rastreados abaixo disso = rastreio perdido
+    track_min_ratio: float = 0.5  # Fração mínima dos pontos que sobrevive de um frame ao outro
+    track_max_error: float = 1.0  # Erro máximo (px) da volta do fluxo óptico (forward-backward)
+    track_max_misses: int = 2  # Confirmações seguidas sem achar o QR antes de soltar o rastreio
+    overlay_ttl: float = 1.5  # Segundos que as marcações da última detecção ficam na tela
+    stats_interval: float = 5.0  # Intervalo do resumo do pipeline no console (0 = desliga)
 
 @dataclass
 class AppState:
@@ -61,6 +108,581 @@ COLORS = {
     'WHITE': (255, 255, 255)
 }
 
+@dataclass
+class Overlay:
+    """Marcação de uma detecção, em coordenadas do frame da câmera"""
+    bbox: Tuple[int, int, int, int]
+    color: Tuple[int, int, int]
+    label: str
+    decoded: bool = False
+
+class FrameSlot:
+    """Guarda só o frame mais recente: quem lê sempre recebe o último capturado.
+
+    Cada frame ganha um número de sequência; o consumidor que pula números
+    sabe quantos frames foram descartados por ele.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+
+    def put(self, frame: np.ndarray):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, after: int = 0, timeout: Optional[float] = None) -> Tuple[int, Optional[np.ndarray]]:
+        """Espera um frame mais novo que `after`; retorna (seq, frame) ou (after, None) no timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after, timeout):
+                return after, None
+            return self._seq, self._frame
+
+class StageMeter:
+    """FPS (janela deslizante) e frames descartados de um estágio do pipeline"""
+
+    def __init__(self, window: float = 2.0):
+        self.window = window
+        self.dropped = 0
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def tick(self, dropped: int = 0):
+        now = time.monotonic()
+        with self._lock:
+            self.dropped += dropped
+            self._times.append(now)
+            while now - self._times[0] > self.window:
+                self._times.popleft()
+
+    def fps(self) -> float:
+        with self._lock:
+            # Sem frames recentes (estágio parado) o FPS cai para zero
+            if len(self._times) < 2 or time.monotonic() - self._times[-1] > self.window:
+                return 0.0
+            return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+def expand_box(bbox, margin: float, shape) -> Tuple[int, int, int, int]:
+    """Caixa (x1, y1, x2, y2) com `margin` de cada lado, limitada à imagem"""
+    x1, y1, x2, y2 = bbox
+    h, w = shape[:2]
+    mx, my = (x2 - x1) * margin, (y2 - y1) * margin
+    return (max(0, int(x1 - mx)), max(0, int(y1 - my)), min(w, int(x2 + mx)), min(h, int(y2 + my)))
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> List[int]:
+    """Índices das caixas (N x 4, xyxy) mantidas, da mais confiante para a menos.
+
+    Cada caixa mantida descarta de uma vez, em NumPy, todas as restantes que
+    a sobrepõem além de `iou_threshold`.
+    """
+    x1, y1, x2, y2 = boxes.T
+    areas = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(int(best))
+        width = np.maximum(0, np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]))
+        height = np.maximum(0, np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]))
+        inter = width * height
+        union = areas[best] + areas[rest] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        order = rest[iou <= iou_threshold]
+    return keep
+
+class FastDetector:
+    """Passe barato: frame reduzido em cinza, checagem de movimento e leitura rápida.
+
+    Lê com o pyzbar se estiver instalado e localiza candidatos com o
+    cv2.QRCodeDetector (padrões de posição), ambos em milissegundos. Sem o
+    pyzbar, o OpenCV lê um QR Code por imagem (o do cupom): as variantes
+    "Multi" dele perdem com frequência um código sozinho na cena.
+    """
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.detector = cv2.QRCodeDetector()
+        self._previous = None
+        self._settled_scanned = False
+
+    def prepare(self, frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        """Frame em cinza com lado maior até fast_max_side, e o fator para voltar ao original."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        factor = min(1.0, self.cfg.fast_max_side / max(gray.shape))
+        if factor < 1.0:
+            gray = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+        return gray, factor
+
+    def should_scan(self, small: np.ndarray) -> bool:
+        """Há movimento, ou a cena acabou de parar e ainda não foi lida parada."""
+        blurred = cv2.GaussianBlur(small, (5, 5), 0)
+        previous, self._previous = self._previous, blurred
+        moved = True
+        if previous is not None and previous.shape == blurred.shape:
+            _, changed = cv2.threshold(cv2.absdiff(blurred, previous), self.cfg.motion_threshold, 255, cv2.THRESH_BINARY)
+            moved = cv2.countNonZero(changed) > self.cfg.motion_min_area * changed.size
+        if moved:
+            self._settled_scanned = False
+            return True
+        if not self._settled_scanned:
+            # Cupom parado na frente da câmera: o frame mais nítido, vale uma leitura
+            self._settled_scanned = True
+            return True
+        return False
+
+    def scan(self, gray: np.ndarray) -> Tuple[List[Tuple[str, tuple]], List[tuple]]:
+        """Lê e localiza: ([(texto, caixa)], [caixas de candidatos ilegíveis])"""
+        if pyzbar is not None:
+            found = []
+            for code in pyzbar.decode(gray, symbols=[ZBarSymbol.QRCODE]):
+                x, y, w, h = code.rect
+                found.append((code.data.decode('utf-8', errors='replace'), (x, y, x + w, y + h)))
+            if found:
+                return found, []
+            ok, points = self.detector.detect(gray)
+            return [], [self._box(points)] if ok and points is not None else []
+        text, points, _ = self.detector.detectAndDecode(gray)
+        if points is None:
+            return [], []
+        box = self._box(points)
+        return ([(text, box)], []) if text else ([], [box])
+
+    @staticmethod
+    def _box(points: np.ndarray) -> Tuple[float, float, float, float]:
+        quad = points.reshape(-1, 2)
+        (x1, y1), (x2, y2) = quad.min(axis=0), quad.max(axis=0)
+        return (float(x1), float(y1), float(x2), float(y2))
+
+class PyramidDetector:
+    """Pirâmide de escalas do QReader montada uma vez e detectada numa inferência em lote.
+
+    O YOLO do QReader reduz toda entrada a IMGSZ px (letterbox), então
+    escalas em que a imagem inteira cabe nisso dariam a mesma entrada: viram
+    uma passada só. Nas maiores, a imagem é cortada em recortes de IMGSZ px
+    com sobreposição, que é o que de fato aumenta a resolução para QR
+    pequenos. Com o modelo exposto pelo qrdet, todos os níveis vão numa
+    única chamada ao predict; senão, uma chamada do QReader por nível.
+    """
+
+    IMGSZ = 640
+    TILE_OVERLAP = 0.25
+    # Chaves do qrdet em pixels: pontos (x, y) e tamanhos (w, h)
+    POINT_KEYS = ('bbox_xyxy', 'cxcy', 'polygon_xy', 'quad_xy', 'padded_quad_xy')
+    SIZE_KEYS = ('wh',)
+
+    def __init__(self, qreader, cfg: Config):
+        self.qreader = qreader
+        self.cfg = cfg
+        detector = getattr(qreader, 'detector', None)
+        self.model = getattr(detector, 'model', None)
+        self.conf = getattr(detector, '_conf_th', 0.5)
+        self.iou = getattr(detector, '_nms_iou', 0.3)
+        self.batched = self.model is not None and _yolo_v8_results_to_dict is not None
+        if not self.batched:
+            reason = _QRDET_IMPORT_ERROR or "modelo do QReader não encontrado"
+            print(f"[Aviso] Inferência em lote indisponível ({reason}); detectando nível a nível. "
+                  "Confira a versão do qrdet em requirements.txt")
+        self.last_levels: List[str] = []
+
+    def plan(self, shape, scales, max_tiles: Optional[int] = None) -> List[Tuple[float, Tuple[int, int, int, int]]]:
+        """Níveis da pirâmide: [(escala, região xyxy da imagem)], a imagem inteira primeiro.
+
+        As escalas entram na ordem dada (a do controlador adaptativo: as
+        que mais leem primeiro); as que não cabem no limite de recortes ficam de fora.
+        """
+        h, w = shape[:2]
+        # A imagem inteira entra no modelo nesta escala
+        whole = self.IMGSZ / max(h, w)
+        levels = [(whole, (0, 0, w, h))]
+        budget = self.cfg.pyramid_max_tiles if max_tiles is None else max_tiles
+        for scale in dict.fromkeys(scales):
+            if scale <= whole:
+                continue
+            side = int(self.IMGSZ / scale)
+            tiles = [(x, y, min(w, x + side), min(h, y + side))
+                     for y in self._starts(h, side) for x in self._starts(w, side)]
+            if len(tiles) > budget:
+                continue
+            budget -= len(tiles)
+            levels.extend((scale, tile) for tile in tiles)
+        return levels
+
+    def _starts(self, length: int, side: int) -> List[int]:
+        if side >= length:
+            return [0]
+        count = int(np.ceil((length - side) / (side * (1 - self.TILE_OVERLAP)))) + 1
+        return [round(i * (length - side) / (count - 1)) for i in range(count)]
+
+    @staticmethod
+    def scale_key(scale: float) -> str:
+        """Nome de uma escala nas estatísticas (1.0 -> "1", como nos níveis)"""
+        return f"{scale:g}"
+
+    @staticmethod
+    def level_key(level: int, scale: float) -> str:
+        """Nome do nível nas estatísticas: a imagem inteira ou a escala dos recortes"""
+        return "inteira" if level == 0 else PyramidDetector.scale_key(scale)
+
+    def detect(self, image: np.ndarray, scales, max_tiles: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Detecções em coordenadas de `image` (RGB), sem duplicatas entre níveis.
+
+        Cada detecção leva 'scale' e 'level' (ver level_key); os níveis
+        usados ficam em `last_levels`.
+        """
+        levels = self.plan(image.shape, scales, max_tiles)
+        self.last_levels = list(dict.fromkeys(self.level_key(i, scale) for i, (scale, _) in enumerate(levels)))
+        patches = []
+        for scale, (x1, y1, x2, y2) in levels:
+            region = image[y1:y2, x1:x2]
+            if (x1, y1, x2, y2) != (0, 0, image.shape[1], image.shape[0]):
+                size = (max(1, round((x2 - x1) * scale)), max(1, round((y2 - y1) * scale)))
+                region = cv2.resize(region, size, interpolation=cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA)
+            patches.append(region)
+
+        results = None
+        if self.batched:
+            try:
+                results = self._predict(patches)
+            except Exception as e:
+                print(f"[Aviso] Inferência em lote indisponível ({e}); detectando nível a nível")
+                self.batched = False
+        if results is None:
+            results = []
+            for patch in patches:
+                try:
+                    results.append(self.qreader.detect(image=patch))
+                except Exception as e:
+                    print(f"[Aviso] Nível da pirâmide: {e}")
+                    results.append([])
+
+        detections = []
+        for i, ((scale, (x1, y1, x2, y2)), patch, found) in enumerate(zip(levels, patches, results)):
+            factor = np.array([patch.shape[1] / (x2 - x1), patch.shape[0] / (y2 - y1)])
+            for det in found:
+                if det.get('bbox_xyxy') is None:
+                    continue
+                det['level'] = self.level_key(i, scale)
+                detections.append(self._to_image(det, factor, (x1, y1), image.shape, scale))
+        if len(detections) <= 1:
+            return detections
+
+        boxes = np.array([det['bbox_xyxy'] for det in detections], dtype=np.float32)
+        scores = np.array([det['confidence'] for det in detections], dtype=np.float32)
+        return [detections[i] for i in non_max_suppression(boxes, scores, self.cfg.nms_iou)]
+
+    def _predict(self, patches: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        sources = [_prepare_input(source=patch, is_bgr=False) for patch in patches]
+        results = self.model.predict(source=sources, conf=self.conf, iou=self.iou, imgsz=self.IMGSZ,
+                                     half=False, max_det=100, agnostic_nms=True, verbose=False)
+        return [_yolo_v8_results_to_dict(results=result, image=source) for result, source in zip(results, sources)]
+
+    def _to_image(self, det: Dict[str, Any], factor: np.ndarray, origin, shape, scale: float) -> Dict[str, Any]:
+        """Leva as coordenadas de um nível para a imagem (e recalcula as normalizadas)."""
+        h, w = shape[:2]
+        for key in self.POINT_KEYS + self.SIZE_KEYS:
+            value = det.get(key)
+            if value is None:
+                continue
+            points = np.asarray(value, dtype=np.float32).reshape(-1, 2) / factor
+            if key in self.POINT_KEYS:
+                points += origin
+            det[key] = points.reshape(np.shape(value))
+            if key + 'n' in det:
+                det[key + 'n'] = (points / (w, h)).reshape(np.shape(value))
+        det['image_shape'] = (h, w)
+        det['scale'] = scale
+        det['confidence'] = float(det.get('confidence', 1.0))
+        return det
+
+class AdaptiveController:
+    """Ajusta a detecção pesada ao tempo por frame de Config.fps_target.
+
+    Conta usos e leituras por escala da pirâmide, por técnica de
+    decodificação e por etapa cara do realce (ampliação, remoção de ruído,
+    recortes da pirâmide). Escalas e técnicas vão em ordem de taxa de
+    leitura e as que nunca leram saem, salvo numa rodada de exploração a
+    cada EXPLORE_EVERY. Acima do tempo alvo, desliga a etapa que rende menos
+    leituras por segundo de custo; com folga, religa a que rende mais. Uma
+    etapa que, desligada, lê menos da metade do que lia ligada é essencial:
+    volta a ser ligada e não é mais cortada.
+    As contagens e o orçamento ficam em Config.stats_file entre execuções.
+    """
+
+    VERSION = 1
+    MIN_TRIES = 10  # Usos sem nenhuma leitura antes de descartar uma escala/técnica
+    EXPLORE_EVERY = 20  # A cada N detecções pesadas, tenta todas de novo
+    MAX_TRIES = 500  # Acima disso as contagens caem pela metade (o perfil acompanha a cena)
+    SAVE_INTERVAL = 60.0
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.stats: Dict[str, Dict[str, Dict[str, int]]] = {"scales": {}, "decode": {}, "steps": {}}
+        self.budget = {"tiles": cfg.pyramid_max_tiles, "upscale": cfg.use_upscaling, "denoise": True}
+        self.costs: Dict[str, float] = {}
+        self.calls = 0
+        self.exploring = False
+        self._frames = 0
+        self._busy = 0.0
+        self._heavy = 0
+        self._window = time.monotonic()
+        self._saved = time.monotonic()
+        self.load()
+
+    # ---- contagens ----
+
+    def record(self, group: str, key: str, hit: bool):
+        entry = self.stats[group].setdefault(key, {"tries": 0, "hits": 0})
+        entry["tries"] += 1
+        entry["hits"] += int(hit)
+        if entry["tries"] > self.MAX_TRIES:
+            entry["tries"] //= 2
+            entry["hits"] //= 2
+
+    def cost(self, step: str, seconds: float):
+        """Custo médio (móvel) de uma etapa, em segundos"""
+        previous = self.costs.get(step)
+        self.costs[step] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def _rate(self, group: str, key: str) -> float:
+        entry = self.stats[group].get(key, {"tries": 0, "hits": 0})
+        return (entry["hits"] + 1) / (entry["tries"] + 2)
+
+    def _ranked(self, group: str, keys, name=str) -> list:
+        """`keys` ordenadas pela taxa de leitura; `name` dá a chave de cada uma nas estatísticas"""
+        keys = list(keys)
+        if not self.cfg.use_adaptive_processing or self.exploring:
+            return keys
+        kept = [key for key in keys if not self._useless(group, name(key))]
+        # sorted é estável: empates ficam na ordem da configuração
+        return sorted(kept or keys, key=lambda key: -self._rate(group, name(key)))
+
+    def _useless(self, group: str, key: str) -> bool:
+        entry = self.stats[group].get(key)
+        return entry is not None and entry["tries"] >= self.MIN_TRIES and entry["hits"] == 0
+
+    # ---- plano de cada detecção pesada ----
+
+    def start_heavy(self):
+        self.calls += 1
+        self._heavy += 1
+        self.exploring = self.calls % self.EXPLORE_EVERY == 0
+
+    def scales(self) -> list:
+        # Mesma chave que o PyramidDetector registra ("1", não "1.0")
+        return self._ranked("scales", sorted(self.cfg.scales), PyramidDetector.scale_key)
+
+    def decode_steps(self, steps) -> list:
+        return self._ranked("decode", steps)
+
+    # ---- orçamento ----
+
+    def observe_frame(self, seconds: float):
+        """Tempo de um frame na thread de detecção; ajusta o orçamento a cada adapt_interval."""
+        self._frames += 1
+        self._busy += seconds
+        now = time.monotonic()
+        if now - self._window < self.cfg.adapt_interval:
+            return
+        frame_time, heavy = self._busy / self._frames, self._heavy
+        self._frames, self._busy, self._heavy, self._window = 0, 0.0, 0, now
+        if self.cfg.use_adaptive_processing:
+            target = 1.0 / self.cfg.fps_target
+            if self._restore_essential():
+                pass
+            elif frame_time > target * 1.1:
+                self._adjust(lower=True)
+            elif frame_time < target * 0.7 and heavy:
+                # Só sobe com detecção pesada na janela: cena vazia é sempre rápida
+                self._adjust(lower=False)
+        if now - self._saved >= self.SAVE_INTERVAL:
+            self.save()
+
+    def _score(self, step: str) -> float:
+        """Leituras por segundo de custo da etapa"""
+        return self._rate("steps", step) / max(self.costs.get(step, 0.0), 1e-3)
+
+    def record_step(self, step: str, enabled: bool, hit: bool):
+        """Leitura (ou não) de uma detecção pesada com a etapa ligada ou desligada"""
+        self.record("steps", step if enabled else f"sem {step}", hit)
+
+    def _essential(self, step: str) -> bool:
+        entry = self.stats["steps"].get(f"sem {step}")
+        if entry is None or entry["tries"] < self.MIN_TRIES:
+            return False
+        return self._rate("steps", f"sem {step}") < 0.5 * self._rate("steps", step)
+
+    def _restore_essential(self) -> bool:
+        for step in ("upscale", "denoise", "tiles"):
+            if not self.budget[step] and self._essential(step) and (step != "upscale" or self.cfg.use_upscaling):
+                self.budget[step] = 1 if step == "tiles" else True
+                print(f"[Adaptativo] Etapa essencial religada ({step}): {self.summary()}")
+                return True
+        return False
+
+    def _adjust(self, lower: bool):
+        budget = self.budget
+        if lower:
+            options = [step for step in ("tiles", "upscale", "denoise") if budget[step] and not self._essential(step)]
+        else:
+            options = [step for step, can in (
+                ("tiles", budget["tiles"] < self.cfg.pyramid_max_tiles),
+                ("upscale", not budget["upscale"] and self.cfg.use_upscaling),
+                ("denoise", not budget["denoise"]),
+            ) if can]
+        if not options:
+            return
+        step = (min if lower else max)(options, key=self._score)
+        if step == "tiles":
+            budget["tiles"] = budget["tiles"] // 2 if lower else min(self.cfg.pyramid_max_tiles, max(1, budget["tiles"] * 2))
+        else:
+            budget[step] = not lower
+        print(f"[Adaptativo] {'Reduzindo' if lower else 'Ampliando'} ({step}): {self.summary()}")
+
+    def summary(self) -> str:
+        budget = self.budget
+        scales = ", ".join(f"{scale:g}" for scale in self.scales()) or "-"
+        return (f"recortes {budget['tiles']}, ampliação {'sim' if budget['upscale'] else 'não'}, "
+                f"ruído {'sim' if budget['denoise'] else 'não'} | escalas {scales}")
+
+    # ---- persistência ----
+
+    def load(self):
+        path = self.cfg.stats_file
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding="utf-8") as source:
+                data = json.load(source)
+            if data.get("version") != self.VERSION:
+                return
+            for group in self.stats:
+                self.stats[group].update(data.get("stats", {}).get(group, {}))
+            self.costs.update(data.get("costs", {}))
+            budget = data.get("budget", {})
+            self.budget["tiles"] = min(int(budget.get("tiles", self.budget["tiles"])), self.cfg.pyramid_max_tiles)
+            self.budget["upscale"] = bool(budget.get("upscale", self.budget["upscale"])) and self.cfg.use_upscaling
+            self.budget["denoise"] = bool(budget.get("denoise", self.budget["denoise"]))
+            print(f"[Adaptativo] Perfil carregado de {path}: {self.summary()}")
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"[Aviso] Perfil {path} ignorado: {e}")
+
+    def save(self):
+        self._saved = time.monotonic()
+        path = self.cfg.stats_file
+        if not path:
+            return
+        data = {"version": self.VERSION, "budget": self.budget, "costs": self.costs, "stats": self.stats}
+        try:
+            # Arquivo temporário + replace: uma queda no meio não corrompe o perfil
+            with open(path + ".tmp", "w", encoding="utf-8") as output:
+                json.dump(data, output, ensure_ascii=False, indent=1)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"[Aviso] Não foi possível salvar o perfil em {path}: {e}")
+
+class RoiTracker:
+    """Acompanha a região de um QR Code entre frames com fluxo óptico (Lucas-Kanade).
+
+    Trabalha no frame reduzido do passe barato: cantos achados dentro da
+    caixa são seguidos de um frame ao outro e a caixa anda com o
+    deslocamento mediano (e a escala mediana) dos que passam na checagem de
+    ida e volta. Custa ~1-2 ms, contra dezenas de ms do passe barato.
+    """
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.reset()
+
+    @property
+    def active(self) -> bool:
+        return self.box is not None
+
+    def reset(self):
+        self.box: Optional[Tuple[float, float, float, float]] = None
+        self.decoded = False
+        self.points = None
+        self.previous = None
+        self.initial = 0
+        self.checked = 0.0
+        self.misses = 0
+
+    def start(self, small: np.ndarray, box, decoded: bool = False) -> bool:
+        """Passa a rastrear `box` (coordenadas do frame reduzido); False se não houver pontos."""
+        points = self._features(small, box)
+        if points is None:
+            self.reset()
+            return False
+        self.box = tuple(float(coord) for coord in box)
+        self.decoded = decoded
+        self.points, self.previous, self.initial = points, small, len(points)
+        self.checked = time.monotonic()
+        self.misses = 0
+        return True
+
+    def update(self, small: np.ndarray) -> bool:
+        """Move a caixa até o frame atual; False (e rastreio solto) se ela se perdeu."""
+        if self.previous is None or self.previous.shape != small.shape:
+            self.reset()
+            return False
+        params = dict(winSize=(21, 21), maxLevel=3)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.previous, small, self.points, None, **params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(small, self.previous, moved, None, **params)
+        error = np.linalg.norm((self.points - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.cfg.track_max_error)
+        kept = int(good.sum())
+        if kept < self.cfg.track_min_points or kept < self.cfg.track_min_ratio * len(self.points):
+            self.reset()
+            return False
+
+        old, new = self.points.reshape(-1, 2)[good], moved.reshape(-1, 2)[good]
+        dx, dy = np.median(new - old, axis=0)
+        # Escala: razão mediana das distâncias ao centro (cupom se aproximando)
+        old_dist = np.linalg.norm(old - np.median(old, axis=0), axis=1)
+        new_dist = np.linalg.norm(new - np.median(new, axis=0), axis=1)
+        spread = old_dist > 1
+        scale = float(np.median(new_dist[spread] / old_dist[spread])) if spread.any() else 1.0
+
+        x1, y1, x2, y2 = self.box
+        cx, cy = (x1 + x2) / 2 + dx, (y1 + y2) / 2 + dy
+        half_w, half_h = (x2 - x1) * scale / 2, (y2 - y1) * scale / 2
+        h, w = small.shape[:2]
+        if cx < 0 or cy < 0 or cx >= w or cy >= h:
+            self.reset()
+            return False
+        self.box = (max(0.0, cx - half_w), max(0.0, cy - half_h), min(w, cx + half_w), min(h, cy + half_h))
+        self.points, self.previous = new.reshape(-1, 1, 2), small
+
+        # Pontos se perdem com o tempo: renova dentro da caixa atual
+        if len(self.points) < self.initial / 2:
+            points = self._features(small, self.box)
+            if points is not None:
+                self.points, self.initial = points, len(points)
+        return True
+
+    def redetect_due(self) -> bool:
+        return time.monotonic() - self.checked >= self.cfg.track_redetect_interval
+
+    def confirm(self, found: bool) -> bool:
+        """Resultado da varredura periódica; False quando o rastreio deve ser solto."""
+        self.checked = time.monotonic()
+        self.misses = 0 if found else self.misses + 1
+        if self.misses >= self.cfg.track_max_misses:
+            self.reset()
+            return False
+        return True
+
+    def _features(self, small: np.ndarray, box) -> Optional[np.ndarray]:
+        x1, y1, x2, y2 = (int(coord) for coord in box)
+        mask = np.zeros_like(small)
+        mask[max(0, y1):y2, max(0, x1):x2] = 255
+        points = cv2.goodFeaturesToTrack(small, maxCorners=80, qualityLevel=0.01, minDistance=3, mask=mask)
+        if points is None or len(points) < self.cfg.track_min_points:
+            return None
+        return points.astype(np.float32)
+
 NFCE_PATTERN = re.compile(r'https?://.*(?:fazenda|sefaz|nfce|nfe|qrcode|decodificacao|portal).*', re.IGNORECASE)
 
 class NFCeReader:
@@ -69,19 +691,25 @@ class NFCeReader:
         self.state = AppState()
         # model_size='l' é mais preciso, mas se ficar lento, troque por 'n' ou 's'
         self.qreader = QReader(model_size='l') 
+        self.note_index = NoteIndex()
+
+        # Pipeline: a captura publica no slot; detecção e tela leem o mais recente
+        self.frames = FrameSlot()
+        self.meters = {'capture': StageMeter(), 'detect': StageMeter(), 'display': StageMeter()}
+        self.overlays: List[Overlay] = []
+        self.overlays_time = 0.0
+        self.stop_event = threading.Event()
+
+        # Camadas da detecção e quantos frames seguiram cada caminho
+        self.fast = FastDetector(self.cfg)
+        self.tiers = Counter()
+        self.last_full_scan = 0.0
+        self.tracker = RoiTracker(self.cfg)
+        self.pyramid = PyramidDetector(self.qreader, self.cfg)
+        self.controller = AdaptiveController(self.cfg)
         
-        self._init_csv()
         self._init_camera()
 
-    def _init_csv(self):
-        if not os.path.exists(self.cfg.csv_file):
-            try:
-                with open(self.cfg.csv_file, mode="w", newline="", encoding="utf-8-sig") as f:
-                    writer = csv.writer(f, delimiter=';')
-                    writer.writerow(["Estabelecimento", "Produto", "Quantidade", "Unidade", "Valor_Total", "Desconto"])
-            except IOError as e:
-                print(f"[Erro] Falha ao criar CSV: {e}")
-
     def _init_camera(self):
         print(f"[Sistema] Iniciando Câmera {self.cfg.camera_index}...")
         self.cap = cv2.VideoCapture(self.cfg.camera_index, cv2.CAP_DSHOW)  # DirectShow no Windows
@@ -94,6 +722,7 @@ class NFCeReader:
         self.cap.set(cv2.CAP_PROP_FPS, self.cfg.fps_target)
         self.cap.set(cv2.CAP_PROP_AUTOFOCUS, 1)  # Autofoco ativo
         self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)  # Auto-exposição
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Sem fila no driver: o frame lido é o atual
         
         w = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -105,13 +734,13 @@ class NFCeReader:
         self.state.status = "Baixando dados..."
         self.state.color = COLORS['BLUE']
 
-        comando = f'scrapy crawl nfcedata -a url="{url}"'
+        # Sem shell: o conteúdo do QR Code chega ao spider como texto
+        comando = [sys.executable, "-m", "scrapy", "crawl", "nfcedata", "-a", f"url={url}"]
 
         try:
             process = subprocess.Popen(
                 comando,
                 cwd=self.cfg.scrapy_folder,
-                shell=True,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True
@@ -141,15 +770,27 @@ class NFCeReader:
             self.state.color = COLORS['GREEN']
 
     def _enhance_frame(self, image: np.ndarray) -> np.ndarray:
-        """Aplica processamento avançado para detectar QR codes muito pequenos."""
+        """Aplica processamento avançado para detectar QR codes muito pequenos.
+
+        Ampliação e remoção de ruído (as etapas caras) seguem o orçamento do
+        controlador adaptativo, que também recebe o custo de cada uma.
+        """
+        budget = self.controller.budget
         # 0. Upscaling para QR codes muito pequenos
-        if self.cfg.use_upscaling:
+        if budget['upscale']:
+            started = time.perf_counter()
             h, w = image.shape[:2]
             image = cv2.resize(image, (int(w * self.cfg.upscale_factor), int(h * self.cfg.upscale_factor)),
                              interpolation=cv2.INTER_CUBIC)
+            self.controller.cost('upscale', time.perf_counter() - started)
         
         # 1. Reduzir ruído mantendo bordas (mais agressivo)
-        denoised = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+        if budget['denoise']:
+            started = time.perf_counter()
+            denoised = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+            self.controller.cost('denoise', time.perf_counter() - started)
+        else:
+            denoised = image
         
         # 2. Sharpening super agressivo
         kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]]) * self.cfg.sharpen_strength
@@ -186,62 +827,157 @@ class NFCeReader:
         
         return final
 
-    def _process_frame(self, frame: np.ndarray):
-        """Processa o frame com detecção em múltiplas escalas (inclui QR muito pequenos)."""
+    def _process_frame(self, frame: np.ndarray) -> Optional[List[Overlay]]:
+        """Detecta e lê os QR Codes de um frame, do caminho mais barato ao mais caro.
+
+        Roda na thread de detecção e não desenha no frame: devolve as
+        marcações, que a tela aplica sobre os frames seguintes, ou None se
+        a cena parada dispensou a detecção (as marcações anteriores seguem
+        até expirar o overlay_ttl).
+        1. cena parada e já lida: não processa nem renova as marcações;
+        2. região rastreada: a caixa segue o cupom por fluxo óptico; lida,
+           não é lida de novo, senão só o recorte dela é processado;
+        3. leitura rápida no frame reduzido (e, a cada
+           track_redetect_interval, confirmação do rastreio);
+        4. candidato ilegível: leitura rápida no recorte em resolução cheia,
+           e só então o realce pesado e o QReader, no recorte.
+        """
         if self.state.is_processing:
-            return
+            return []
+        if self.cfg.detection_mode != "tiered":
+            self.tiers['completo'] += 1
+            return self._detect_heavy(frame)
+
+        small, factor = self.fast.prepare(frame)
+        if not self.fast.should_scan(small):
+            self.tiers['parado'] += 1
+            return None
+
+        tracker = self.tracker
+        tracked = self.cfg.use_tracking and tracker.active and tracker.update(small)
+        if tracked and not tracker.redetect_due():
+            self.tiers['rastreado'] += 1
+            return self._process_tracked(frame, factor)
+
+        overlays = []
+        decoded, candidates = self.fast.scan(small)
+        if tracked:
+            # Varredura periódica: sem achar nada, o rastreio segue até
+            # track_max_misses confirmações falharem; achando, recomeça na caixa nova
+            if not decoded and not candidates:
+                if tracker.confirm(False):
+                    self.tiers['rastreado'] += 1
+                    return self._process_tracked(frame, factor)
+            else:
+                tracker.confirm(True)
+
+        for text, box in decoded:
+            # Já lido e rastreado: não reenvia o mesmo cupom a cada confirmação
+            if not (tracked and tracker.decoded and self._inside(box, tracker.box)):
+                self._handle_url(text)
+            bbox = tuple(int(coord / factor) for coord in box)
+            overlays.append(Overlay(bbox, COLORS['GREEN'], "rápido", True))
+        if decoded:
+            self.tiers['rápido'] += 1
+            self._track(small, decoded[0][1], True)
+            return overlays
+
+        for box in candidates:
+            already = tracked and tracker.decoded and self._inside(box, tracker.box)
+            region = expand_box([coord / factor for coord in box], self.cfg.roi_margin, frame.shape)
+            if already:
+                found = [Overlay(region, COLORS['GREEN'], "rastreado", True)]
+            else:
+                found = self._process_roi(frame, region)
+            overlays.extend(found)
+            if box is candidates[0]:
+                self._track(small, box, any(overlay.decoded for overlay in found))
+
+        if not candidates:
+            # Sem candidato: QR pequeno demais para o passe barato; varredura
+            # completa só se configurada, espaçada por full_scan_interval
+            interval = self.cfg.full_scan_interval
+            if interval and time.monotonic() - self.last_full_scan >= interval:
+                self.last_full_scan = time.monotonic()
+                self.tiers['completo'] += 1
+                return self._detect_heavy(frame)
+            self.tiers['sem candidato'] += 1
+        return overlays
+
+    def _process_roi(self, frame: np.ndarray, region: Tuple[int, int, int, int]) -> List[Overlay]:
+        """Leitura rápida no recorte em resolução cheia; falhando, realce pesado no recorte."""
+        x1, y1, x2, y2 = region
+        roi = frame[y1:y2, x1:x2]
+        if roi.size == 0:
+            return []
+        found, _ = self.fast.scan(cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY))
+        if found:
+            self.tiers['recorte'] += 1
+            for text, _ in found:
+                self._handle_url(text)
+            return [Overlay(region, COLORS['GREEN'], "rápido (recorte)", True)]
+        self.tiers['recorte pesado'] += 1
+        heavy = self._detect_heavy(roi, (x1, y1))
+        return heavy or [Overlay(region, COLORS['RED'], "candidato", False)]
+
+    def _process_tracked(self, frame: np.ndarray, factor: float) -> List[Overlay]:
+        """Região rastreada: só repete a marcação se já foi lida, senão processa o recorte."""
+        tracker = self.tracker
+        region = expand_box([coord / factor for coord in tracker.box], self.cfg.roi_margin, frame.shape)
+        if tracker.decoded:
+            return [Overlay(region, COLORS['GREEN'], "rastreado", True)]
+        overlays = self._process_roi(frame, region)
+        tracker.decoded = any(overlay.decoded for overlay in overlays)
+        return overlays
+
+    def _track(self, small: np.ndarray, box, decoded: bool):
+        if self.cfg.use_tracking:
+            self.tracker.start(small, box, decoded)
+
+    @staticmethod
+    def _inside(box, region) -> bool:
+        """Centro de `box` dentro de `region`"""
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        return region[0] <= cx <= region[2] and region[1] <= cy <= region[3]
+
+    def _detect_heavy(self, image: np.ndarray, origin: Tuple[int, int] = (0, 0)) -> List[Overlay]:
+        """Realce e detecção em múltiplas escalas (inclui QR muito pequenos).
+
+        `image` é o frame inteiro ou um recorte dele começando em `origin`;
+        as marcações saem em coordenadas do frame.
+        """
+        overlays = []
+        controller = self.controller
+        controller.start_heavy()
+        budget = dict(controller.budget)  # o que valeu nesta detecção, para as contagens
 
         # Prepara imagem base
-        rgb_frame = self._enhance_frame(frame)
-        all_detections = []
+        rgb_frame = self._enhance_frame(image)
+        # Caixas da imagem realçada (ampliada) voltam para o tamanho do frame
+        to_frame = rgb_frame.shape[1] / image.shape[1]
+        ox, oy = origin
 
         try:
-            if self.cfg.use_multiscale_detection:
-                # Detecta em múltiplas escalas para melhor cobertura (especial para pequenos)
-                for scale in self.cfg.scales:
-                    try:
-                        if scale != 1.0:
-                            h, w = rgb_frame.shape[:2]
-                            scaled = cv2.resize(rgb_frame, (int(w * scale), int(h * scale)), 
-                                              interpolation=cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA)
-                            detections = self.qreader.detect(image=scaled)
-                            
-                            # Ajustar coordenadas de volta para escala original
-                            for det in detections:
-                                if det.get('bbox_xyxy') is not None:
-                                    bbox = det['bbox_xyxy']
-                                    det['bbox_xyxy'] = tuple(coord / scale for coord in bbox)
-                                    det['scale'] = scale
-                                    det['confidence'] = det.get('confidence', 1.0)
-                                    all_detections.append(det)
-                        else:
-                            detections = self.qreader.detect(image=rgb_frame)
-                            for det in detections:
-                                det['scale'] = 1.0
-                                det['confidence'] = det.get('confidence', 1.0)
-                                all_detections.append(det)
-                    except Exception as e:
-                        print(f"[Aviso] Escala {scale}: {e}")
-                        continue
-            else:
-                # Detecção simples na escala original
-                detections = self.qreader.detect(image=rgb_frame)
-                all_detections = detections
-            
-            # Remover duplicatas (QR codes detectados em múltiplas escalas)
-            unique_detections = self._remove_duplicate_detections(all_detections)
-            
+            scales = controller.scales() if self.cfg.use_multiscale_detection else ()
+            started = time.perf_counter()
+            unique_detections = self.pyramid.detect(rgb_frame, scales, budget['tiles'])
+            tiles = len(self.pyramid.last_levels) > 1
+            if tiles:
+                controller.cost('tiles', time.perf_counter() - started)
+
             # Processar cada detecção única
+            read_levels = set()
             for detection in unique_detections:
                 bbox = detection.get('bbox_xyxy')
                 if bbox is None: 
                     continue
 
-                x1, y1, x2, y2 = map(int, bbox)
+                x1, y1, x2, y2 = (int(coord / to_frame) for coord in bbox)
+                x1, y1, x2, y2 = x1 + ox, y1 + oy, x2 + ox, y2 + oy
                 scale = detection.get('scale', 1.0)
                 confidence = detection.get('confidence', 1.0)
                 
-                # Desenha retângulo com cor baseada na escala
+                # Cor baseada na escala
                 if scale < 1.0:
                     color = COLORS['RED']  # Vermelho para escalas pequenas
                 elif scale == 1.0:
@@ -249,172 +985,77 @@ class NFCeReader:
                 else:
                     color = COLORS['BLUE']  # Azul para escalas grandes
                 
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
-                
                 # Mostrar escala e confiança de detecção
                 info = f"{scale:.2f}x | {int(confidence*100)}%"
-                cv2.putText(frame, info, (x1, y1-10), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
                 
                 # Tenta decodificar com múltiplas técnicas
-                self._decode_and_act(rgb_frame, detection, frame)
+                decoded = self._decode_and_act(rgb_frame, detection)
+                overlays.append(Overlay((x1, y1, x2, y2), color, info, decoded is not None))
+                if decoded is not None:
+                    read_levels.add(detection.get('level'))
+
+            for level in self.pyramid.last_levels:
+                controller.record('scales', level, level in read_levels)
+            read = bool(read_levels)
+            controller.record_step('upscale', budget['upscale'], read)
+            controller.record_step('denoise', budget['denoise'], read)
+            controller.record_step('tiles', tiles, read)
                 
         except Exception as e:
             print(f"[Aviso] Erro no processamento: {e}")
+        return overlays
     
-    def _remove_duplicate_detections(self, detections: list) -> list:
-        """Remove detecções duplicadas usando IoU (Intersection over Union)."""
-        if len(detections) <= 1:
-            return detections
-        
-        unique = []
-        for det in detections:
-            bbox1 = det.get('bbox_xyxy')
-            if bbox1 is None:
-                continue
-            
-            is_duplicate = False
-            for unique_det in unique:
-                bbox2 = unique_det.get('bbox_xyxy')
-                if bbox2 is None:
-                    continue
-                
-                # Calcular IoU
-                iou = self._calculate_iou(bbox1, bbox2)
-                if iou > 0.5:  # 50% de sobreposição = duplicata
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                unique.append(det)
-        
-        return unique
-    
-    def _calculate_iou(self, bbox1: tuple, bbox2: tuple) -> float:
-        """Calcula Intersection over Union entre dois bounding boxes."""
-        x1_1, y1_1, x2_1, y2_1 = bbox1
-        x1_2, y1_2, x2_2, y2_2 = bbox2
-        
-        # Área de interseção
-        x1_i = max(x1_1, x1_2)
-        y1_i = max(y1_1, y1_2)
-        x2_i = min(x2_1, x2_2)
-        y2_i = min(y2_1, y2_2)
-        
-        if x2_i < x1_i or y2_i < y1_i:
-            return 0.0
-        
-        intersection = (x2_i - x1_i) * (y2_i - y1_i)
-        
-        # Área de união
-        area1 = (x2_1 - x1_1) * (y2_1 - y1_1)
-        area2 = (x2_2 - x1_2) * (y2_2 - y1_2)
-        union = area1 + area2 - intersection
-        
-        return intersection / union if union > 0 else 0.0
+    # Técnicas de decodificação; o controlador adaptativo decide a ordem
+    DECODE_STEPS = ("direta", "gaussiana", "média", "otsu", "invertida")
 
-    def _decode_and_act(self, image: np.ndarray, detection: Dict[str, Any], display_frame: np.ndarray):
-        """Tenta decodificar QR code com múltiplas técnicas (otimizado para pequenos)."""
-        decoded_text = None
-        
-        try:
-            # Tentativa 1: Decodificação direta
-            decoded = self.qreader.decode(image=image, candidates=[detection])
-            if decoded and decoded[0]:
-                decoded_text = decoded[0]
-        except Exception as e:
-            pass
-        
-        # Tentativa 2: Se falhou, tentar com recorte, expansão e processamento extra
-        if not decoded_text:
-            try:
-                bbox = detection.get('bbox_xyxy')
-                if bbox:
-                    x1, y1, x2, y2 = map(int, bbox)
-                    
-                    # Expandir área do QR em 30% para pegar bordas (maior margem para pequenos)
-                    margin = 0.3
-                    h, w = image.shape[:2]
-                    w_bbox = x2 - x1
-                    h_bbox = y2 - y1
-                    
-                    x1_exp = max(0, int(x1 - w_bbox * margin))
-                    y1_exp = max(0, int(y1 - h_bbox * margin))
-                    x2_exp = min(w, int(x2 + w_bbox * margin))
-                    y2_exp = min(h, int(y2 + h_bbox * margin))
-                    
-                    # Recortar região
-                    cropped = image[y1_exp:y2_exp, x1_exp:x2_exp]
-                    
-                    if cropped.size > 0:
-                        # Tentar múltiplas binarizações
-                        binary_methods = [
-                            # Método 1: Binarização adaptativa Gaussiana
-                            cv2.adaptiveThreshold(
-                                cv2.cvtColor(cropped, cv2.COLOR_RGB2GRAY), 255, 
-                                cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-                            ),
-                            # Método 2: Binarização adaptativa Média
-                            cv2.adaptiveThreshold(
-                                cv2.cvtColor(cropped, cv2.COLOR_RGB2GRAY), 255, 
-                                cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 2
-                            ),
-                            # Método 3: Otsu
-                            cv2.threshold(cv2.cvtColor(cropped, cv2.COLOR_RGB2GRAY), 0, 255, 
-                                        cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1],
-                        ]
-                        
-                        for binary in binary_methods:
-                            rgb_binary = cv2.cvtColor(binary, cv2.COLOR_GRAY2RGB)
-                            
-                            try:
-                                decoded = self.qreader.detect_and_decode(image=rgb_binary)
-                                if decoded and len(decoded) > 0 and decoded[0]:
-                                    decoded_text = decoded[0]
-                                    break
-                            except:
-                                continue
-                        
-            except Exception as e:
-                pass
-        
-        # Tentativa 3: Inverter cores se ainda não decodificou (caso inverso branco/preto)
-        if not decoded_text:
+    def _decode_and_act(self, image: np.ndarray, detection: Dict[str, Any]) -> Optional[str]:
+        """Tenta decodificar QR code com múltiplas técnicas (otimizado para pequenos).
+
+        As técnicas vão na ordem das que mais leram nesta estação; cada
+        tentativa entra nas contagens do controlador.
+        Retorna o texto lido (já encaminhado para _handle_url) ou None.
+        """
+        cropped = None
+        bbox = detection.get('bbox_xyxy')
+        if bbox is not None:
+            # Expandir área do QR em 30% para pegar bordas (maior margem para pequenos)
+            x1, y1, x2, y2 = expand_box(bbox, 0.3, image.shape)
+            cropped = image[y1:y2, x1:x2]
+
+        for step in self.controller.decode_steps(self.DECODE_STEPS):
             try:
-                bbox = detection.get('bbox_xyxy')
-                if bbox:
-                    x1, y1, x2, y2 = map(int, bbox)
-                    margin = 0.3
-                    h, w = image.shape[:2]
-                    w_bbox = x2 - x1
-                    h_bbox = y2 - y1
-                    
-                    x1_exp = max(0, int(x1 - w_bbox * margin))
-                    y1_exp = max(0, int(y1 - h_bbox * margin))
-                    x2_exp = min(w, int(x2 + w_bbox * margin))
-                    y2_exp = min(h, int(y2 + h_bbox * margin))
-                    
-                    cropped = image[y1_exp:y2_exp, x1_exp:x2_exp]
-                    
-                    if cropped.size > 0:
-                        # Inverter e tentar novamente
-                        inverted = cv2.bitwise_not(cropped)
-                        decoded = self.qreader.detect_and_decode(image=inverted)
-                        if decoded and len(decoded) > 0 and decoded[0]:
-                            decoded_text = decoded[0]
-            except:
-                pass
-        
-        # Se conseguiu decodificar, processar URL
-        if decoded_text:
-            # Feedback visual de sucesso
-            bbox = detection.get('bbox_xyxy')
-            if bbox:
-                x1, y1, x2, y2 = map(int, bbox)
-                cv2.putText(display_frame, "LIDO! ✓", (x1, y2+25), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.8, COLORS['GREEN'], 2)
-            
-            self._handle_url(decoded_text)
+                decoded_text = self._decode_step(step, image, detection, cropped)
+            except Exception:
+                decoded_text = None
+            self.controller.record('decode', step, bool(decoded_text))
+            # Se conseguiu decodificar, processar URL
+            if decoded_text:
+                self._handle_url(decoded_text)
+                return decoded_text
+        return None
+
+    def _decode_step(self, step: str, image: np.ndarray, detection: Dict[str, Any],
+                     cropped: Optional[np.ndarray]) -> Optional[str]:
+        if step == "direta":
+            # Decodificação direta na detecção do QReader
+            return self.qreader.decode(image=image, detection_result=detection)
+        if cropped is None or cropped.size == 0:
+            return None
+        if step == "invertida":
+            # Inverter cores (caso inverso branco/preto)
+            source = cv2.bitwise_not(cropped)
+        else:
+            # Binarizações do recorte: adaptativa Gaussiana, adaptativa Média ou Otsu
+            gray = cv2.cvtColor(cropped, cv2.COLOR_RGB2GRAY)
+            if step == "gaussiana":
+                binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+            elif step == "média":
+                binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 2)
+            else:
+                binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+            source = cv2.cvtColor(binary, cv2.COLOR_GRAY2RGB)
+        decoded = self.qreader.detect_and_decode(image=source)
+        return decoded[0] if decoded and decoded[0] else None
 
     def _handle_url(self, url: str):
         current_time = time.time()
@@ -426,6 +1067,14 @@ class NFCeReader:
                 print(f"[QR Detectado] {url}")
                 self.state.last_url = url
                 self.state.last_time = current_time
+
+                # Nota já ingerida: responde na hora, sem acessar a SEFAZ
+                chave = extract_access_key(url)
+                if chave and self.note_index.contains(chave):
+                    print(f"[Duplicada] Nota {chave} já registrada.")
+                    self.state.status = "Nota já registrada"
+                    self.state.color = COLORS['BLUE']
+                    return
                 
                 t = threading.Thread(target=self._run_scrapy_thread, args=(url,))
                 t.daemon = True
@@ -444,8 +1093,8 @@ class NFCeReader:
         cv2.putText(frame, self.state.status, (20, 35), cv2.FONT_HERSHEY_SIMPLEX, 
                    0.9, self.state.color, 2)
         
-        # Info de detecção
-        info = f"Multi-Scale: {'ON' if self.cfg.use_multiscale_detection else 'OFF'} | FPS: {int(self.cap.get(cv2.CAP_PROP_FPS))}"
+        # Info de detecção e do pipeline
+        info = f"Multi-Scale: {'ON' if self.cfg.use_multiscale_detection else 'OFF'} | {self._pipeline_summary()}"
         cv2.putText(frame, info, (20, 55), cv2.FONT_HERSHEY_SIMPLEX, 
                    0.4, COLORS['WHITE'], 1)
         
@@ -458,31 +1107,113 @@ class NFCeReader:
         cv2.putText(frame, "Verde: 1.0x | Azul: Outras escalas", (w - 350, legend_y), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, COLORS['WHITE'], 1)
 
+    def _draw_overlays(self, frame: np.ndarray):
+        """Aplica as marcações da última detecção (se ainda recentes) ao frame exibido."""
+        if time.monotonic() - self.overlays_time > self.cfg.overlay_ttl:
+            return
+        for overlay in self.overlays:
+            x1, y1, x2, y2 = overlay.bbox
+            cv2.rectangle(frame, (x1, y1), (x2, y2), overlay.color, 3)
+            cv2.putText(frame, overlay.label, (x1, y1-10), 
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.5, overlay.color, 2)
+            if overlay.decoded:
+                # Feedback visual de sucesso
+                cv2.putText(frame, "LIDO! ✓", (x1, y2+25), 
+                          cv2.FONT_HERSHEY_SIMPLEX, 0.8, COLORS['GREEN'], 2)
+
+    def _pipeline_summary(self) -> str:
+        m = self.meters
+        return (f"Captura {m['capture'].fps():.0f} fps | "
+                f"Detecção {m['detect'].fps():.1f} fps ({m['detect'].dropped} descartados) | "
+                f"Tela {m['display'].fps():.0f} fps ({m['display'].dropped} descartados)")
+
+    def _tiers_summary(self) -> str:
+        return ", ".join(f"{tier} {count}" for tier, count in self.tiers.most_common()) or "-"
+
+    def _capture_loop(self):
+        """Lê a câmera sem parar; o slot guarda só o frame mais novo."""
+        failures = 0
+        while not self.stop_event.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                failures += 1
+                if failures >= 30:
+                    print("[Erro] Falha na câmera")
+                    self.stop_event.set()
+                continue
+            failures = 0
+            self.frames.put(frame)
+            self.meters['capture'].tick()
+
+    def _detect_loop(self):
+        """Processa sempre o frame mais recente; os que chegaram no meio são descartados."""
+        seq = 0
+        while not self.stop_event.is_set():
+            new_seq, frame = self.frames.get(seq, timeout=0.5)
+            if frame is None:
+                continue
+            self.meters['detect'].tick(dropped=new_seq - seq - 1 if seq else 0)
+            seq = new_seq
+            started = time.perf_counter()
+            overlays = self._process_frame(frame)
+            self.controller.observe_frame(time.perf_counter() - started)
+            # Só uma detecção de verdade renova as marcações e o prazo delas
+            if overlays is not None:
+                self.overlays, self.overlays_time = overlays, time.monotonic()
+
     def run(self):
         print("[Sistema] NFCe Reader OTIMIZADO para QR PEQUENOS!")
+        print("[Config] Detecção:", "EM CAMADAS" if self.cfg.detection_mode == "tiered" else "COMPLETA",
+              f"(leitura rápida: {'pyzbar' if pyzbar is not None else 'OpenCV'})")
+        print("[Config] Rastreamento:", "ATIVO" if self.cfg.use_tracking else "INATIVO",
+              f"(confirmação a cada {self.cfg.track_redetect_interval:g} s)")
         print("[Config] Multi-Scale:", "ATIVO" if self.cfg.use_multiscale_detection else "INATIVO")
         print("[Config] Escalas:", self.cfg.scales)
         print("[Config] Upscaling:", "ATIVO (2x)" if self.cfg.use_upscaling else "INATIVO")
+        print("[Config] Adaptativo:", f"ATIVO (alvo {self.cfg.fps_target} fps)" if self.cfg.use_adaptive_processing else "INATIVO",
+              f"| {self.controller.summary()}")
         print("[Config] Sharpening:", self.cfg.sharpen_strength)
         print("[Dica] Pressione 'Q' para sair")
         print("=" * 60)
         
-        while True:
-            ret, frame = self.cap.read()
-            if not ret:
-                print("[Erro] Falha na câmera")
-                break
+        workers = [
+            threading.Thread(target=self._capture_loop, name="captura", daemon=True),
+            threading.Thread(target=self._detect_loop, name="deteccao", daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
 
-            if (cv2.waitKey(1) & 0xFF) == ord('q'):
-                break
+        # A tela fica na thread principal (exigência do highgui) e acompanha
+        # a câmera, com as marcações mais recentes que a detecção produziu
+        seq = 0
+        last_report = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                new_seq, frame = self.frames.get(seq, timeout=0.1)
+                if frame is not None:
+                    self.meters['display'].tick(dropped=new_seq - seq - 1 if seq else 0)
+                    seq = new_seq
+                    # O mesmo array está com a detecção: desenha numa cópia
+                    frame = frame.copy()
+                    self._draw_overlays(frame)
+                    self._draw_hud(frame)
+                    cv2.imshow("NFCe Reader", frame)
 
-            self._process_frame(frame)
-            self._draw_hud(frame)
-            
-            cv2.imshow("NFCe Reader", frame)
+                if (cv2.waitKey(1) & 0xFF) == ord('q'):
+                    break
 
-        self.cap.release()
-        cv2.destroyAllWindows()
+                if self.cfg.stats_interval and time.monotonic() - last_report >= self.cfg.stats_interval:
+                    print(f"[Pipeline] {self._pipeline_summary()}")
+                    print(f"[Camadas] {self._tiers_summary()}")
+                    print(f"[Adaptativo] {self.controller.summary()}")
+                    last_report = time.monotonic()
+        finally:
+            self.stop_event.set()
+            for worker in workers:
+                worker.join(timeout=5)
+            self.cap.release()
+            cv2.destroyAllWindows()
+            self.controller.save()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1 @@
+# Comandos de linha de comando do projeto (COMMANDS_MODULE em settings.py)
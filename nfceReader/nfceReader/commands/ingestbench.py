@@ -0,0 +1,185 @@
+# `scrapy ingestbench`: benchmark do caminho de ingestão com NFCe sintéticas.
+#
+# Para cada tamanho de nota, gera páginas determinísticas (synthetic.py) e
+# mede separadamente o parse do spider, os pipelines de itens e a gravação no
+# SQLite (escritor com commit em grupo) num banco temporário. Reporta
+# itens/s, p50/p99 por página e pico de memória; --output grava o JSON e
+# --compare mostra a variação contra um resultado anterior.
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import lxml
+import scrapy
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import HtmlResponse
+
+from nfceReader.notes import extract_access_key
+from nfceReader.pipelines import NfcereaderPipeline, StoragePipeline
+from nfceReader.spiders.nfcedata import NfcedataSpider
+from nfceReader.synthetic import generate_page
+from nfceReader.writer import GroupCommitWriter
+
+STAGES = ("parse", "pipeline", "storage")
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Mede parse, pipeline e gravação com NFCe sintéticas"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--sizes", default="10,100,500",
+                            help="itens por nota, separados por vírgula (padrão: 10,100,500)")
+        parser.add_argument("--pages", type=int, default=50, help="notas medidas por tamanho (padrão: 50)")
+        parser.add_argument("--selectors", action="store_true",
+                            help="mede o parse pelos seletores CSS em vez do caminho rápido")
+        parser.add_argument("--output", metavar="ARQUIVO", help="grava os resultados em JSON")
+        parser.add_argument("--compare", metavar="ARQUIVO", help="compara com um JSON de execução anterior")
+
+    def run(self, args, opts):
+        try:
+            sizes = [int(size) for size in opts.sizes.split(",") if size.strip()]
+        except ValueError:
+            raise UsageError("--sizes deve ser uma lista de inteiros")
+        if not sizes or min(sizes) < 1 or opts.pages < 1:
+            raise UsageError("--sizes e --pages devem ser positivos")
+
+        workdir = tempfile.mkdtemp(prefix="nfce-bench-")
+        try:
+            results = {
+                "environment": {
+                    "python": platform.python_version(),
+                    "scrapy": scrapy.__version__,
+                    "lxml": ".".join(map(str, lxml.etree.LXML_VERSION)),
+                    "parser": "selectors" if opts.selectors else "fast",
+                },
+                "pages": opts.pages,
+                "sizes": {},
+            }
+            for size in sizes:
+                db_path = os.path.join(workdir, f"bench_{size}.db")
+                results["sizes"][str(size)] = self._bench_size(size, opts.pages, db_path, opts.selectors)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        baseline = None
+        if opts.compare:
+            with open(opts.compare, encoding="utf-8") as f:
+                baseline = json.load(f)
+        self._report(results, baseline)
+
+        if opts.output:
+            with open(opts.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+    def _pages(self, size, count):
+        # Sementes fixas por tamanho: a mesma execução gera as mesmas páginas
+        for index in range(count):
+            url, body = generate_page(size, seed=size * 100000 + index)
+            yield HtmlResponse(url=url, body=body, encoding="utf-8")
+
+    def _run_pages(self, responses, db_path, use_selectors, timings=None):
+        spider = NfcedataSpider()
+        parse = spider.parse_selectors if use_selectors else spider.parse_fast
+        normalizer = NfcereaderPipeline()
+        pipeline = StoragePipeline(db_path)
+        # Escritor próprio, sem espera por lote: mede o custo de um commit por nota
+        writer = GroupCommitWriter(db_path, batch_delay=0)
+        total_items = 0
+
+        for response in responses:
+            # Resposta nova a cada passada: o parse inclui montar a árvore HTML
+            response = response.replace()
+            start = time.perf_counter()
+            items = list(parse(response))
+            parsed = time.perf_counter()
+
+            spider.url = response.url
+            pipeline.open_spider(spider)
+            for item in items:
+                pipeline.process_item(normalizer.process_item(item, spider), spider)
+            piped = time.perf_counter()
+
+            writer.write(pipeline.items, extract_access_key(response.url), response.url)
+            stored = time.perf_counter()
+
+            total_items += len(items)
+            if timings is not None:
+                timings["parse"].append(parsed - start)
+                timings["pipeline"].append(piped - parsed)
+                timings["storage"].append(stored - piped)
+        return total_items
+
+    def _bench_size(self, size, count, db_path, use_selectors):
+        responses = list(self._pages(size, count))
+
+        # Aquecimento (imports, XPath compilado, schema) fora da medição
+        self._run_pages(responses[:1], db_path + ".warmup", use_selectors)
+
+        timings = {stage: [] for stage in STAGES}
+        total_items = self._run_pages(responses, db_path, use_selectors, timings)
+
+        # Memória numa passada separada: o tracemalloc distorce os tempos
+        tracemalloc.start()
+        self._run_pages(responses[:max(1, count // 5)], db_path + ".memory", use_selectors)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        result = {"items": total_items, "peak_memory_kb": round(peak / 1024, 1)}
+        for stage in STAGES:
+            values = timings[stage]
+            elapsed = sum(values)
+            result[stage] = {
+                "items_per_sec": round(total_items / elapsed, 1) if elapsed else None,
+                "p50_ms": round(statistics.median(values) * 1000, 3),
+                "p99_ms": round(_percentile(values, 0.99) * 1000, 3),
+            }
+        total = sum(sum(timings[stage]) for stage in STAGES)
+        result["total_items_per_sec"] = round(total_items / total, 1) if total else None
+        return result
+
+    def _report(self, results, baseline):
+        env = results["environment"]
+        print(f"Python {env['python']}, Scrapy {env['scrapy']}, lxml {env['lxml']}, "
+              f"parser {env['parser']}, {results['pages']} notas por tamanho")
+        header = f"{'itens':>6} {'etapa':<9} {'itens/s':>12} {'p50 ms':>9} {'p99 ms':>9}"
+        if baseline:
+            header += f" {'Δ itens/s':>10} {'Δ p99':>8}"
+        print(header)
+
+        for size, result in results["sizes"].items():
+            old = (baseline or {}).get("sizes", {}).get(size)
+            for stage in STAGES:
+                data = result[stage]
+                line = f"{size:>6} {stage:<9} {data['items_per_sec'] or 0:>12,.0f} {data['p50_ms']:>9.3f} {data['p99_ms']:>9.3f}"
+                if old:
+                    line += (f" {self._delta(old[stage]['items_per_sec'], data['items_per_sec']):>10}"
+                             f" {self._delta(old[stage]['p99_ms'], data['p99_ms']):>8}")
+                print(line)
+            print(f"{size:>6} {'total':<9} {result['total_items_per_sec'] or 0:>12,.0f}"
+                  f"   pico de memória {result['peak_memory_kb']:,.0f} KiB")
+
+    @staticmethod
+    def _delta(old, new):
+        if not old or new is None:
+            return "-"
+        return f"{(new - old) / old * 100:+.1f}%"
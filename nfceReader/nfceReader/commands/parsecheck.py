@@ -0,0 +1,76 @@
+# `scrapy parsecheck`: confere que o caminho rápido de extração (lxml)
+# produz exatamente os mesmos itens que os seletores CSS originais.
+#
+# Usa as páginas de nfceReader/fixtures/ (ou os arquivos informados) e,
+# com --cache, também todas as páginas guardadas pelo PageCache.
+
+import glob
+import os
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.http import HtmlResponse
+
+from nfceReader.pagecache import PageCache
+from nfceReader.spiders.nfcedata import NfcedataSpider
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "fixtures")
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options] [arquivo.html ...]"
+
+    def short_desc(self):
+        return "Compara a extração rápida (lxml) com a dos seletores CSS"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--cache", action="store_true",
+                            help="confere também as páginas do cache de páginas")
+
+    def _pages(self, args, opts):
+        for path in args or sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html"))):
+            with open(path, "rb") as f:
+                yield path, HtmlResponse(url=f"file://{os.path.abspath(path)}", body=f.read(), encoding="utf-8")
+        if opts.cache:
+            settings = self.settings
+            cache = PageCache(settings.get("PAGE_CACHE_DIR"), settings.getint("PAGE_CACHE_MAX_BYTES"),
+                              settings.get("NFCE_DB"))
+            for entry in cache.entries():
+                try:
+                    body = cache.read(entry["digest"])
+                except FileNotFoundError:
+                    continue
+                yield entry["access_key"], HtmlResponse(url=entry["url"], body=body, encoding=entry["encoding"])
+
+    def run(self, args, opts):
+        spider = NfcedataSpider()
+        pages = mismatches = 0
+        elapsed = {"selectors": 0.0, "fast": 0.0}
+
+        for name, response in self._pages(args, opts):
+            pages += 1
+            start = time.perf_counter()
+            expected = list(spider.parse_selectors(response))
+            elapsed["selectors"] += time.perf_counter() - start
+            start = time.perf_counter()
+            got = list(spider.parse_fast(response))
+            elapsed["fast"] += time.perf_counter() - start
+
+            if got != expected:
+                mismatches += 1
+                print(f"DIVERGENTE {name}")
+                for position in range(max(len(expected), len(got))):
+                    old = expected[position] if position < len(expected) else None
+                    new = got[position] if position < len(got) else None
+                    if old != new:
+                        print(f"  item {position}: seletores={old} rapido={new}")
+
+        print(f"{pages} páginas, {mismatches} divergentes "
+              f"(seletores {elapsed['selectors'] * 1000:.1f} ms, rápido {elapsed['fast'] * 1000:.1f} ms)")
+        if mismatches or not pages:
+            self.exitcode = 1
@@ -0,0 +1,89 @@
+# `scrapy reprocess`: reinterpreta as notas guardadas no PageCache.
+#
+# Roda NfcedataSpider.parse sobre o HTML em cache, em paralelo em vários
+# processos, e substitui os itens de cada nota no banco. Nenhum acesso à
+# SEFAZ é feito: serve para aplicar correções do parser ao histórico.
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import HtmlResponse
+
+from nfceReader.pagecache import PageCache
+from nfceReader.storage import ItemStore
+
+_spider = None
+
+
+def _parse_page(cache, entry):
+    """Executado nos processos filhos: devolve (chave, itens, erro)"""
+    global _spider
+    from nfceReader.spiders.nfcedata import NfcedataSpider
+
+    if _spider is None:
+        _spider = NfcedataSpider()
+    try:
+        body = cache.read(entry["digest"])
+        response = HtmlResponse(url=entry["url"], body=body, encoding=entry["encoding"])
+        items = [dict(item) for item in _spider.parse(response)]
+        if not items:
+            # Não apaga os itens gravados por causa de uma página que o parser não entende
+            return entry["access_key"], None, "nenhum item encontrado na página"
+        return entry["access_key"], items, None
+    except Exception as e:
+        return entry["access_key"], None, str(e)
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options] [chave_de_acesso ...]"
+
+    def short_desc(self):
+        return "Reinterpreta as notas do cache de páginas, sem acessar a rede"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                            help="processos em paralelo (padrão: número de CPUs)")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="só interpreta e informa, sem gravar no banco")
+
+    def run(self, args, opts):
+        if opts.jobs < 1:
+            raise UsageError("--jobs deve ser pelo menos 1")
+
+        settings = self.settings
+        cache = PageCache(settings.get("PAGE_CACHE_DIR"), settings.getint("PAGE_CACHE_MAX_BYTES"),
+                          settings.get("NFCE_DB"))
+        store = ItemStore(settings.get("NFCE_DB"))
+        entries = cache.entries(args)
+        if not entries:
+            print("Nenhuma página no cache para reprocessar")
+            return
+
+        start = time.time()
+        notes = items = errors = 0
+        with ProcessPoolExecutor(max_workers=opts.jobs) as executor:
+            results = executor.map(_parse_page, [cache] * len(entries), entries,
+                                   chunksize=max(1, len(entries) // (opts.jobs * 4)))
+            for (access_key, parsed, error), entry in zip(results, entries):
+                if error is not None:
+                    errors += 1
+                    print(f"Erro ao reprocessar {access_key}: {error}")
+                    continue
+                if not opts.dry_run:
+                    store.replace_note(access_key, parsed, entry["url"])
+                notes += 1
+                items += len(parsed)
+
+        elapsed = time.time() - start
+        action = "interpretadas" if opts.dry_run else "reprocessadas"
+        print(f"{notes} notas {action} ({items} itens, {errors} erros) em {elapsed:.2f}s com {opts.jobs} processos")
+        if errors:
+            self.exitcode = 1
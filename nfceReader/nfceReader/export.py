@@ -0,0 +1,153 @@
+# Formatos de exportação dos itens, todos gerados em streaming.
+#
+# CSV (opcionalmente gzip), NDJSON tipado e, com pyarrow instalado,
+# Parquet e Arrow IPC com colunas tipadas. Os geradores consomem
+# ItemStore.iter_records() em lotes, então o uso de memória não depende
+# do tamanho do histórico.
+
+import json
+import zlib
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import islice
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # dependência opcional: só CSV e NDJSON
+    pa = None
+    pq = None
+
+# Linhas por lote (row group no Parquet, record batch no Arrow)
+BATCH_ROWS = 50000
+# Tamanho mínimo de cada pedaço comprimido entregue ao cliente
+GZIP_CHUNK_BYTES = 64 * 1024
+
+QUANTITY_PLACES = Decimal("0.0001")
+
+FORMATS = {
+    # formato: (mimetype, extensão)
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+COLUMNAR_FORMATS = {"parquet", "arrow"}
+
+
+def columnar_available():
+    return pa is not None
+
+
+def gzip_stream(chunks, level=6):
+    """Comprime um gerador de str/bytes em gzip, incrementalmente"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = []
+    size = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            pending.append(data)
+            size += len(data)
+        if size >= GZIP_CHUNK_BYTES:
+            yield b"".join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b"".join(pending)
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+def iter_ndjson(records):
+    """Um objeto JSON por linha, com valores em centavos e quantidade decimal"""
+    for record in records:
+        record["ingested_at"] = _iso(record["ingested_at"])
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("access_key", pa.string()),
+        ("local", pa.string()),
+        ("name", pa.string()),
+        ("quantidade", pa.decimal128(18, 4)),
+        ("unidade", pa.string()),
+        ("valor_cents", pa.int64()),
+        ("desconto_cents", pa.int64()),
+        ("issues", pa.string()),
+        ("url", pa.string()),
+        ("ingested_at", pa.timestamp("ms", tz="UTC")),
+    ])
+
+
+def _quantity(text):
+    if text is None:
+        return None
+    return Decimal(text).quantize(QUANTITY_PLACES, rounding=ROUND_HALF_UP)
+
+
+def _record_batches(records, schema):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, BATCH_ROWS))
+        if not batch:
+            return
+        columns = {name: [record[name] for record in batch] for name in (
+            "id", "access_key", "local", "name", "unidade", "valor_cents", "desconto_cents", "issues", "url")}
+        columns["quantidade"] = [_quantity(record["quantidade_num"]) for record in batch]
+        columns["ingested_at"] = [int(record["ingested_at"] * 1000) for record in batch]
+        yield pa.RecordBatch.from_arrays([pa.array(columns[field.name], type=field.type) for field in schema],
+                                         schema=schema)
+
+
+class _ChunkSink:
+    """Arquivo só de escrita que acumula os bytes até serem drenados"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _stream_columnar(records, open_writer):
+    schema = _schema()
+    sink = _ChunkSink()
+    writer = open_writer(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for batch in _record_batches(records, schema):
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_parquet(records):
+    """Parquet (zstd) com um row group por lote de BATCH_ROWS linhas"""
+    return _stream_columnar(
+        records, lambda sink, schema: pq.ParquetWriter(sink, schema, compression="zstd")
+    )
+
+
+def iter_arrow(records):
+    """Arrow IPC em formato de stream (pyarrow.ipc.open_stream lê direto)"""
+    return _stream_columnar(records, lambda sink, schema: pa.ipc.new_stream(sink, schema))
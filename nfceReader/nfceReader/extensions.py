@@ -0,0 +1,37 @@
+# Extensão que mede a partida do crawl e cada download (ver metrics.py),
+# no histograma do Prometheus e nas stats do crawl (tempos por URL do job).
+#
+# A partida vai do início do crawl (argumento started_at do spider, passado
+# pelos motores de crawl_engine.py) até o spider abrir: criação do crawler
+# no motor em processo, ou o processo inteiro do `scrapy crawl` no motor
+# subprocess.
+
+import time
+
+from scrapy import signals
+
+from nfceReader import metrics
+
+
+class MetricsExtension:
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.stats)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        started_at = getattr(spider, "started_at", None)
+        if started_at is not None:
+            metrics.observe_stage("startup", time.time() - float(started_at), self.stats)
+
+    def response_received(self, response, request, spider):
+        # Respostas do cache de páginas não têm latência de rede
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            metrics.observe_stage("fetch", latency, self.stats)
@@ -0,0 +1,92 @@
+# Extração das notas em uma passada sobre a árvore lxml.
+#
+# Equivale aos seletores CSS de NfcedataSpider.parse_selectors, mas cada
+# linha de item é percorrida uma única vez, em vez de uma consulta por
+# campo. As consultas de documento usam o mesmo XPath que o parsel gera
+# para os seletores CSS, pré-compilado. `scrapy parsecheck` confere que os
+# dois caminhos produzem a mesma saída.
+
+import re
+
+from lxml import etree
+from parsel.csstranslator import css2xpath
+
+ESTABELECIMENTO_XPATH = etree.XPath(css2xpath("div.txtTopo::text"))
+ESTABELECIMENTO_FALLBACK_XPATH = etree.XPath(css2xpath("#u20::text"))
+ITEMS_XPATH = etree.XPath(css2xpath("tr[id^='Item +']"))
+
+# Classe do span -> (campo, exige um td entre o span e a linha)
+ROW_FIELDS = {
+    "txtTit2": ("name", True),
+    "Rqtd": ("qtd", True),
+    "RUN": ("un", True),
+    "valor": ("valor", True),
+    "totalNumb": ("raw_desconto", False),
+}
+
+# normalize-space() do XPath só considera estes quatro caracteres
+_CLASS_SEPARATOR = re.compile(r"[ \t\r\n]+")
+
+
+def _first_text_nodes(row):
+    """Primeiro nó de texto, em ordem de documento, de cada campo da linha.
+
+    Os nós de texto aparecem no evento "start" do elemento (`.text`) e no
+    "end" de cada filho (`.tail`, que pertence ao pai); comentários chegam
+    num evento próprio. Assim a ordem é a mesma em que `span.classe::text`
+    os devolveria.
+    """
+    found = {}
+    td_depth = 0
+    for event, element in etree.iterwalk(row, events=("start", "end", "comment", "pi")):
+        if event == "start":
+            if element.tag == "td":
+                td_depth += 1
+            text, parent = element.text, element
+        elif event == "end":
+            if element.tag == "td":
+                td_depth -= 1
+            if element is row:
+                break
+            text, parent = element.tail, element.getparent()
+        else:
+            # Comentários e instruções: só o .tail é nó de texto (do pai)
+            text, parent = element.tail, element.getparent()
+
+        if text is None or parent.tag != "span":
+            continue
+        classes = parent.get("class")
+        if not classes:
+            continue
+        for cls in _CLASS_SEPARATOR.split(classes):
+            spec = ROW_FIELDS.get(cls)
+            if spec is None or spec[0] in found:
+                continue
+            field, needs_td = spec
+            if needs_td and not td_depth:
+                continue
+            found[field] = text
+        if len(found) == len(ROW_FIELDS):
+            break
+    return found
+
+
+def _first(texts):
+    return str(texts[0]) if texts else None
+
+
+def extract(root):
+    """Retorna (estabelecimento, linhas) a partir da raiz lxml da página.
+
+    Cada linha é um dict com os textos brutos name, qtd, un, valor e
+    raw_desconto (None quando ausentes), como os seletores devolveriam.
+    """
+    estabelecimento = _first(ESTABELECIMENTO_XPATH(root))
+    if not estabelecimento:
+        estabelecimento = _first(ESTABELECIMENTO_FALLBACK_XPATH(root))
+
+    rows = []
+    for row in ITEMS_XPATH(root):
+        found = _first_text_nodes(row)
+        rows.append({field: found.get(field) for field, _ in ROW_FIELDS.values()})
+    return estabelecimento, rows
@@ -0,0 +1,35 @@
+# Download handler HTTP com pool de conexões compartilhado no processo.
+#
+# O HTTP11DownloadHandler padrão cria um pool por crawler e o fecha no fim
+# do crawl. No motor em processo cada nota é um crawler, então toda nota
+# abriria uma conexão (e um handshake TLS) nova com o portal. Aqui todos os
+# crawlers usam o mesmo pool persistente e as conexões keep-alive com cada
+# SEFAZ são reaproveitadas entre notas.
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from twisted.internet.defer import succeed
+from twisted.web.client import HTTPConnectionPool
+
+_shared_pool = None
+
+
+def shared_pool(max_per_host):
+    global _shared_pool
+    if _shared_pool is None:
+        from twisted.internet import reactor
+
+        _shared_pool = HTTPConnectionPool(reactor, persistent=True)
+        _shared_pool._factory.noisy = False
+    _shared_pool.maxPersistentPerHost = max(_shared_pool.maxPersistentPerHost, max_per_host)
+    return _shared_pool
+
+
+class SharedPoolDownloadHandler(HTTP11DownloadHandler):
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        self._pool = shared_pool(settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"))
+
+    def close(self):
+        # O pool sobrevive ao crawler; as conexões fecham com o processo
+        return succeed(None)
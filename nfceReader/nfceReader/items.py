@@ -7,6 +7,16 @@ import scrapy
 
 
 class NfcereaderItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # Textos como aparecem na página da SEFAZ (formato brasileiro)
+    local = scrapy.Field()
+    name = scrapy.Field()
+    quantidade = scrapy.Field()
+    unidade = scrapy.Field()
+    valor = scrapy.Field()
+    desconto = scrapy.Field()
+
+    # Preenchidos pelo NfcereaderPipeline (ver normalize.py)
+    valor_cents = scrapy.Field()      # int, centavos; None se o valor é inválido
+    desconto_cents = scrapy.Field()   # int, centavos, sempre positivo
+    quantidade_num = scrapy.Field()   # str decimal canônico, ex. "1.5"
+    issues = scrapy.Field()           # list[str] com os problemas encontrados
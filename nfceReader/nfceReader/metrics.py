@@ -0,0 +1,121 @@
+# Métricas Prometheus da ingestão (exportadas em /metrics pelo app web).
+#
+# Os objetos ficam aqui para que o app, o pool de workers e os componentes
+# do Scrapy registrem nos mesmos contadores, tanto no motor em processo
+# quanto no `scrapy crawl` do motor subprocess. Com vários processos
+# (workers do gunicorn, worker.py, subprocessos), defina
+# PROMETHEUS_MULTIPROC_DIR: cada processo grava seus valores em arquivos
+# mmap nesse diretório e o /metrics soma todos.
+#
+# Registrar um valor custa poucos microssegundos (um lock e uma soma). Sem
+# prometheus_client instalado, as métricas viram no-op.
+
+import os
+
+try:
+    import prometheus_client as prom
+    from prometheus_client.core import GaugeMetricFamily
+    from prometheus_client.multiprocess import MultiProcessCollector
+except ImportError:  # dependência opcional: sem /metrics
+    prom = None
+
+# Segundos; de respostas em cache (ms) até o timeout do crawl (30 s)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+class _NoOp:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _metric(kind, name, documentation, labels, **kwargs):
+    if prom is None:
+        return _NoOp()
+    return getattr(prom, kind)(name, documentation, labels, **kwargs)
+
+
+def available():
+    return prom is not None
+
+
+HTTP_LATENCY = _metric(
+    "Histogram", "nfce_http_request_duration_seconds", "Latência dos endpoints da API",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+# Etapas: queue_wait (fila até o início), startup (início até o spider
+# abrir), fetch (cada download), parse, write (commit de um lote) e crawl
+# (do envio ao motor até o resultado)
+CRAWL_STAGE = _metric(
+    "Histogram", "nfce_crawl_stage_duration_seconds", "Duração de cada etapa da ingestão",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+CRAWLS = _metric(
+    "Counter", "nfce_crawls", "Crawls concluídos por resultado (success, empty, timeout, circuit_open, ...)",
+    ["outcome"],
+)
+FETCHES = _metric(
+    "Counter", "nfce_fetches", "Downloads de páginas da SEFAZ por host e resultado",
+    ["host", "outcome"],
+)
+NOTES_WRITTEN = _metric("Counter", "nfce_notes_written", "Notas gravadas no SQLite", [])
+
+# Etapas de cada crawl também vão para as stats do Scrapy com este prefixo;
+# o motor em processo as devolve ao worker, que grava os tempos no job
+STAGE_STATS_PREFIX = "nfce/timing/"
+
+
+def observe_stage(stage, seconds, stats=None):
+    """Registra a duração de uma etapa no histograma e nas stats do crawl, se houver"""
+    CRAWL_STAGE.labels(stage).observe(seconds)
+    if stats is not None:
+        stats.inc_value(STAGE_STATS_PREFIX + stage, seconds)
+
+
+class StoreCollector:
+    """Medidas lidas na hora da coleta: fila, itens e tamanho dos bancos"""
+
+    def __init__(self, item_store, job_store):
+        self.item_store = item_store
+        self.job_store = job_store
+
+    def collect(self):
+        queue = GaugeMetricFamily("nfce_queue_urls", "URLs na fila por status", labels=["status"])
+        for status, count in self.job_store.status_counts().items():
+            queue.add_metric([status], count)
+        yield queue
+
+        stats = self.item_store.stats(top=0)
+        yield GaugeMetricFamily("nfce_items", "Itens armazenados", value=stats["total_items"])
+        yield GaugeMetricFamily("nfce_stores", "Estabelecimentos distintos", value=stats["store_count"])
+
+        size = GaugeMetricFamily("nfce_db_size_bytes", "Tamanho dos bancos SQLite (com o WAL)", labels=["db"])
+        for name, path in (("items", self.item_store.path), ("jobs", self.job_store.path)):
+            size.add_metric([name], sum(
+                os.path.getsize(file) for file in (path, path + "-wal") if os.path.exists(file)
+            ))
+        yield size
+
+
+def exposition(*collectors):
+    """(corpo, content type) do /metrics, com os coletores extras"""
+    registry = prom.CollectorRegistry()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        MultiProcessCollector(registry)
+    else:
+        registry.register(_ProcessRegistry())
+    for collector in collectors:
+        registry.register(collector)
+    return prom.generate_latest(registry), prom.CONTENT_TYPE_LATEST
+
+
+class _ProcessRegistry:
+    """Métricas deste processo (registro padrão) dentro de um registro por coleta"""
+
+    def collect(self):
+        return prom.REGISTRY.collect()
@@ -3,11 +3,25 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import random
+import time
+from urllib.parse import urlparse
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import TextResponse
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import defer, error, threads
+from twisted.internet.task import deferLater
+from twisted.web._newclient import ResponseFailed
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from nfceReader import metrics
+from nfceReader.notes import extract_access_key
+from nfceReader.pagecache import PageCache
+
 
 class NfcereaderSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +115,221 @@ class NfcereaderDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class PageCacheMiddleware:
+    """Guarda o HTML de cada nota baixada no PageCache, pela chave de acesso.
+
+    Fica entre o HttpCompressionMiddleware (590), para receber o corpo já
+    descompactado, e o MetaRefreshMiddleware (580); só páginas 200 com chave
+    de acesso são guardadas. A gravação (gzip, arquivo e SQLite, que pode
+    esperar pelo lock) roda numa thread: na thread do reactor ela pararia
+    todos os crawls do processo.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PAGE_CACHE_ENABLED"):
+            raise NotConfigured
+        return cls(PageCache(
+            settings.get("PAGE_CACHE_DIR"),
+            settings.getint("PAGE_CACHE_MAX_BYTES"),
+            settings.get("NFCE_DB"),
+        ))
+
+    async def process_response(self, request, response, spider):
+        if response.status != 200 or not isinstance(response, TextResponse):
+            return response
+        access_key = extract_access_key(request.url) or extract_access_key(getattr(spider, "url", None))
+        if access_key:
+            try:
+                await maybe_deferred_to_future(threads.deferToThread(
+                    self.cache.put, access_key, response.url, response.body, response.encoding
+                ))
+            except Exception as e:
+                spider.logger.error(f"Erro ao guardar página no cache: {str(e)}")
+        return response
+
+
+class CircuitBreaker:
+    """Disjuntor de um host: abre após `failures` falhas seguidas.
+
+    Aberto, rejeita tudo por `reset_timeout` segundos; depois deixa passar
+    uma única requisição de teste (meio-aberto), que fecha o circuito se
+    der certo ou o reabre se falhar.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures=5, reset_timeout=30.0):
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def retry_after(self, now):
+        return max(0.0, self.opened_at + self.reset_timeout - now)
+
+    def rejecting(self, now):
+        """Se allow() recusaria agora, sem consumir a requisição de teste"""
+        return self.state != self.CLOSED and now - self.opened_at < self.reset_timeout
+
+    def allow(self, now):
+        if self.state == self.CLOSED:
+            return True
+        # Aberto há reset_timeout (ou teste sem resposta há tanto tempo): novo teste
+        if now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self, now):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.max_failures:
+            self.state = self.OPEN
+            self.opened_at = now
+
+
+# Disjuntores por host, compartilhados pelos crawlers do processo (todos na
+# thread do reactor). No motor por subprocess cada crawl tem os seus.
+_breakers = {}
+
+
+def circuit_retry_after(host, now):
+    """Segundos até o disjuntor do host aceitar um teste, ou None se não estiver recusando.
+
+    O motor em processo consulta antes de enfileirar o crawl, para a nota
+    ser rejeitada sem esperar vaga nem ritmo do host.
+    """
+    breaker = _breakers.get(host)
+    if breaker is None or not breaker.rejecting(now):
+        return None
+    return breaker.retry_after(now)
+
+
+def failure_cause(exception):
+    """Classe de uma falha de download, para métricas (timeout, dns, connection...)"""
+    if isinstance(exception, (defer.TimeoutError, error.TimeoutError, error.TCPTimedOutError)):
+        return "timeout"
+    if isinstance(exception, error.DNSLookupError):
+        return "dns"
+    if isinstance(exception, (error.ConnectError, error.ConnectionLost, ResponseFailed)):
+        return "connection"
+    return "network"
+
+
+class ResilienceMiddleware:
+    """Retentativas com backoff exponencial, disjuntor por host e orçamento
+    de latência.
+
+    Substitui o RetryMiddleware (RETRY_ENABLED = False). Cada tentativa tem
+    no máximo NFCE_LATENCY_BUDGET segundos e a soma das tentativas não passa
+    de NFCE_TOTAL_BUDGET; com o portal fora do ar o disjuntor rejeita as
+    notas na hora, em vez de prender um worker até o timeout.
+    """
+
+    def __init__(self, settings, stats):
+        self.stats = stats
+        self.max_retries = settings.getint("NFCE_RETRY_TIMES")
+        self.backoff_base = settings.getfloat("NFCE_RETRY_BACKOFF_BASE")
+        self.backoff_max = settings.getfloat("NFCE_RETRY_BACKOFF_MAX")
+        self.retry_codes = {int(code) for code in settings.getlist("NFCE_RETRY_HTTP_CODES")}
+        self.latency_budget = settings.getfloat("NFCE_LATENCY_BUDGET")
+        self.total_budget = settings.getfloat("NFCE_TOTAL_BUDGET")
+        self.breaker_failures = settings.getint("NFCE_BREAKER_FAILURES")
+        self.breaker_reset = settings.getfloat("NFCE_BREAKER_RESET")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.stats)
+
+    def _breaker(self, request):
+        host = urlparse(request.url).hostname or ""
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return host, breaker
+
+    def process_request(self, request, spider):
+        now = time.monotonic()
+        host, breaker = self._breaker(request)
+        if not breaker.allow(now):
+            retry_after = breaker.retry_after(now)
+            reason = f"Portal {host} indisponível; nova tentativa em {retry_after:.0f}s"
+            # Lidos pelo motor em processo para reagendar a nota sem gastar tentativa
+            self.stats.set_value("nfce/failure_reason", reason)
+            self.stats.set_value("nfce/retry_after", retry_after)
+            self.stats.inc_value("nfce/circuit_rejected")
+            metrics.FETCHES.labels(host, "circuit_open").inc()
+            raise IgnoreRequest(reason)
+
+        deadline = request.meta.setdefault("nfce_deadline", now + self.total_budget)
+        remaining = deadline - now
+        if remaining <= 0:
+            self.stats.set_value("nfce/failure_reason", "Orçamento de latência esgotado")
+            self.stats.set_value("nfce/failure_cause", "budget")
+            raise IgnoreRequest("Orçamento de latência esgotado")
+        request.meta["download_timeout"] = min(self.latency_budget, remaining)
+        return None
+
+    async def process_response(self, request, response, spider):
+        host, breaker = self._breaker(request)
+        metrics.FETCHES.labels(host, f"{response.status // 100}xx").inc()
+        if response.status not in self.retry_codes:
+            breaker.record_success()
+            return response
+        breaker.record_failure(time.monotonic())
+        retry = await self._retry(request, f"HTTP {response.status}", spider)
+        if retry is None:
+            self.stats.set_value("nfce/failure_reason", f"Portal {host} respondeu HTTP {response.status}")
+            self.stats.set_value("nfce/failure_cause", f"http_{response.status}")
+            return response
+        return retry
+
+    async def process_exception(self, request, exception, spider):
+        if isinstance(exception, IgnoreRequest):
+            return None
+        host, breaker = self._breaker(request)
+        cause = failure_cause(exception)
+        metrics.FETCHES.labels(host, cause).inc()
+        breaker.record_failure(time.monotonic())
+        retry = await self._retry(request, type(exception).__name__, spider)
+        if retry is None:
+            self.stats.set_value("nfce/failure_reason", f"Falha ao acessar {host}: {exception}")
+            self.stats.set_value("nfce/failure_cause", cause)
+        return retry
+
+    async def _retry(self, request, reason, spider):
+        """Nova tentativa após o backoff, se couber no limite e no orçamento"""
+        retries = request.meta.get("nfce_retry_times", 0) + 1
+        host, breaker = self._breaker(request)
+        if retries > self.max_retries or breaker.state == CircuitBreaker.OPEN:
+            self.stats.inc_value("nfce/retry/max_reached")
+            return None
+
+        # Backoff exponencial com jitter ("full jitter")
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (retries - 1)))
+        if time.monotonic() + delay >= request.meta["nfce_deadline"]:
+            self.stats.inc_value("nfce/retry/budget_exhausted")
+            return None
+
+        from twisted.internet import reactor
+
+        spider.logger.warning(f"Tentativa {retries}/{self.max_retries} para {request.url} ({reason})")
+        self.stats.inc_value("nfce/retry/count")
+        await maybe_deferred_to_future(deferLater(reactor, delay, lambda: None))
+        retry_request = request.copy()
+        retry_request.meta["nfce_retry_times"] = retries
+        retry_request.dont_filter = True
+        return retry_request
+
@@ -0,0 +1,76 @@
+# Normalização numérica dos itens na ingestão.
+#
+# A SEFAZ publica valores no formato brasileiro ("1.234,56", "-0,50").
+# Aqui eles são convertidos uma única vez: valores e descontos em centavos
+# inteiros, quantidades em decimal exato (texto canônico, ex. "1.5").
+# Campos que não seguem o formato são apontados em `issues`, em vez de
+# virarem zero silenciosamente.
+
+import re
+from decimal import ROUND_HALF_UP, Decimal
+
+# Milhar opcional com ponto, decimais com vírgula; sinal só à esquerda
+BR_NUMBER_RE = re.compile(r"^-?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?$")
+
+CENT = Decimal("0.01")
+
+
+def parse_br_decimal(text):
+    """"1.234,56" -> Decimal("1234.56"); None se o texto não for um número válido"""
+    text = (text or "").strip()
+    if not BR_NUMBER_RE.match(text):
+        return None
+    return Decimal(text.replace(".", "").replace(",", "."))
+
+
+def to_cents(value):
+    """Decimal em reais -> centavos inteiros (arredondamento comercial)"""
+    return int((value / CENT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def normalize_item(item):
+    """Calcula os campos numéricos de um item com os textos do spider.
+
+    Retorna dict com valor_cents (com sinal), desconto_cents (positivo),
+    quantidade_num e issues (lista de problemas encontrados; vazia se o
+    item está correto).
+    """
+    issues = []
+
+    valor = parse_br_decimal(item.get("valor"))
+    if valor is None:
+        issues.append(f"valor inválido: {item.get('valor')!r}")
+        valor_cents = None
+    else:
+        valor_cents = to_cents(valor)
+        # Item com valor negativo não é venda: fica com o sinal e marcado
+        if valor < 0:
+            issues.append(f"valor negativo: {item.get('valor')!r}")
+        if valor != valor.quantize(CENT):
+            issues.append(f"valor com mais de 2 casas: {item.get('valor')!r}")
+
+    desconto_text = item.get("desconto")
+    if desconto_text:
+        desconto = parse_br_decimal(desconto_text)
+        if desconto is None:
+            issues.append(f"desconto inválido: {desconto_text!r}")
+            desconto_cents = 0
+        else:
+            desconto_cents = to_cents(abs(desconto))
+    else:
+        desconto_cents = 0
+
+    quantidade = parse_br_decimal(item.get("quantidade"))
+    if quantidade is None:
+        issues.append(f"quantidade inválida: {item.get('quantidade')!r}")
+        quantidade_num = None
+    else:
+        # normalize() tira zeros à direita; "f" evita notação exponencial (10 -> "1E+1")
+        quantidade_num = format(quantidade.normalize(), "f")
+
+    return {
+        "valor_cents": valor_cents,
+        "desconto_cents": desconto_cents,
+        "quantidade_num": quantidade_num,
+        "issues": issues,
+    }
@@ -0,0 +1,91 @@
+# Índice persistente das notas já ingeridas, pela chave de acesso.
+#
+# A chave de acesso (44 dígitos) vem no parâmetro `p=` da URL do QR Code
+# (p=<chave>|<versão>|<ambiente>|...). Consultar o índice antes do crawl
+# evita um novo acesso à SEFAZ e linhas duplicadas nos dados.
+
+import re
+import time
+from urllib.parse import parse_qs, urlparse
+
+from nfceReader.storage import NFCE_DB, connect
+
+ACCESS_KEY_RE = re.compile(r"(?<!\d)\d{44}(?!\d)")
+
+
+def check_digit(key43):
+    """Dígito verificador (módulo 11) dos 43 primeiros dígitos da chave"""
+    total = 0
+    weight = 2
+    for digit in reversed(key43):
+        total += int(digit) * weight
+        weight = 2 if weight == 9 else weight + 1
+    dv = 11 - total % 11
+    return 0 if dv >= 10 else dv
+
+
+def is_valid_access_key(key):
+    """Confere o tamanho e o dígito verificador (módulo 11) da chave"""
+    if not key or len(key) != 44 or not key.isdigit():
+        return False
+    return check_digit(key[:43]) == int(key[43])
+
+
+def extract_access_key(url):
+    """Extrai a chave de acesso da URL do QR Code, ou None se não houver"""
+    if not url:
+        return None
+    query = parse_qs(urlparse(url.strip()).query)
+    for param in ("p", "chNFe"):
+        for value in query.get(param, []):
+            key = value.split("|", 1)[0].strip()
+            if is_valid_access_key(key):
+                return key
+    # Alguns portais usam outros formatos; aceita qualquer sequência válida
+    for match in ACCESS_KEY_RE.finditer(url):
+        if is_valid_access_key(match.group()):
+            return match.group()
+    return None
+
+
+class NoteIndex:
+    """Chaves de acesso já ingeridas (B-tree do SQLite, O(log n) por consulta)"""
+
+    def __init__(self, path=NFCE_DB):
+        self.path = path
+
+    def _connect(self):
+        return connect(self.path)
+
+    def get(self, key):
+        """Retorna {access_key, url, ingested_at} se a nota já foi ingerida"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT access_key, url, ingested_at FROM notes WHERE access_key = ?", (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {"access_key": row[0], "url": row[1], "ingested_at": row[2]}
+
+    def contains(self, key):
+        return self.get(key) is not None
+
+    def contains_url(self, url):
+        """Atalho: extrai a chave da URL e consulta o índice"""
+        key = extract_access_key(url)
+        return key is not None and self.contains(key)
+
+    def add(self, key, url):
+        """Registra a nota; retorna False se ela já estava no índice"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO notes (access_key, url, ingested_at) VALUES (?, ?, ?)",
+                (key, url, time.time())
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
@@ -0,0 +1,150 @@
+# Cache das páginas brutas da SEFAZ, para reprocessar sem acessar a rede.
+#
+# O HTML de cada nota é gravado comprimido (gzip) num arquivo endereçado
+# pelo SHA-256 do conteúdo; a tabela `pages` do banco liga a chave de
+# acesso ao arquivo. Passado o limite de tamanho, as páginas buscadas há
+# mais tempo são descartadas primeiro.
+
+import gzip
+import hashlib
+import logging
+import os
+import time
+
+from nfceReader.storage import NFCE_DB, PROJECT_ROOT, connect
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", os.path.join(PROJECT_ROOT, "page_cache"))
+PAGE_CACHE_MAX_BYTES = int(float(os.environ.get("PAGE_CACHE_MAX_MB", 512)) * 1024 * 1024)
+
+
+class PageCache:
+    """Páginas comprimidas por conteúdo, indexadas pela chave de acesso"""
+
+    def __init__(self, directory=PAGE_CACHE_DIR, max_bytes=PAGE_CACHE_MAX_BYTES, db_path=NFCE_DB):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.html.gz")
+
+    def put(self, access_key, url, body, encoding="utf-8"):
+        """Guarda a página da nota (substitui a anterior) e aplica o limite de tamanho"""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+        else:
+            data = gzip.compress(body, mtime=0)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Grava num temporário e renomeia: leitores nunca veem arquivo pela metade
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            size = len(data)
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            previous = conn.execute("SELECT digest FROM pages WHERE access_key = ?", (access_key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (access_key, digest, url, encoding, size, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (access_key, digest, url, encoding, size, time.time())
+            )
+            orphans = self._orphans(conn, [previous[0]] if previous and previous[0] != digest else [])
+            orphans += self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        self._unlink(orphans)
+        return digest
+
+    def get(self, access_key):
+        """Retorna {url, encoding, body} da nota, ou None se não estiver no cache"""
+        entry = self.entry(access_key)
+        if entry is None:
+            return None
+        try:
+            entry["body"] = self.read(entry["digest"])
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def entry(self, access_key):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT access_key, digest, url, encoding FROM pages WHERE access_key = ?", (access_key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {"access_key": row[0], "digest": row[1], "url": row[2], "encoding": row[3]}
+
+    def read(self, digest):
+        with gzip.open(self.path_for(digest), "rb") as f:
+            return f.read()
+
+    def entries(self, keys=None):
+        """Lista as páginas do cache (todas ou só as das chaves informadas)"""
+        sql = "SELECT access_key, digest, url, encoding FROM pages"
+        params = []
+        if keys:
+            sql += f" WHERE access_key IN ({', '.join('?' * len(keys))})"
+            params = list(keys)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql + " ORDER BY fetched_at", params).fetchall()
+        finally:
+            conn.close()
+        return [{"access_key": k, "digest": d, "url": u, "encoding": e} for k, d, u, e in rows]
+
+    def total_size(self, conn):
+        return conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM pages)"
+        ).fetchone()[0]
+
+    def _evict(self, conn):
+        """Remove as páginas mais antigas até caber no limite; retorna os arquivos órfãos"""
+        orphans = []
+        total = self.total_size(conn)
+        while total > self.max_bytes:
+            oldest = conn.execute(
+                "SELECT access_key, digest, size FROM pages ORDER BY fetched_at LIMIT 1"
+            ).fetchone()
+            if oldest is None:
+                break
+            access_key, digest, size = oldest
+            conn.execute("DELETE FROM pages WHERE access_key = ?", (access_key,))
+            freed = self._orphans(conn, [digest])
+            if freed:
+                orphans += freed
+                total -= size
+        return orphans
+
+    def _orphans(self, conn, digests):
+        """Dos digests informados, os que não são mais usados por nenhuma nota"""
+        return [
+            digest for digest in digests
+            if conn.execute("SELECT 1 FROM pages WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None
+        ]
+
+    def _unlink(self, digests):
+        for digest in digests:
+            try:
+                os.remove(self.path_for(digest))
+            except FileNotFoundError:
+                pass
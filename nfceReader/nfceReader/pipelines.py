@@ -4,10 +4,100 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+import time
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from twisted.internet.defer import Deferred
+
+from nfceReader import metrics
+from nfceReader.normalize import normalize_item
+from nfceReader.notes import NoteIndex, extract_access_key
+from nfceReader.storage import NFCE_DB
+from nfceReader.writer import get_writer
 
 
 class NfcereaderPipeline:
+    """Converte valor, desconto e quantidade uma única vez, na ingestão.
+
+    Itens com campos fora do formato ou valor negativo seguem marcados em
+    `issues` (e ficam de fora das somas de valor e desconto do /api/stats);
+    com NFCE_REJECT_MALFORMED são descartados.
+    """
+
+    def __init__(self, reject_malformed=False):
+        self.reject_malformed = reject_malformed
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.getbool("NFCE_REJECT_MALFORMED"))
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        values = normalize_item(adapter)
+        if values["issues"]:
+            if self.reject_malformed:
+                raise DropItem(f"Item malformado: {'; '.join(values['issues'])}")
+            spider.logger.warning(f"Item com problemas ({adapter.get('name')}): {'; '.join(values['issues'])}")
+        for field, value in values.items():
+            adapter[field] = value
+        return item
+
+
+class StoragePipeline:
+    """Grava os itens da nota no SQLite, junto com a chave de acesso.
+
+    Os itens são acumulados durante o crawl e entregues ao escritor do
+    processo ao fechar o spider, que os grava em commit em grupo com as
+    notas de outros crawls; se a nota já estiver no índice (outro crawl a
+    ingeriu antes), os itens são descartados.
+    """
+
+    def __init__(self, db_path):
+        self.writer = get_writer(db_path)
+        self.index = NoteIndex(db_path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("NFCE_DB", NFCE_DB))
+
+    def open_spider(self, spider):
+        self.url = getattr(spider, "url", None)
+        self.access_key = extract_access_key(self.url)
+        self.items = []
+        self.duplicate = None
+
     def process_item(self, item, spider):
+        if self.access_key:
+            if self.duplicate is None:
+                self.duplicate = self.index.contains(self.access_key)
+            if self.duplicate:
+                raise DropItem(f"NFCe {self.access_key} já ingerida")
+        self.items.append(ItemAdapter(item).asdict())
         return item
+
+    def close_spider(self, spider):
+        if not self.items:
+            return None
+        from twisted.internet import reactor
+
+        # O spider só fecha depois do commit, sem bloquear o reactor
+        done = Deferred()
+        submitted = time.perf_counter()
+        future = self.writer.submit(self.items, self.access_key, self.url)
+        future.add_done_callback(lambda f: reactor.callFromThread(self._written, f, done, spider, submitted))
+        return done
+
+    def _written(self, future, done, spider, submitted):
+        # Espera pelo lote mais o commit; o histograma "write" mede só o commit
+        crawler = getattr(spider, "crawler", None)
+        if crawler is not None:
+            crawler.stats.inc_value(metrics.STAGE_STATS_PREFIX + "write", time.perf_counter() - submitted)
+        error = future.exception()
+        if error is not None:
+            done.errback(error)
+            return
+        if not future.result():
+            spider.logger.warning(f"NFCe {self.access_key} já ingerida por outro crawl; itens descartados")
+        done.callback(None)
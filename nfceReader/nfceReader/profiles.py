@@ -0,0 +1,84 @@
+# Perfis por portal SEFAZ: concorrência e ritmo de cada host.
+#
+# O host da URL do QR Code escolhe o perfil. O motor em processo usa a
+# concorrência e o atraso do perfil para limitar os crawls simultâneos e
+# espaçar o início deles por host (HostThrottle, no estilo do AutoThrottle
+# do Scrapy, mas entre crawlers).
+#
+# Os limites valem por processo: cada processo que drena a fila tem seu
+# próprio semáforo e HostThrottle. Por isso só um processo por banco de
+# jobs drena (jobs.DrainLock); bancos separados somam as cotas no portal.
+
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+
+@dataclass(frozen=True)
+class HostProfile:
+    uf: str
+    hosts: tuple
+    # Crawls simultâneos no host e atraso mínimo entre inícios (s)
+    concurrency: int = 4
+    delay: float = 0.25
+    # Crawls "em voo" que o ajuste adaptativo tenta manter e teto do atraso
+    target_concurrency: float = 2.0
+    max_delay: float = 10.0
+
+
+# Todos os portais abaixo usam o leiaute de consulta que o spider entende
+# (txtTopo / "Item + N").
+PROFILES = [
+    HostProfile("PR", ("www.fazenda.pr.gov.br", "www.sped.fazenda.pr.gov.br"), concurrency=4, delay=0.5),
+    HostProfile("SP", ("www.nfce.fazenda.sp.gov.br",), concurrency=2, delay=1.0, target_concurrency=1.0),
+    HostProfile("RS", ("www.sefaz.rs.gov.br", "dfe-portal.svrs.rs.gov.br"), concurrency=4, delay=0.5),
+    HostProfile("SC", ("sat.sef.sc.gov.br",), concurrency=2, delay=1.0),
+    HostProfile("MG", ("portalsped.fazenda.mg.gov.br",), concurrency=2, delay=1.0, target_concurrency=1.0),
+    HostProfile("RJ", ("consultadfe.fazenda.rj.gov.br", "www4.fazenda.rj.gov.br"), concurrency=2, delay=1.0),
+]
+
+# Hosts fora do registro: ritmo conservador
+DEFAULT_PROFILE = HostProfile("", (), concurrency=2, delay=1.0, target_concurrency=1.0)
+
+_BY_HOST = {host: profile for profile in PROFILES for host in profile.hosts}
+
+
+def all_hosts():
+    return list(_BY_HOST)
+
+
+def profile_for_host(host, default=DEFAULT_PROFILE):
+    return _BY_HOST.get((host or "").lower(), default)
+
+
+def profile_for_url(url, default=DEFAULT_PROFILE):
+    return profile_for_host(urlparse(url or "").hostname, default)
+
+
+class HostThrottle:
+    """Ritmo adaptativo de um host, compartilhado pelos crawls dele neste processo.
+
+    Como o AutoThrottle: o atraso tende a latência / concorrência alvo,
+    nunca abaixo do atraso do perfil; falhas dobram o atraso (até o teto).
+    Não é thread-safe: o motor só o usa na thread do reactor.
+    """
+
+    def __init__(self, profile, concurrency=None):
+        self.profile = profile
+        self.concurrency = concurrency or profile.concurrency
+        self.delay = profile.delay
+        self.next_start = 0.0
+
+    def reserve(self, now):
+        """Reserva o próximo horário de início; retorna quanto esperar (s)"""
+        start = max(now, self.next_start)
+        self.next_start = start + self.delay
+        return start - now
+
+    def record(self, latency, ok):
+        profile = self.profile
+        if ok:
+            target = latency / profile.target_concurrency
+            self.delay = (self.delay + target) / 2
+        else:
+            self.delay = self.delay * 2 or profile.delay or 0.5
+        self.delay = min(profile.max_delay, max(profile.delay, self.delay))
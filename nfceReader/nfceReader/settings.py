@@ -7,6 +7,13 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+# Banco SQLite do projeto (itens e índice de notas); sobrescreva com a variável NFCE_DB
+from nfceReader.storage import NFCE_DB
+# Perfis por portal SEFAZ (ver profiles.py)
+from nfceReader import profiles
+# Cache de páginas brutas (ver pagecache.py)
+from nfceReader.pagecache import PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES
+
 BOT_NAME = "nfceReader"
 
 SPIDER_MODULES = ["nfceReader.spiders"]
@@ -27,9 +34,29 @@ ROBOTSTXT_OBEY = True
 # See also autothrottle settings and docs
 #DOWNLOAD_DELAY = 3
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+# Também é o máximo de conexões keep-alive por host no pool compartilhado
+CONCURRENT_REQUESTS_PER_DOMAIN = max(profile.concurrency for profile in profiles.PROFILES)
 #CONCURRENT_REQUESTS_PER_IP = 16
 
+# Retentativas, disjuntor por host e orçamento de latência ficam no
+# ResilienceMiddleware (o RetryMiddleware padrão é desligado). O orçamento
+# total deve ficar abaixo do PROCESS_TIMEOUT da aplicação (30s).
+RETRY_ENABLED = False
+NFCE_RETRY_TIMES = 2
+NFCE_RETRY_BACKOFF_BASE = 0.5
+NFCE_RETRY_BACKOFF_MAX = 4.0
+NFCE_RETRY_HTTP_CODES = [408, 429, 500, 502, 503, 504, 522, 524]
+NFCE_LATENCY_BUDGET = 10.0
+NFCE_TOTAL_BUDGET = 25.0
+NFCE_BREAKER_FAILURES = 5
+NFCE_BREAKER_RESET = 30.0
+
+# Pool de conexões HTTP compartilhado entre crawlers (ver handlers.py)
+DOWNLOAD_HANDLERS = {
+    "http": "nfceReader.handlers.SharedPoolDownloadHandler",
+    "https": "nfceReader.handlers.SharedPoolDownloadHandler",
+}
+
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
 
@@ -50,22 +77,44 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "nfceReader.middlewares.NfcereaderDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
+    "nfceReader.middlewares.ResilienceMiddleware": 550,
+    # Entre o MetaRefreshMiddleware (580) e o HttpCompressionMiddleware (590)
+    "nfceReader.middlewares.PageCacheMiddleware": 585,
+}
+
+# Cache das páginas brutas; diretório e limite vêm de PAGE_CACHE_DIR e
+# PAGE_CACHE_MAX_MB (importados acima). `scrapy reprocess` reinterpreta as
+# notas a partir dele, sem rede
+PAGE_CACHE_ENABLED = True
+
+# Extração em uma passada com lxml; False volta aos seletores CSS originais
+# (os dois caminhos são comparados por `scrapy parsecheck`)
+NFCE_FAST_PARSE = True
+COMMANDS_MODULE = "nfceReader.commands"
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+# Métricas Prometheus da partida do crawl e dos downloads (ver metrics.py)
+EXTENSIONS = {
+    "nfceReader.extensions.MetricsExtension": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "nfceReader.pipelines.NfcereaderPipeline": 300,
-#}
-
+ITEM_PIPELINES = {
+    "nfceReader.pipelines.NfcereaderPipeline": 200,
+    "nfceReader.pipelines.StoragePipeline": 300,
+}
+
+# Itens com valor/quantidade fora do formato: marcados em `issues` (False)
+# ou descartados (True)
+NFCE_REJECT_MALFORMED = False
+
+# Cada nota é um crawl de uma requisição: o ritmo por portal (concorrência,
+# atraso e ajuste adaptativo) fica no motor em processo, pelos perfis de
+# profiles.py, e não no AutoThrottle de cada crawler.
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -1,24 +1,20 @@
+import time
+
 import scrapy
 
+from nfceReader import fastparse, metrics
+from nfceReader.items import NfcereaderItem
+from nfceReader.profiles import all_hosts
+
 class NfcedataSpider(scrapy.Spider):
     name = "nfcedata"
-    allowed_domains = ["www.fazenda.pr.gov.br"]
+    # Portais do registro de perfis (profiles.py)
+    allowed_domains = all_hosts()
 
     custom_settings = {
         "ROBOTSTXT_OBEY": False, #
         "USER_AGENT": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36", #
-        "FEEDS": {
-            "../nfc_data.csv": {
-                "format": "csv",
-                "encoding": "utf-8-sig",
-                "item_export_kwargs": {
-                    "include_headers_line": False, 
-                    "delimiter": ";",             
-                },
-                "overwrite": False,
-            }
-        },
-        # Definição da ordem das colunas no CSV
+        # Itens vão para o SQLite pelo StoragePipeline; ordem das colunas em exports via -o
         "FEED_EXPORT_FIELDS": ["local", "name", "quantidade", "unidade", "valor", "desconto"],
     }
 
@@ -28,6 +24,25 @@ class NfcedataSpider(scrapy.Spider):
             yield scrapy.Request(url, callback=self.parse, dont_filter=True)
 
     def parse(self, response):
+        # Caminho rápido (lxml, uma passada por linha) salvo NFCE_FAST_PARSE=False
+        settings = getattr(self, "settings", None)
+        started = time.perf_counter()
+        if settings is None or settings.getbool("NFCE_FAST_PARSE", True):
+            items = list(self.parse_fast(response))
+        else:
+            items = list(self.parse_selectors(response))
+        # A lista completa separa o tempo de parse do tempo dos pipelines
+        crawler = getattr(self, "crawler", None)
+        metrics.observe_stage("parse", time.perf_counter() - started, crawler.stats if crawler else None)
+        return items
+
+    def parse_fast(self, response):
+        estabelecimento, rows = fastparse.extract(response.selector.root)
+        for row in rows:
+            yield self.build_item(estabelecimento, **row)
+
+    def parse_selectors(self, response):
+        """Extração original por seletores CSS; referência do `scrapy parsecheck`"""
         estabelecimento = response.css("div.txtTopo::text").get()
         if not estabelecimento:
             estabelecimento = response.css("#u20::text").get() 
@@ -40,23 +55,27 @@ class NfcedataSpider(scrapy.Spider):
             un = item.css("td span.RUN::text").get()
             valor = item.css("td span.valor::text").get()
             
-            # Lógica de Desconto:
             # Captura o texto do desconto usando a classe .totalNumb
             raw_desconto = item.css("span.totalNumb::text").get()
-            desconto_final = ""
-
-            if raw_desconto:
-                # Limpa o texto (remove 'Vlr. Desc.:', espaços e converte para número)
-                clean_desc = raw_desconto.replace("Vlr. Desc.:", "").strip()
-                if clean_desc and clean_desc != "0,00":
-                    # Adiciona o sinal de negativo antes do valor
-                    desconto_final = f"-{clean_desc}"
-
-            yield {
-                "local": estabelecimento.strip() if estabelecimento else "Nao identificado",
-                "name": name.strip() if name else "",
-                "quantidade": qtd.strip().replace("Qtde.:", "").strip() if qtd else "",
-                "unidade": un.strip().replace("UN:", "").strip() if un else "",
-                "valor": valor.strip() if valor else "",
-                "desconto": desconto_final
-            }
\ No newline at end of file
+
+            yield self.build_item(estabelecimento, name, qtd, un, valor, raw_desconto)
+
+    @staticmethod
+    def build_item(estabelecimento, name, qtd, un, valor, raw_desconto):
+        # Lógica de Desconto:
+        desconto_final = ""
+        if raw_desconto:
+            # Limpa o texto (remove 'Vlr. Desc.:', espaços e converte para número)
+            clean_desc = raw_desconto.replace("Vlr. Desc.:", "").strip()
+            if clean_desc and clean_desc != "0,00":
+                # Adiciona o sinal de negativo antes do valor
+                desconto_final = f"-{clean_desc}"
+
+        return NfcereaderItem(
+            local=estabelecimento.strip() if estabelecimento else "Nao identificado",
+            name=name.strip() if name else "",
+            quantidade=qtd.strip().replace("Qtde.:", "").strip() if qtd else "",
+            unidade=un.strip().replace("UN:", "").strip() if un else "",
+            valor=valor.strip() if valor else "",
+            desconto=desconto_final
+        )
@@ -0,0 +1,496 @@
+# Armazenamento dos itens das notas em SQLite (modo WAL).
+#
+# Substitui o antigo nfc_data.csv: o pipeline do spider grava aqui e os
+# endpoints da aplicação web consultam por índice, sem reler o histórico.
+# CSV continua disponível como formato de exportação.
+
+import csv
+import io
+import os
+import sqlite3
+import time
+
+from nfceReader.normalize import normalize_item
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+NFCE_DB = os.environ.get("NFCE_DB", os.path.join(PROJECT_ROOT, "nfce.db"))
+
+# Campos do item do spider e o cabeçalho correspondente no CSV exportado
+EXPORT_FIELDS = [
+    ("local", "Estabelecimento"),
+    ("name", "Produto"),
+    ("quantidade", "Quantidade"),
+    ("unidade", "Unidade"),
+    ("valor", "Valor_Total"),
+    ("desconto", "Desconto"),
+]
+ITEM_FIELDS = [field for field, _ in EXPORT_FIELDS]
+# Campos numéricos calculados na ingestão (ver normalize.py)
+NORMALIZED_FIELDS = ["valor_cents", "desconto_cents", "quantidade_num", "issues"]
+
+# Colunas tipadas dos exports (NDJSON, Parquet, Arrow)
+RECORD_FIELDS = ["id", "access_key", "local", "name", "quantidade_num", "unidade",
+                 "valor_cents", "desconto_cents", "issues", "url", "ingested_at"]
+
+# Versão do schema em PRAGMA user_version; _migrate atualiza bancos antigos
+SCHEMA_VERSION = 2
+
+_STATS_TOTALS_TABLE = """
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_items INTEGER NOT NULL,
+        total_value_cents INTEGER NOT NULL,
+        total_discount_cents INTEGER NOT NULL,
+        flagged_items INTEGER NOT NULL,
+        store_count INTEGER NOT NULL
+    )"""
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS notes (
+        access_key TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        ingested_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS items (
+        id INTEGER PRIMARY KEY,
+        access_key TEXT,
+        local TEXT NOT NULL DEFAULT '',
+        name TEXT NOT NULL DEFAULT '',
+        quantidade TEXT NOT NULL DEFAULT '',
+        unidade TEXT NOT NULL DEFAULT '',
+        valor TEXT NOT NULL DEFAULT '',
+        desconto TEXT NOT NULL DEFAULT '',
+        url TEXT,
+        ingested_at REAL NOT NULL,
+        valor_cents INTEGER,
+        desconto_cents INTEGER NOT NULL DEFAULT 0,
+        quantidade_num TEXT,
+        issues TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_items_local ON items (local);
+    CREATE INDEX IF NOT EXISTS idx_items_name ON items (name);
+    CREATE INDEX IF NOT EXISTS idx_items_ingested_at ON items (ingested_at);
+
+    -- Agregados mantidos a cada ingestão (linha única) e contagem por
+    -- estabelecimento, indexada por contagem para o top-k do /api/stats
+""" + _STATS_TOTALS_TABLE + """;
+    CREATE TABLE IF NOT EXISTS store_counts (
+        local TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_store_counts_count ON store_counts (count);
+
+    -- Páginas brutas da SEFAZ guardadas pelo cache (ver pagecache.py)
+    CREATE TABLE IF NOT EXISTS pages (
+        access_key TEXT PRIMARY KEY,
+        digest TEXT NOT NULL,
+        url TEXT NOT NULL,
+        encoding TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        fetched_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_pages_digest ON pages (digest);
+    CREATE INDEX IF NOT EXISTS idx_pages_fetched_at ON pages (fetched_at);
+"""
+
+_initialized_paths = set()
+
+
+def _normalized(item):
+    """Campos numéricos do item; calcula se ainda não passaram pelo pipeline"""
+    if "valor_cents" in item:
+        values = {field: item.get(field) for field in NORMALIZED_FIELDS}
+    else:
+        values = normalize_item(item)
+    issues = values.get("issues")
+    if isinstance(issues, (list, tuple)):
+        values["issues"] = "; ".join(issues) or None
+    values["desconto_cents"] = values.get("desconto_cents") or 0
+    return values
+
+
+def _migrate(conn):
+    """Atualiza bancos criados por versões anteriores do schema"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            conn.execute("ROLLBACK")
+            return
+
+        # v1: campos numéricos normalizados nos itens e agregados em centavos
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(items)")}
+        if "valor_cents" not in columns:
+            conn.execute("ALTER TABLE items ADD COLUMN valor_cents INTEGER")
+            conn.execute("ALTER TABLE items ADD COLUMN desconto_cents INTEGER NOT NULL DEFAULT 0")
+            conn.execute("ALTER TABLE items ADD COLUMN quantidade_num TEXT")
+            conn.execute("ALTER TABLE items ADD COLUMN issues TEXT")
+            rows = conn.execute("SELECT id, quantidade, valor, desconto FROM items").fetchall()
+            updates = []
+            for item_id, quantidade, valor, desconto in rows:
+                values = _normalized({"quantidade": quantidade, "valor": valor, "desconto": desconto})
+                updates.append((*(values[field] for field in NORMALIZED_FIELDS), item_id))
+            conn.executemany(
+                "UPDATE items SET valor_cents = ?, desconto_cents = ?, quantidade_num = ?, issues = ? WHERE id = ?",
+                updates
+            )
+        totals = {row[1] for row in conn.execute("PRAGMA table_info(stats_totals)")}
+        if "total_value_cents" not in totals:
+            # Recriada vazia: _rebuild_stats recalcula a partir dos itens
+            conn.execute("DROP TABLE stats_totals")
+            conn.execute(_STATS_TOTALS_TABLE)
+
+        # v2: valores negativos marcados (antes viravam positivos) e itens
+        # marcados fora das somas; _rebuild_stats recalcula os agregados
+        if version < 2:
+            rows = conn.execute("SELECT id, quantidade, valor, desconto FROM items WHERE valor LIKE '-%'").fetchall()
+            updates = []
+            for item_id, quantidade, valor, desconto in rows:
+                values = _normalized({"quantidade": quantidade, "valor": valor, "desconto": desconto})
+                updates.append((*(values[field] for field in NORMALIZED_FIELDS), item_id))
+            conn.executemany(
+                "UPDATE items SET valor_cents = ?, desconto_cents = ?, quantidade_num = ?, issues = ? WHERE id = ?",
+                updates
+            )
+            conn.execute("DELETE FROM stats_totals")
+
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _rebuild_stats(conn):
+    """Recalcula os agregados a partir dos itens (bancos criados antes deles)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM stats_totals").fetchone():
+            conn.execute("ROLLBACK")
+            return
+        conn.execute("DELETE FROM store_counts")
+        conn.execute("INSERT INTO store_counts (local, count) SELECT local, COUNT(*) FROM items GROUP BY local")
+        conn.execute(
+            "INSERT INTO stats_totals "
+            "(id, total_items, total_value_cents, total_discount_cents, flagged_items, store_count) "
+            "SELECT 1, COUNT(*), "
+            "COALESCE(SUM(CASE WHEN COALESCE(issues, '') = '' THEN valor_cents END), 0), "
+            "COALESCE(SUM(CASE WHEN COALESCE(issues, '') = '' THEN desconto_cents END), 0), "
+            "COUNT(NULLIF(issues, '')), (SELECT COUNT(*) FROM store_counts) FROM items"
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _apply_stats(conn, rows, sign=1):
+    """Soma (sign=1) ou subtrai (sign=-1) as linhas (local, valor_cents,
+    desconto_cents, issues) dos agregados, na transação aberta.
+
+    Itens marcados em `issues` contam como itens, mas não entram nas somas
+    de valor e desconto.
+    """
+    value = discount = flagged = 0
+    per_store = {}
+    for local, valor_cents, desconto_cents, issues in rows:
+        if issues:
+            flagged += 1
+        else:
+            value += valor_cents or 0
+            discount += desconto_cents or 0
+        per_store[local] = per_store.get(local, 0) + 1
+
+    store_delta = 0
+    for local, count in per_store.items():
+        if sign > 0:
+            cursor = conn.execute("INSERT OR IGNORE INTO store_counts (local, count) VALUES (?, ?)", (local, count))
+            if cursor.rowcount == 1:
+                store_delta += 1
+            else:
+                conn.execute("UPDATE store_counts SET count = count + ? WHERE local = ?", (count, local))
+        else:
+            conn.execute("UPDATE store_counts SET count = count - ? WHERE local = ?", (count, local))
+            cursor = conn.execute("DELETE FROM store_counts WHERE local = ? AND count <= 0", (local,))
+            store_delta -= cursor.rowcount
+
+    conn.execute(
+        "UPDATE stats_totals SET total_items = total_items + ?, total_value_cents = total_value_cents + ?, "
+        "total_discount_cents = total_discount_cents + ?, flagged_items = flagged_items + ?, "
+        "store_count = store_count + ? WHERE id = 1",
+        (sign * len(rows), sign * value, sign * discount, sign * flagged, store_delta)
+    )
+
+
+def _insert_items(conn, items, access_key, url, now):
+    rows = []
+    for item in items:
+        values = _normalized(item)
+        rows.append((*(item.get(field) or "" for field in ITEM_FIELDS),
+                     *(values[field] for field in NORMALIZED_FIELDS)))
+    conn.executemany(
+        "INSERT INTO items (access_key, local, name, quantidade, unidade, valor, desconto, "
+        "valor_cents, desconto_cents, quantidade_num, issues, url, ingested_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(access_key, *row, url, now) for row in rows]
+    )
+    _apply_stats(conn, [(row[0], row[6], row[7], row[9]) for row in rows])
+
+
+def insert_note(conn, items, access_key=None, url=None, now=None):
+    """Insere a nota e seus itens na transação aberta em `conn`.
+
+    Retorna False sem inserir nada se a chave de acesso já estava no índice.
+    """
+    now = now or time.time()
+    if access_key:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO notes (access_key, url, ingested_at) VALUES (?, ?, ?)",
+            (access_key, url or "", now)
+        )
+        if cursor.rowcount == 0:
+            return False
+    _insert_items(conn, items, access_key, url, now)
+    return True
+
+
+def connect(path=NFCE_DB):
+    """Abre uma conexão em modo autocommit, criando o schema na primeira vez"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path not in _initialized_paths:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _migrate(conn)
+        _rebuild_stats(conn)
+        _initialized_paths.add(path)
+    return conn
+
+
+class ItemStore:
+    """Leitura e escrita dos itens ingeridos"""
+
+    def __init__(self, path=NFCE_DB):
+        self.path = path
+
+    def _connect(self):
+        return connect(self.path)
+
+    def add_note(self, items, access_key=None, url=None):
+        """Grava os itens de uma nota numa única transação.
+
+        Com chave de acesso, a nota é registrada no índice junto com os
+        itens; retorna False (sem gravar nada) se ela já tinha sido ingerida.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            inserted = insert_note(conn, items, access_key, url)
+            conn.execute("COMMIT")
+            return inserted
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def replace_note(self, access_key, items, url=None):
+        """Troca os itens de uma nota já ingerida pelos de um novo parse.
+
+        Mantém o horário de ingestão original, para que os filtros por data
+        do /api/data continuem vendo a nota no mesmo lugar.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            note = conn.execute(
+                "SELECT url, ingested_at FROM notes WHERE access_key = ?", (access_key,)
+            ).fetchone()
+            if note is None:
+                now = time.time()
+                conn.execute(
+                    "INSERT INTO notes (access_key, url, ingested_at) VALUES (?, ?, ?)",
+                    (access_key, url or "", now)
+                )
+            else:
+                url = url or note[0]
+                now = note[1]
+                old = conn.execute(
+                    "SELECT local, valor_cents, desconto_cents, issues FROM items WHERE access_key = ?",
+                    (access_key,)
+                ).fetchall()
+                conn.execute("DELETE FROM items WHERE access_key = ?", (access_key,))
+                _apply_stats(conn, old, sign=-1)
+            _insert_items(conn, items, access_key, url, now)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _select(self, columns, store=None, product=None, since=None, until=None, after_id=None, limit=None,
+                max_id=None):
+        """Itera as tuplas `columns` dos itens filtrados, em ordem de id"""
+        where, params = [], []
+        if store:
+            where.append("local = ?")
+            params.append(store)
+        if product:
+            where.append("name LIKE ? ESCAPE '\\'")
+            escaped = product.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if since is not None:
+            where.append("ingested_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ingested_at < ?")
+            params.append(until)
+        if after_id is not None:
+            where.append("id > ?")
+            params.append(after_id)
+        if max_id is not None:
+            where.append("id <= ?")
+            params.append(max_id)
+
+        sql = f"SELECT {', '.join(columns)} FROM items"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        conn = self._connect()
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def iter_rows(self, store=None, product=None, since=None, until=None, after_id=None, limit=None,
+                  max_id=None):
+        """Itera (id, linha) em ordem de ingestão, com os nomes de coluna do CSV.
+
+        Filtros: estabelecimento exato, trecho do nome do produto e intervalo
+        de ingestão (timestamps). `after_id` é o cursor da paginação: a
+        consulta anda pela chave primária, então cada página custa o mesmo.
+        `max_id` fixa o fim da listagem (o cursor dos eventos em /api/events).
+        """
+        for row in self._select(["id", *ITEM_FIELDS], store, product, since, until, after_id, limit, max_id):
+            yield row[0], {header: value for (_, header), value in zip(EXPORT_FIELDS, row[1:])}
+
+    def iter_records(self, **filters):
+        """Itera os itens com os campos tipados (RECORD_FIELDS), para exportação"""
+        for row in self._select(RECORD_FIELDS, **filters):
+            yield dict(zip(RECORD_FIELDS, row))
+
+    def last_id(self):
+        """Maior id de item gravado (0 sem itens)"""
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0]
+        finally:
+            conn.close()
+
+    def count(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        finally:
+            conn.close()
+
+    def stats(self, top=5):
+        """Totais de itens, valor e desconto, e os estabelecimentos com mais itens.
+
+        Lê apenas os agregados mantidos na ingestão: custo constante,
+        independente do tamanho do histórico. Somas exatas em centavos.
+        """
+        conn = self._connect()
+        try:
+            total_items, value_cents, discount_cents, flagged, store_count = conn.execute(
+                "SELECT total_items, total_value_cents, total_discount_cents, flagged_items, store_count "
+                "FROM stats_totals WHERE id = 1"
+            ).fetchone()
+            stores = conn.execute(
+                "SELECT local, count FROM store_counts ORDER BY count DESC LIMIT ?", (top,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        return {
+            "total_items": total_items,
+            "total_value": value_cents / 100,
+            "total_discount": discount_cents / 100,
+            "total_value_cents": value_cents,
+            "total_discount_cents": discount_cents,
+            "flagged_items": flagged,
+            "store_count": store_count,
+            "stores": [{"name": name or "Não identificado", "count": n} for name, n in stores]
+        }
+
+    def clear(self):
+        """Apaga itens e índice de notas numa única transação"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM items")
+            conn.execute("DELETE FROM notes")
+            conn.execute("DELETE FROM store_counts")
+            conn.execute(
+                "UPDATE stats_totals SET total_items = 0, total_value_cents = 0, total_discount_cents = 0, "
+                "flagged_items = 0, store_count = 0"
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def iter_csv(self, **filters):
+        """Exporta os itens como CSV (;), gerado linha a linha"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=";")
+
+        writer.writerow([header for _, header in EXPORT_FIELDS])
+        yield "\ufeff" + buffer.getvalue()
+        for _, row in self.iter_rows(**filters):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row.values())
+            yield buffer.getvalue()
+
+    def import_csv(self, csv_path):
+        """Importa o nfc_data.csv legado se o banco ainda estiver vazio.
+
+        Retorna o número de linhas importadas (0 se já havia dados).
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM items LIMIT 1").fetchone():
+                conn.execute("ROLLBACK")
+                return 0
+            now = time.time()
+            with open(csv_path, mode="r", encoding="utf-8-sig", newline="") as f:
+                reader = csv.reader(f, delimiter=";")
+                items = []
+                for row in reader:
+                    if not row:
+                        continue
+                    # Cada append do feed antigo podia gravar um BOM no meio do arquivo
+                    row[0] = row[0].lstrip("\ufeff")
+                    if row[0] == "Estabelecimento":
+                        continue
+                    items.append(dict(zip(ITEM_FIELDS, row + [""] * len(ITEM_FIELDS))))
+            _insert_items(conn, items, None, None, now)
+            conn.execute("COMMIT")
+            return len(items)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
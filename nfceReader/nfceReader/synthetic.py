@@ -0,0 +1,88 @@
+# Gerador de páginas de NFCe sintéticas no formato da SEFAZ-PR.
+#
+# Reproduz a marcação que o spider consome (txtTopo, tr "Item + N",
+# txtTit2, Rqtd, RUN, valor, totalNumb) com o entorno da página real, para
+# benchmarks e testes de carga. A saída é determinística para a mesma
+# semente.
+
+import random
+from html import escape
+
+from nfceReader.notes import check_digit
+
+BASE_URL = "http://www.fazenda.pr.gov.br/nfce/qrcode"
+
+PRODUCTS = [
+    ("ARROZ TIPO 1 5KG", "UN"), ("FEIJAO CARIOCA 1KG", "UN"), ("LEITE INTEGRAL 1L", "UN"),
+    ("CAFE TORRADO E MOIDO 500G", "UN"), ("ACUCAR CRISTAL 5KG", "UN"), ("OLEO DE SOJA 900ML", "UN"),
+    ("BANANA PRATA", "KG"), ("TOMATE ITALIANO", "KG"), ("CARNE MOIDA PATINHO", "KG"),
+    ("PAO FRANCES", "KG"), ("QUEIJO MUSSARELA FATIADO", "KG"), ("DETERGENTE NEUTRO 500ML", "UN"),
+    ("PAPEL HIGIENICO FOLHA DUPLA 12UN", "PCT"), ("REFRIGERANTE COLA 2L", "UN"), ("AGUA MINERAL 1,5L", "UN"),
+    ("IOGURTE NATURAL 170G", "UN"), ("MACARRAO ESPAGUETE 500G", "UN"), ("SABAO EM PO 1,6KG", "CX"),
+]
+STORES = [
+    "SUPERMERCADO EXEMPLO S/A", "MERCADO BOM PRECO LTDA", "PADARIA E CONFEITARIA CENTRAL LTDA",
+    "ATACADO DO POVO COMERCIO DE ALIMENTOS", "HORTIFRUTI VERDE VIDA ME",
+]
+
+
+def br_number(value, decimals=2):
+    """1234.5 -> "1.234,50" """
+    text = f"{value:,.{decimals}f}"
+    return text.replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def access_key(sequence, uf="41", aamm="2401"):
+    """Chave de acesso válida (modelo 65) para o número de sequência"""
+    key43 = f"{uf}{aamm}{0:014d}65001{sequence:09d}1{sequence % 10 ** 8:08d}"
+    return key43 + str(check_digit(key43))
+
+
+def note_url(sequence):
+    return f"{BASE_URL}?p={access_key(sequence)}|2|1|1|{'0' * 40}"
+
+
+def generate_page(n_items, seed=0, discount_rate=0.15):
+    """Gera (url, html em bytes) de uma NFCe com `n_items` itens"""
+    rng = random.Random(seed)
+    store = rng.choice(STORES)
+    rows = []
+    total = 0.0
+    for position in range(1, n_items + 1):
+        name, unit = rng.choice(PRODUCTS)
+        if unit == "KG":
+            quantity = round(rng.uniform(0.1, 3), 3)
+            quantity_text = br_number(quantity, 4).rstrip("0").rstrip(",")
+        else:
+            quantity = rng.randint(1, 12)
+            quantity_text = str(quantity)
+        unit_price = round(rng.uniform(1, 80), 2)
+        value = round(quantity * unit_price, 2)
+        discount = round(value * rng.uniform(0.02, 0.2), 2) if rng.random() < discount_rate else 0.0
+        total += value - discount
+        rows.append(
+            f'<tr id="Item + {position}">'
+            f'<td valign="top"><span class="txtTit2">{escape(name)}</span>'
+            f'<span class="RCod">(Código: {rng.randint(10 ** 12, 10 ** 13 - 1)} )</span><br>'
+            f'<span class="Rqtd"><strong>Qtde.:</strong>{quantity_text}</span>'
+            f'<span class="RUN"><strong>UN: </strong>{unit}</span>'
+            f'<span class="RvlUnit"><strong>Vl. Unit.:</strong>&nbsp;{br_number(unit_price)}</span>'
+            f'<span class="totalNumb">Vlr. Desc.: {br_number(discount)}</span></td>'
+            f'<td align="right" valign="top" class="txtTit noWrap">Vl. Total<br>'
+            f'<span class="valor">{br_number(value)}</span></td></tr>'
+        )
+
+    html = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>NFC-e</title></head><body>'
+        '<div id="conteudo"><div class="txtCenter">'
+        f'<div id="u20" class="txtTopo">{escape(store)}</div>'
+        '<div class="text">CNPJ: 00.000.000/0001-00</div>'
+        '<div class="text">RUA EXEMPLO, 100, CENTRO, CURITIBA, PR</div></div>'
+        '<table id="tabResult" border="0" align="center" width="100%">'
+        + "".join(rows) +
+        '</table><div id="totalNota" class="txtRight">'
+        f'<div id="linhaTotal"><label>Qtd. total de itens:</label><span class="totalNumb">{n_items}</span></div>'
+        f'<div id="linhaTotal"><label>Valor a pagar R$:</label><span class="totalNumb txtMax">{br_number(total)}</span></div>'
+        '</div></div></body></html>'
+    )
+    return note_url(seed), html.encode("utf-8")
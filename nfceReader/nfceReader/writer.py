@@ -0,0 +1,114 @@
+# Escritor único dos itens ingeridos, com commit em grupo.
+#
+# Crawls simultâneos no mesmo processo (motor em processo, fila de jobs)
+# entregam suas notas a uma única thread, que grava todas as que estiverem
+# esperando numa só transação. Assim há um único escritor por processo
+# disputando o lock do SQLite e um fsync por lote, não por nota. Entre
+# processos a serialização continua a cargo do BEGIN IMMEDIATE.
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from nfceReader import metrics
+from nfceReader.storage import NFCE_DB, connect, insert_note
+
+logger = logging.getLogger(__name__)
+
+# Máximo de notas por transação e espera por mais notas antes do commit (s)
+WRITE_BATCH_SIZE = int(os.environ.get("NFCE_WRITE_BATCH", 200))
+WRITE_BATCH_DELAY = float(os.environ.get("NFCE_WRITE_DELAY", 0.01))
+
+
+class GroupCommitWriter:
+    """Fila de notas a gravar, drenada por uma thread escritora"""
+
+    def __init__(self, path=NFCE_DB, batch_size=WRITE_BATCH_SIZE, batch_delay=WRITE_BATCH_DELAY):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Sobe a thread escritora (idempotente)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="nfce-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, items, access_key=None, url=None):
+        """Enfileira uma nota; o Future resolve com True (gravada) ou False (duplicada)"""
+        self.start()
+        future = Future()
+        self._queue.put((future, list(items), access_key, url))
+        return future
+
+    def write(self, items, access_key=None, url=None):
+        """Versão bloqueante de `submit`"""
+        return self.submit(items, access_key, url).result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [entry for entry in self._next_batch() if entry[0].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self._commit(batch)
+            except Exception as e:
+                # Um lote inválido não pode derrubar as outras notas: regrava uma a uma
+                logger.error(f"Erro ao gravar lote de {len(batch)} notas: {str(e)}")
+                for entry in batch:
+                    try:
+                        entry[0].set_result(self._commit([entry])[0])
+                    except Exception as e:
+                        entry[0].set_exception(e)
+                continue
+            for (future, *_), result in zip(batch, results):
+                future.set_result(result)
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        conn = connect(self.path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            results = [insert_note(conn, items, access_key, url, now) for _, items, access_key, url in batch]
+            conn.execute("COMMIT")
+            metrics.CRAWL_STAGE.labels("write").observe(time.perf_counter() - started)
+            # Só as inseridas: notas já no índice são ignoradas pelo INSERT
+            metrics.NOTES_WRITTEN.inc(sum(results))
+            return results
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path=NFCE_DB):
+    """Escritor compartilhado do processo para o banco em `path`"""
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = GroupCommitWriter(path)
+        return writer
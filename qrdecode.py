@@ -0,0 +1,208 @@
+"""
+NFCe Web Reader - Decodificação de QR Codes em fotos de cupons
+Lê lotes de imagens (ou arquivos zip com imagens) num pool de processos do
+tamanho dos núcleos e devolve, por imagem, os textos dos QR Codes achados.
+
+Usa pyzbar + Pillow; sem eles (ou sem a libzbar do sistema), o
+cv2.QRCodeDetector do OpenCV, se estiver instalado.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps
+    from pyzbar import pyzbar
+    from pyzbar.pyzbar import ZBarSymbol
+except ImportError:  # pyzbar sem a libzbar do sistema também cai aqui
+    pyzbar = None
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+
+BACKEND = "pyzbar" if pyzbar is not None else "opencv" if cv2 is not None else None
+
+# Processos de decodificação (padrão: um por núcleo)
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', 0)) or os.cpu_count() or 1
+# Limites de um envio: imagens, tamanho de cada imagem e total descompactado
+DECODE_MAX_FILES = int(os.environ.get('DECODE_MAX_FILES', 5000))
+DECODE_MAX_IMAGE_MB = int(os.environ.get('DECODE_MAX_IMAGE_MB', 25))
+DECODE_MAX_TOTAL_MB = int(os.environ.get('DECODE_MAX_TOTAL_MB', 2048))
+# Lado maior da primeira tentativa; fotos maiores só são lidas inteiras
+# se a versão reduzida não tiver QR Code
+DECODE_MAX_SIDE = int(os.environ.get('DECODE_MAX_SIDE', 1600))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".gif"}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def available():
+    return BACKEND is not None
+
+
+class UploadError(ValueError):
+    """Envio inválido (sem imagens, acima dos limites, zip corrompido)"""
+
+
+def _is_image(name):
+    return os.path.splitext(name.lower())[1] in IMAGE_EXTENSIONS
+
+
+def iter_uploads(files):
+    """Expande os arquivos enviados em (nome, bytes ou mensagem de erro).
+
+    `files` são pares (nome, arquivo binário). Zips são abertos e suas
+    imagens entram no lote com o nome "arquivo.zip/caminho". Os bytes são
+    lidos sob demanda, para o lote não precisar caber em memória.
+    """
+    max_image = DECODE_MAX_IMAGE_MB * 1024 * 1024
+    remaining = DECODE_MAX_TOTAL_MB * 1024 * 1024
+    count = 0
+    for name, stream in files:
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(stream)
+            except zipfile.BadZipFile:
+                raise UploadError(f"Arquivo zip inválido: {name}")
+            with archive:
+                for entry in archive.infolist():
+                    if entry.is_dir() or not _is_image(entry.filename):
+                        continue
+                    count += 1
+                    if count > DECODE_MAX_FILES:
+                        raise UploadError(f"Envio excede o limite de {DECODE_MAX_FILES} imagens")
+                    path = f"{name}/{entry.filename}"
+                    # Tamanho declarado no zip: barra zip bombs antes de descompactar
+                    if entry.file_size > max_image:
+                        yield path, f"Imagem maior que {DECODE_MAX_IMAGE_MB} MB"
+                        continue
+                    remaining -= entry.file_size
+                    if remaining < 0:
+                        raise UploadError(f"Envio excede o limite de {DECODE_MAX_TOTAL_MB} MB")
+                    # Membro corrompido, cifrado ou com compressão não suportada
+                    # vira erro da imagem, sem derrubar o restante do lote
+                    try:
+                        data = archive.read(entry)
+                    except (zipfile.BadZipFile, zlib.error, EOFError, RuntimeError, NotImplementedError) as e:
+                        yield path, f"Arquivo corrompido no zip: {e}"
+                        continue
+                    yield path, data
+        else:
+            count += 1
+            if count > DECODE_MAX_FILES:
+                raise UploadError(f"Envio excede o limite de {DECODE_MAX_FILES} imagens")
+            data = stream.read(max_image + 1)
+            if len(data) > max_image:
+                yield name, f"Imagem maior que {DECODE_MAX_IMAGE_MB} MB"
+                continue
+            remaining -= len(data)
+            if remaining < 0:
+                raise UploadError(f"Envio excede o limite de {DECODE_MAX_TOTAL_MB} MB")
+            yield name, data
+    if count == 0:
+        raise UploadError("Nenhuma imagem enviada")
+
+
+def _texts(results):
+    texts = []
+    for text in results:
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="replace")
+        text = text.strip()
+        if text and text not in texts:
+            texts.append(text)
+    return texts
+
+
+def _decode_pyzbar(data):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("L")
+    attempts = []
+    if max(image.size) > DECODE_MAX_SIDE:
+        reduced = image.copy()
+        reduced.thumbnail((DECODE_MAX_SIDE, DECODE_MAX_SIDE))
+        attempts.append(reduced)
+    attempts.append(image)
+    for attempt in attempts:
+        texts = _texts(code.data for code in pyzbar.decode(attempt, symbols=[ZBarSymbol.QRCODE]))
+        if texts:
+            return texts
+    return []
+
+
+def _decode_opencv(data):
+    # imdecode aplica a orientação EXIF da foto
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("formato de imagem não reconhecido")
+    attempts = []
+    scale = DECODE_MAX_SIDE / max(image.shape)
+    if scale < 1:
+        attempts.append(cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+    attempts.append(image)
+    detector = cv2.QRCodeDetector()
+    for attempt in attempts:
+        found, texts, _, _ = detector.detectAndDecodeMulti(attempt)
+        texts = _texts(texts) if found else []
+        if texts:
+            return texts
+    return []
+
+
+def decode_image(name, data):
+    """Decodifica uma imagem (roda no processo do pool).
+
+    Retorna {"file", "codes": [textos dos QR Codes], "error"}.
+    """
+    if isinstance(data, str):  # recusada em iter_uploads
+        return {"file": name, "codes": [], "error": data}
+    try:
+        decode = _decode_pyzbar if BACKEND == "pyzbar" else _decode_opencv
+        return {"file": name, "codes": decode(data), "error": None}
+    except Exception as e:
+        return {"file": name, "codes": [], "error": f"Imagem ilegível: {str(e)}"}
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: o processo web tem threads (reactor, workers da fila)
+            # que um fork copiaria em estado inconsistente
+            _executor = ProcessPoolExecutor(
+                max_workers=DECODE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def decode_batch(uploads):
+    """Decodifica (nome, bytes) em paralelo; gera os resultados na ordem de entrada.
+
+    Mantém no máximo duas imagens por processo em voo, então o consumo de
+    memória não depende do tamanho do lote.
+    """
+    global _executor
+    executor = _get_executor()
+    window = []
+    try:
+        for name, data in uploads:
+            window.append(executor.submit(decode_image, name, data))
+            if len(window) >= 2 * DECODE_WORKERS:
+                yield window.pop(0).result()
+        for future in window:
+            yield future.result()
+    except BrokenProcessPool:
+        # Um processo morreu (ex.: falta de memória): o próximo lote cria outro pool
+        with _executor_lock:
+            if _executor is executor:
+                _executor = None
+        raise
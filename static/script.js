@@ -7,6 +7,15 @@
 const state = {
     isProcessing: false,
     currentData: [],
+    nextCursor: null,
+    isLoadingPage: false,
+    // Canal de eventos (/api/events): cursor do servidor, id até onde
+    // currentData foi carregado e linhas novas ainda não exibidas
+    events: null,
+    streamLastId: null,
+    dataUpTo: null,
+    liveRows: [],
+    jobWaiters: {},
     qrScanner: null,
     isScannerActive: false,
     isFlashOn: false,
@@ -43,6 +52,7 @@ const elements = {
     loadingTable: document.getElementById('loadingTable'),
     emptyState: document.getElementById('emptyState'),
     tableWrapper: document.getElementById('tableWrapper'),
+    modalBody: document.querySelector('#dataModal .modal-body'),
     dataTableBody: document.getElementById('dataTableBody')
 };
 
@@ -62,7 +72,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     
     initEventListeners();
-    loadStats();
+    initEventStream();
     
     console.log('✅ Aplicação inicializada');
 });
@@ -105,6 +115,14 @@ function initEventListeners() {
     elements.closeModal.addEventListener('click', closeModal);
     elements.modalOverlay.addEventListener('click', closeModal);
     
+    // Paginação: carregar a próxima página ao chegar perto do fim da tabela
+    elements.modalBody.addEventListener('scroll', () => {
+        const body = elements.modalBody;
+        if (body.scrollTop + body.clientHeight >= body.scrollHeight - 200) {
+            loadNextPage();
+        }
+    });
+    
     // Actions
     elements.downloadBtn.addEventListener('click', handleDownload);
     elements.clearDataBtn.addEventListener('click', handleClearData);
@@ -460,6 +478,101 @@ function onScanError(error) {
         }
     });
 
+/**
+ * Canal de eventos do servidor: estatísticas, linhas novas e progresso dos
+ * jobs chegam por push, sem reconsultar /api/stats e /api/data
+ */
+function initEventStream() {
+    if (!window.EventSource) {
+        loadStats();
+        return;
+    }
+    
+    // Ao reconectar, o navegador envia o Last-Event-ID e o servidor
+    // reenvia as linhas perdidas no intervalo
+    const source = new EventSource('/api/events');
+    state.events = source;
+    
+    source.addEventListener('hello', (event) => {
+        state.streamLastId = JSON.parse(event.data).last_id;
+    });
+    
+    source.addEventListener('stats', (event) => {
+        renderStats(JSON.parse(event.data).stats);
+    });
+    
+    source.addEventListener('rows', (event) => {
+        const data = JSON.parse(event.data);
+        state.streamLastId = data.last_id;
+        // Linhas anteriores ao carregamento da tabela já vieram do /api/data
+        if (state.dataUpTo === null) {
+            return;
+        }
+        state.liveRows = state.liveRows.concat(data.rows);
+        flushLiveRows();
+    });
+    
+    source.addEventListener('clear', () => {
+        state.currentData = [];
+        state.nextCursor = null;
+        state.liveRows = [];
+        state.dataUpTo = 0;
+        state.streamLastId = 0;
+        if (elements.dataModal.style.display === 'flex') {
+            renderTable([]);
+            showTable();
+        }
+    });
+    
+    source.addEventListener('reset', (event) => {
+        // Mudanças demais para enviar linha a linha: recarregar a tabela
+        state.streamLastId = JSON.parse(event.data).last_id;
+        state.dataUpTo = null;
+        state.liveRows = [];
+        if (elements.dataModal.style.display === 'flex') {
+            loadData();
+        }
+    });
+    
+    source.addEventListener('job', (event) => {
+        const job = JSON.parse(event.data);
+        if (job.finished && state.jobWaiters[job.id]) {
+            state.jobWaiters[job.id]();
+        }
+    });
+    
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            // Sem reconexão automática (ex.: 503 com o servidor no limite de
+            // conexões): voltar às consultas e tentar de novo mais tarde
+            state.events = null;
+            state.dataUpTo = null;
+            loadStats();
+            setTimeout(() => {
+                if (state.events === null) {
+                    initEventStream();
+                }
+            }, 30000);
+        }
+    };
+}
+
+/**
+ * Acrescentar à tabela as linhas recebidas por evento, depois da última página
+ */
+function flushLiveRows() {
+    if (state.nextCursor !== null || state.isLoadingPage || state.liveRows.length === 0) {
+        return;
+    }
+    const rows = state.liveRows;
+    state.liveRows = [];
+    state.currentData = state.currentData.concat(rows);
+    if (elements.dataModal.style.display === 'flex') {
+        showTable();
+        renderTable(rows, true);
+    }
+}
+
 /**
  * Processar NFCe usando Scrapy Spider
  */
@@ -481,14 +594,34 @@ async function processNFCe(url) {
         const data = await response.json();
         
         if (!response.ok) {
-            throw new Error(data.error || 'Erro ao processar NFCe');
+            throw new Error(data.message || 'Erro ao processar NFCe');
+        }
+        
+        // Nota já ingerida: o servidor responde sem novo scraping
+        if (data.duplicate) {
+            showAlert('ℹ️ Esta NFCe já foi processada anteriormente', 'info');
+            setTimeout(() => {
+                elements.scanResult.style.display = 'none';
+                state.isProcessing = false;
+            }, 2000);
+            return;
+        }
+        
+        // A URL entrou na fila; acompanhar o job até terminar
+        const job = await waitForJob(data.job_id);
+        const result = job.urls[0];
+        
+        if (result.status === 'failed') {
+            throw new Error(result.message || 'Erro ao processar NFCe');
         }
         
         console.log('✅ Spider executada com sucesso');
         showAlert('✅ NFCe processada! Aguarde 3s para escanear próxima...', 'success');
         
-        // Atualizar estatísticas
-        await loadStats();
+        // Atualizar estatísticas (com o canal de eventos, já chegaram por push)
+        if (!state.events) {
+            await loadStats();
+        }
         
         // Ocultar resultado após 3 segundos e permitir nova leitura
         setTimeout(() => {
@@ -511,6 +644,37 @@ async function processNFCe(url) {
     }
 }
 
+/**
+ * Aguardar a conclusão de um job da fila
+ */
+async function waitForJob(jobId, interval = 1000) {
+    // Com o canal de eventos, o fim do job chega por push; a consulta
+    // espaçada só cobre um evento perdido numa reconexão
+    const pushed = state.events
+        ? new Promise(resolve => { state.jobWaiters[jobId] = resolve; })
+        : null;
+    
+    try {
+        while (true) {
+            const response = await fetch(`/api/jobs/${jobId}`);
+            const data = await response.json();
+            
+            if (!response.ok || !data.success) {
+                throw new Error(data.message || 'Erro ao consultar processamento');
+            }
+            
+            if (data.job.finished) {
+                return data.job;
+            }
+            
+            const delay = new Promise(resolve => setTimeout(resolve, pushed ? 5000 : interval));
+            await (pushed ? Promise.race([pushed, delay]) : delay);
+        }
+    } finally {
+        delete state.jobWaiters[jobId];
+    }
+}
+
 /**
  * Carregar estatísticas
  */
@@ -520,19 +684,24 @@ async function loadStats() {
         const data = await response.json();
         
         if (data.success) {
-            const stats = data.stats;
-            
-            // Animar números
-            animateNumber(elements.statItems, stats.total_items);
-            animateNumber(elements.statValue, stats.total_value, true);
-            animateNumber(elements.statStores, stats.stores.length);
-            animateNumber(elements.statDiscount, stats.total_discount, true);
+            renderStats(data.stats);
         }
     } catch (error) {
         console.error('Erro ao carregar estatísticas:', error);
     }
 }
 
+/**
+ * Exibir estatísticas
+ */
+function renderStats(stats) {
+    // Animar números
+    animateNumber(elements.statItems, stats.total_items);
+    animateNumber(elements.statValue, stats.total_value, true);
+    animateNumber(elements.statStores, stats.store_count ?? stats.stores.length);
+    animateNumber(elements.statDiscount, stats.total_discount, true);
+}
+
 /**
  * Animar números
  */
@@ -581,48 +750,124 @@ async function openModal() {
     elements.dataModal.style.display = 'flex';
     document.body.style.overflow = 'hidden';
     
+    // Tabela mantida em dia pelo canal de eventos: nada a baixar de novo
+    if (state.dataUpTo !== null) {
+        renderTable(state.currentData);
+        showTable();
+        return;
+    }
+    
+    await loadData();
+}
+
+/**
+ * Carregar a primeira página de dados
+ */
+async function loadData() {
     // Mostrar loading
     elements.loadingTable.style.display = 'flex';
     elements.emptyState.style.display = 'none';
     elements.tableWrapper.style.display = 'none';
     
+    // Carregar até o cursor atual do canal de eventos; as linhas
+    // posteriores chegam pelos eventos "rows"
+    state.dataUpTo = state.events ? state.streamLastId : null;
+    state.liveRows = [];
+    state.isLoadingPage = true;
+    
     try {
-        const response = await fetch('/api/data');
+        const response = await fetch(dataUrl());
         const result = await response.json();
         
         if (result.success) {
             state.currentData = result.data;
-            
-            if (result.data.length === 0) {
-                // Mostrar estado vazio
-                elements.loadingTable.style.display = 'none';
-                elements.emptyState.style.display = 'flex';
-            } else {
-                // Mostrar tabela
-                renderTable(result.data);
-                elements.loadingTable.style.display = 'none';
-                elements.tableWrapper.style.display = 'block';
-            }
+            state.nextCursor = result.next_cursor;
+            renderTable(result.data);
+            showTable();
         } else {
+            state.dataUpTo = null;
             showAlert(`Erro ao carregar dados: ${result.message}`, 'error');
             closeModal();
         }
     } catch (error) {
+        state.dataUpTo = null;
         console.error('Erro ao carregar dados:', error);
         showAlert('Erro ao carregar dados do servidor.', 'error');
         closeModal();
+    } finally {
+        state.isLoadingPage = false;
     }
+    
+    flushLiveRows();
+}
+
+/**
+ * URL de uma página do /api/data, limitada ao cursor do canal de eventos
+ */
+function dataUrl(cursor = null) {
+    const params = new URLSearchParams();
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    if (state.dataUpTo !== null) {
+        params.set('max_id', state.dataUpTo);
+    }
+    const query = params.toString();
+    return query ? `/api/data?${query}` : '/api/data';
+}
+
+/**
+ * Mostrar a tabela, ou o estado vazio se não houver dados
+ */
+function showTable() {
+    elements.loadingTable.style.display = 'none';
+    if (state.currentData.length === 0) {
+        elements.tableWrapper.style.display = 'none';
+        elements.emptyState.style.display = 'flex';
+    } else {
+        elements.emptyState.style.display = 'none';
+        elements.tableWrapper.style.display = 'block';
+    }
+}
+
+/**
+ * Carregar a próxima página de dados (paginação por cursor)
+ */
+async function loadNextPage() {
+    if (!state.nextCursor || state.isLoadingPage) {
+        return;
+    }
+    
+    state.isLoadingPage = true;
+    try {
+        const response = await fetch(dataUrl(state.nextCursor));
+        const result = await response.json();
+        
+        if (result.success) {
+            state.currentData = state.currentData.concat(result.data);
+            state.nextCursor = result.next_cursor;
+            renderTable(result.data, true);
+        }
+    } catch (error) {
+        console.error('Erro ao carregar próxima página:', error);
+    } finally {
+        state.isLoadingPage = false;
+    }
+    
+    flushLiveRows();
 }
 
 /**
  * Renderizar tabela de dados
  */
-function renderTable(data) {
-    elements.dataTableBody.innerHTML = '';
+function renderTable(data, append = false) {
+    if (!append) {
+        elements.dataTableBody.innerHTML = '';
+    }
     
     data.forEach((row, index) => {
         const tr = document.createElement('tr');
-        tr.style.animationDelay = `${index * 0.02}s`;
+        tr.style.animationDelay = `${Math.min(index, 50) * 0.02}s`;
         
         tr.innerHTML = `
             <td><strong>${escapeHtml(row.Estabelecimento || 'N/A')}</strong></td>
@@ -694,7 +939,9 @@ async function handleClearData() {
         if (data.success) {
             showAlert('✅ Dados limpos com sucesso!', 'success');
             closeModal();
-            await loadStats();
+            if (!state.events) {
+                await loadStats();
+            }
         } else {
             showAlert(`❌ Erro: ${data.message}`, 'error');
         }
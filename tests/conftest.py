@@ -0,0 +1,10 @@
+# A aplicação roda da raiz do repositório e o projeto Scrapy (nfceReader/)
+# não é um pacote instalado: os dois entram no sys.path dos testes
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (ROOT, os.path.join(ROOT, "nfceReader")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
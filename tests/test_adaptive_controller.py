@@ -0,0 +1,39 @@
+"""Ordenação das escalas da pirâmide pelo controlador adaptativo"""
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("qreader")
+
+from main_improved import AdaptiveController, Config, PyramidDetector  # noqa: E402
+
+
+def make_controller():
+    return AdaptiveController(Config(scales=(0.5, 1.0, 2.0), stats_file=""))
+
+
+def record_level(controller, scale, hits, tries=AdaptiveController.MIN_TRIES):
+    key = PyramidDetector.level_key(1, scale)
+    for i in range(tries):
+        controller.record("scales", key, i < hits)
+
+
+def test_scale_key_matches_level_key():
+    assert PyramidDetector.scale_key(1.0) == PyramidDetector.level_key(1, 1.0) == "1"
+    assert PyramidDetector.scale_key(0.75) == "0.75"
+
+
+def test_default_order_without_stats():
+    assert make_controller().scales() == [0.5, 1.0, 2.0]
+
+
+def test_recorded_whole_scale_moves_up():
+    controller = make_controller()
+    record_level(controller, 2.0, hits=8)
+    assert controller.scales()[0] == 2.0
+
+
+def test_whole_scale_without_hits_is_dropped():
+    controller = make_controller()
+    record_level(controller, 1.0, hits=0)
+    assert controller.scales() == [0.5, 2.0]
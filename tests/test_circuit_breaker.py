@@ -0,0 +1,83 @@
+"""Transições de estado do disjuntor por host"""
+
+import pytest
+
+from nfceReader import middlewares
+from nfceReader.middlewares import CircuitBreaker, circuit_retry_after
+
+
+def open_breaker(now=100.0):
+    breaker = CircuitBreaker(failures=3, reset_timeout=30.0)
+    for _ in range(3):
+        breaker.record_failure(now)
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=3, reset_timeout=30.0)
+    breaker.record_failure(100.0)
+    breaker.record_failure(100.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow(100.0)
+    breaker.record_failure(100.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failures=3, reset_timeout=30.0)
+    breaker.record_failure(100.0)
+    breaker.record_failure(100.0)
+    breaker.record_success()
+    breaker.record_failure(100.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_rejects_until_reset_timeout():
+    breaker = open_breaker()
+    assert breaker.rejecting(110.0)
+    assert not breaker.allow(110.0)
+    assert breaker.retry_after(110.0) == pytest.approx(20.0)
+    # rejecting() só consulta: não consome a requisição de teste
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = open_breaker()
+    assert not breaker.rejecting(130.0)
+    assert breaker.allow(130.0)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Enquanto o teste não responde, o resto continua recusado
+    assert not breaker.allow(131.0)
+    assert breaker.rejecting(131.0)
+
+
+def test_successful_probe_closes():
+    breaker = open_breaker()
+    assert breaker.allow(130.0)
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert not breaker.rejecting(130.0)
+
+
+def test_failed_probe_reopens():
+    breaker = open_breaker()
+    assert breaker.allow(130.0)
+    breaker.record_failure(131.0)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after(131.0) == pytest.approx(30.0)
+
+
+def test_unanswered_probe_allows_a_new_one():
+    breaker = open_breaker()
+    assert breaker.allow(130.0)
+    assert breaker.allow(160.0)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_circuit_retry_after(monkeypatch):
+    breaker = open_breaker()
+    monkeypatch.setattr(middlewares, "_breakers", {"portal.sefaz": breaker})
+    assert circuit_retry_after("portal.sefaz", 110.0) == pytest.approx(20.0)
+    assert circuit_retry_after("portal.sefaz", 130.0) is None
+    assert circuit_retry_after("outro.sefaz", 110.0) is None
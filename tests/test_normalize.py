@@ -0,0 +1,71 @@
+"""Conversão dos valores da SEFAZ para centavos e marcação de problemas"""
+
+from decimal import Decimal
+
+import pytest
+
+from nfceReader.normalize import normalize_item, parse_br_decimal, to_cents
+
+
+@pytest.mark.parametrize("value, cents", [
+    ("0", 0),
+    ("12.34", 1234),
+    ("0.005", 1),      # meio centavo arredonda para cima
+    ("0.004", 0),
+    ("2.675", 268),    # exato em Decimal, sem o erro do float
+    ("-0.005", -1),    # arredondamento comercial: metade se afasta do zero
+    ("-1.50", -150),
+    ("1234567.89", 123456789),
+])
+def test_to_cents(value, cents):
+    assert to_cents(Decimal(value)) == cents
+
+
+@pytest.mark.parametrize("text, value", [
+    ("1.234,56", Decimal("1234.56")),
+    ("1.234.567", Decimal("1234567")),
+    ("-0,50", Decimal("-0.50")),
+    (" 12,3 ", Decimal("12.3")),
+    ("7", Decimal("7")),
+])
+def test_parse_br_decimal(text, value):
+    assert parse_br_decimal(text) == value
+
+
+@pytest.mark.parametrize("text", [None, "", "abc", "1,234.56", "12.34", "1.23,4", "0,5-", "--1", "R$ 1,00"])
+def test_parse_br_decimal_invalid(text):
+    assert parse_br_decimal(text) is None
+
+
+def test_normalize_item():
+    normalized = normalize_item({"valor": "1.234,56", "desconto": "-0,50", "quantidade": "1,500"})
+    assert normalized == {
+        "valor_cents": 123456,
+        "desconto_cents": 50,
+        "quantidade_num": "1.5",
+        "issues": [],
+    }
+
+
+def test_negative_value_keeps_sign_and_is_flagged():
+    normalized = normalize_item({"valor": "-3,90", "quantidade": "1"})
+    assert normalized["valor_cents"] == -390
+    assert normalized["issues"] == ["valor negativo: '-3,90'"]
+
+
+def test_more_than_two_decimals_is_rounded_and_flagged():
+    normalized = normalize_item({"valor": "1,005", "quantidade": "1"})
+    assert normalized["valor_cents"] == 101
+    assert normalized["issues"] == ["valor com mais de 2 casas: '1,005'"]
+
+
+def test_invalid_fields_are_flagged_not_zeroed():
+    normalized = normalize_item({"valor": "abc", "desconto": "x", "quantidade": ""})
+    assert normalized["valor_cents"] is None
+    assert normalized["desconto_cents"] == 0
+    assert normalized["quantidade_num"] is None
+    assert len(normalized["issues"]) == 3
+
+
+def test_large_quantity_without_exponent():
+    assert normalize_item({"valor": "1,00", "quantidade": "10"})["quantidade_num"] == "10"
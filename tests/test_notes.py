@@ -0,0 +1,57 @@
+"""Extração da chave de acesso da URL do QR Code"""
+
+import pytest
+
+from nfceReader.notes import check_digit, extract_access_key, is_valid_access_key
+
+BASE = "4124067548193900011765001000012345" + "123456789"
+
+
+def make_key(base=BASE):
+    return base + str(check_digit(base))
+
+
+KEY = make_key()
+
+
+def test_check_digit_valid_key():
+    assert len(KEY) == 44
+    assert is_valid_access_key(KEY)
+
+
+@pytest.mark.parametrize("key", [
+    None, "", KEY[:43], KEY + "0", KEY[:-1] + str((int(KEY[-1]) + 1) % 10), "a" + KEY[1:],
+])
+def test_invalid_access_keys(key):
+    assert not is_valid_access_key(key)
+
+
+@pytest.mark.parametrize("url", [
+    f"https://www.fazenda.pr.gov.br/nfce/qrcode?p={KEY}|2|1|1|ABCDEF",
+    f"  https://www.fazenda.pr.gov.br/nfce/qrcode?p={KEY}|2|1|1|ABCDEF  ",
+    f"https://portal.sefaz/consulta?chNFe={KEY}&nVersao=100",
+    f"https://portal.sefaz/consulta/{KEY}",
+    f"https://portal.sefaz/qrcode?p={KEY}%7C2%7C1%7C1%7CABCDEF",
+])
+def test_extract_access_key(url):
+    assert extract_access_key(url) == KEY
+
+
+@pytest.mark.parametrize("url", [
+    None,
+    "",
+    "https://portal.sefaz/qrcode",
+    "https://portal.sefaz/qrcode?p=123|2|1",
+    # 44 dígitos com dígito verificador errado
+    f"https://portal.sefaz/qrcode?p={KEY[:-1]}{(int(KEY[-1]) + 1) % 10}|2|1",
+    # Mais de 44 dígitos seguidos não é uma chave
+    f"https://portal.sefaz/consulta/{KEY}1",
+])
+def test_extract_access_key_without_key(url):
+    assert extract_access_key(url) is None
+
+
+def test_invalid_p_falls_back_to_valid_sequence():
+    other = make_key("3" + BASE[1:])
+    url = f"https://portal.sefaz/qrcode?p=123|2&ref={other}"
+    assert extract_access_key(url) == other
@@ -0,0 +1,170 @@
+"""Contabilidade das vagas do WorkerPool: toda reserva devolve a vaga"""
+
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from jobs import DrainLock, WorkerPool, fcntl
+
+
+class FakeStore:
+    def __init__(self, tasks=(), claim_error=None):
+        self.tasks = list(tasks)
+        self.claim_error = claim_error
+        self.completed = []
+        self.failed = []
+
+    def requeue_stale(self):
+        return 0
+
+    def claim(self):
+        if self.claim_error:
+            raise self.claim_error
+        return self.tasks.pop(0) if self.tasks else None
+
+    def complete(self, task, items, message="NFCe processada com sucesso", timings=None):
+        self.completed.append((task['url'], items, message))
+
+    def fail(self, task, message, transient=True, timings=None):
+        self.failed.append((task['url'], message))
+
+    def defer(self, task, message, delay, timings=None):
+        self.failed.append((task['url'], message))
+
+
+class FakeEngine:
+    def __init__(self, error=None):
+        self.error = error
+        self.futures = []
+
+    def submit(self, url, timeout=None):
+        if self.error:
+            raise self.error
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+class FakeIndex:
+    def __init__(self, urls):
+        self.urls = set(urls)
+
+    def contains_url(self, url):
+        return url in self.urls
+
+
+def make_task(url="https://portal/nfce?p=1"):
+    return {"url": url, "job_id": "job", "position": 0, "attempts": 1, "ready_at": time.time()}
+
+
+def free_slots(pool):
+    taken = 0
+    while pool._slots.acquire(blocking=False):
+        taken += 1
+    for _ in range(taken):
+        pool._slots.release()
+    return taken
+
+
+def dispatch(pool):
+    """Como o _run: adquire a vaga antes de despachar"""
+    assert pool._slots.acquire(blocking=False)
+    return pool._dispatch()
+
+
+def test_empty_queue_releases_slot():
+    pool = WorkerPool(FakeEngine(), FakeStore(), size=2)
+    assert dispatch(pool) is False
+    assert free_slots(pool) == 2
+
+
+def test_claim_error_releases_slot():
+    pool = WorkerPool(FakeEngine(), FakeStore(claim_error=RuntimeError("database is locked")), size=2)
+    for _ in range(5):
+        with pytest.raises(RuntimeError):
+            dispatch(pool)
+    assert free_slots(pool) == 2
+
+
+def test_duplicate_note_releases_slot():
+    task = make_task()
+    store = FakeStore([task])
+    pool = WorkerPool(FakeEngine(), store, size=2, note_index=FakeIndex([task['url']]))
+    assert dispatch(pool) is True
+    assert free_slots(pool) == 2
+    assert store.completed == [(task['url'], [], "NFCe já processada anteriormente")]
+
+
+def test_submit_error_fails_task_and_releases_slot():
+    task = make_task()
+    store = FakeStore([task])
+    pool = WorkerPool(FakeEngine(error=RuntimeError("motor parado")), store, size=2)
+    with pytest.raises(RuntimeError):
+        dispatch(pool)
+    assert free_slots(pool) == 2
+    assert store.failed == [(task['url'], "motor parado")]
+
+
+def test_slot_held_until_result_is_written():
+    task = make_task()
+    store = FakeStore([task])
+    engine = FakeEngine()
+    pool = WorkerPool(engine, store, size=2)
+    assert dispatch(pool) is True
+    assert free_slots(pool) == 1
+
+    engine.futures[0].set_result([{"produto": "X"}])
+    pool._finisher.shutdown(wait=True)
+    assert free_slots(pool) == 2
+    assert store.completed == [(task["url"], [{"produto": "X"}], "NFCe processada com sucesso")]
+
+
+@pytest.mark.parametrize("error", [TimeoutError(), RuntimeError("portal fora do ar")])
+def test_failed_crawl_releases_slot(error):
+    task = make_task()
+    store = FakeStore([task])
+    engine = FakeEngine()
+    pool = WorkerPool(engine, store, size=1)
+    assert dispatch(pool) is True
+    assert free_slots(pool) == 0
+
+    engine.futures[0].set_exception(error)
+    pool._finisher.shutdown(wait=True)
+    assert free_slots(pool) == 1
+    assert len(store.failed) == 1
+
+
+def test_drain_lock_single_holder(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    first, second = DrainLock(path), DrainLock(path)
+    assert first.acquire()
+    assert first.acquire()
+    if fcntl is not None:
+        assert not second.acquire()
+
+
+def test_standby_pool_does_not_dispatch(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    holder = DrainLock(path)
+    assert holder.acquire()
+    store = FakeStore([make_task()])
+    pool = WorkerPool(FakeEngine(), store, size=1, poll_interval=0.01, drain_lock=DrainLock(path))
+    if fcntl is None:
+        pytest.skip("sem flock neste sistema")
+    pool.start()
+    time.sleep(0.1)
+    assert len(store.tasks) == 1
+    pool.stop()
+
+
+def test_pool_with_drain_lock_dispatches(tmp_path):
+    store = FakeStore([make_task()])
+    engine = FakeEngine()
+    pool = WorkerPool(engine, store, size=1, poll_interval=0.01, drain_lock=DrainLock(str(tmp_path / "jobs.db")))
+    pool.start()
+    deadline = time.monotonic() + 2
+    while not engine.futures and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.stop()
+    assert len(engine.futures) == 1
@@ -0,0 +1,28 @@
+"""Escritor em grupo: notas repetidas não são gravadas nem contadas"""
+
+import pytest
+
+from nfceReader import metrics
+from nfceReader.notes import check_digit
+from nfceReader.writer import GroupCommitWriter
+
+BASE = "4124067548193900011765001000012345123456789"
+KEY = BASE + str(check_digit(BASE))
+URL = f"https://www.fazenda.pr.gov.br/nfce/qrcode?p={KEY}|2|1"
+ITEM = {"produto": "ARROZ", "quantidade": "1", "unidade": "UN", "valor": "5,00", "desconto": ""}
+
+
+def notes_written():
+    if not metrics.available():
+        pytest.skip("prometheus-client não instalado")
+    return metrics.prom.REGISTRY.get_sample_value("nfce_notes_written_total") or 0
+
+
+def test_duplicate_note_is_not_counted(tmp_path):
+    writer = GroupCommitWriter(str(tmp_path / "nfce.db"), batch_delay=0.2)
+    before = notes_written()
+    futures = [writer.submit([ITEM], KEY, URL) for _ in range(3)]
+    assert sorted(f.result(timeout=10) for f in futures) == [False, False, True]
+    assert notes_written() - before == 1
+    assert writer.write([ITEM], KEY, URL) is False
+    assert notes_written() - before == 1
@@ -0,0 +1,219 @@
+"""
+NFCe Web Reader - Tempos por etapa e profiler sob demanda
+Cada request acumula a duração das suas etapas (validação, consulta,
+enfileiramento, e as etapas do crawl ao consultar um job), devolvidas no
+header Server-Timing e numa linha de log JSON.
+
+Para investigar em produção sem novo deploy, um administrador liga o
+profiler por amostragem nos próximos N requests (POST /api/admin/profile);
+cada perfil vai para PROFILE_DIR no formato "folded" (uma pilha por linha
+com o número de amostras), aberto por flamegraph.pl ou speedscope.app.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# Intervalo entre amostras do profiler (ms) e máximo de requests por pedido
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_MAX_REQUESTS = int(os.environ.get('PROFILE_MAX_REQUESTS', 100))
+# Requests mais rápidos que isso (ms) não geram a linha de log; 0 registra todos
+TIMING_LOG_MIN_MS = float(os.environ.get('TIMING_LOG_MIN_MS', 0))
+
+PROFILE_FLAG = "profile_requests"
+
+# Pilhas paradas nestes pontos são threads ociosas (pools, reactor, servidor)
+IDLE_FRAMES = {("threading.py", "wait"), ("selectors.py", "select"), ("socket.py", "accept")}
+
+_current = contextvars.ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """Etapas de um request, em segundos, na ordem em que ocorreram"""
+
+    def __init__(self, profiler=None):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.profiler = profiler
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def server_timing(self, total):
+        """Valor do header Server-Timing (durações em ms)"""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def begin(profile=False):
+    """Inicia a medição do request atual (e o profiler, se `profile`)"""
+    profiler = SamplingProfiler().start() if profile else None
+    request_timing = RequestTiming(profiler)
+    _current.set(request_timing)
+    return request_timing
+
+
+def current():
+    """Medição do request em andamento neste contexto, ou None.
+
+    asyncio.to_thread copia o contexto, então as funções chamadas em
+    threads pelo asgi.py enxergam a mesma medição.
+    """
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Mede um trecho como etapa do request atual (sem request, não faz nada)"""
+    request_timing = _current.get()
+    if request_timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_timing.add(name, time.perf_counter() - started)
+
+
+def finish(request_timing, method, path, endpoint, status):
+    """Encerra a medição: salva o perfil, registra a linha de log e devolve o Server-Timing"""
+    total = time.perf_counter() - request_timing.started
+    record = {
+        "event": "request",
+        "method": method,
+        "path": path,
+        "endpoint": endpoint,
+        "status": status,
+        "duration_ms": round(total * 1000, 1),
+        "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in request_timing.stages.items()},
+    }
+    if request_timing.profiler is not None:
+        try:
+            record["profile"] = request_timing.profiler.stop().save(profile_path(method, endpoint, total))
+        except Exception as e:
+            logger.error(f"Erro ao salvar perfil: {str(e)}")
+    if total * 1000 >= TIMING_LOG_MIN_MS or "profile" in record:
+        logger.info(json.dumps(record, ensure_ascii=False))
+    return request_timing.server_timing(total)
+
+
+def profile_path(method, endpoint, total):
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', endpoint or 'unmatched').strip('_') or 'index'
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(PROFILE_DIR, f"{stamp}_{method}_{slug}_{total * 1000:.0f}ms_{os.getpid()}.folded")
+
+
+def list_profiles(limit=20):
+    """Perfis salvos mais recentes: [{"file", "size", "created_at"}]"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".folded")]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [
+        {"file": entry.name, "size": entry.stat().st_size, "created_at": entry.stat().st_mtime}
+        for entry in entries[:limit]
+    ]
+
+
+class SamplingProfiler:
+    """Amostra as pilhas de todas as threads do processo numa thread própria.
+
+    Sem instrumentar as funções (como o cProfile faria), o custo fica no
+    intervalo entre amostras e não cresce com o número de chamadas; o
+    crawl e as consultas em outras threads também aparecem no perfil.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                # Outros profilers (requests simultâneos) e threads paradas ficam de fora
+                if name == "profiler":
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(name)
+                self.samples[";".join(reversed(stack))] += 1
+
+    def save(self, path):
+        """Grava as pilhas no formato folded e devolve o caminho"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as output:
+            for stack, count in self.samples.most_common():
+                output.write(f"{stack} {count}\n")
+        return path
+
+
+class ProfileSwitch:
+    """Quantos dos próximos requests serão perfilados, somando todos os processos.
+
+    O contador fica no banco de jobs, compartilhado pelos workers do
+    gunicorn; desligado, cada processo consulta o banco no máximo uma vez
+    por CHECK_INTERVAL segundos.
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, store):
+        self.store = store
+        self._remaining = 0
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def arm(self, count):
+        self.store.set_flag(PROFILE_FLAG, count)
+        with self._lock:
+            self._remaining = count
+            self._checked = time.monotonic()
+
+    def remaining(self):
+        return self.store.get_flag(PROFILE_FLAG)
+
+    def pending(self):
+        """Se take() precisa ir ao banco (asgi.py o chama fora do event loop)"""
+        return self._remaining > 0 or time.monotonic() - self._checked >= self.CHECK_INTERVAL
+
+    def take(self):
+        """Reserva um dos requests a perfilar; False se o profiler estiver desligado"""
+        if not self.pending():
+            return False
+        with self._lock:
+            self._checked = time.monotonic()
+        taken, self._remaining = self.store.take_flag(PROFILE_FLAG)
+        return taken
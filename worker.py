@@ -0,0 +1,53 @@
+"""
+NFCe Web Reader - Worker da fila de processamento
+Drena a fila durável (SQLite) fora dos workers web, para escalar a
+capacidade de crawl separadamente da capacidade HTTP.
+
+Uso: QUEUE_INLINE_WORKER=0 no processo web e `python worker.py` aqui,
+com NFCE_DB e JOBS_DB no mesmo disco do processo web (em Heroku, Railway
+ou Render cada processo tem seu próprio disco: lá o web drena a fila
+sozinho). Só um processo por banco de jobs drena; outros worker.py ficam
+de reserva e assumem se ele morrer.
+"""
+
+import logging
+import os
+import signal
+import threading
+
+from crawl_engine import create_engine
+from jobs import DrainLock, JobStore, WorkerPool
+from nfceReader.notes import NoteIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CRAWL_ENGINE = os.environ.get('CRAWL_ENGINE', 'inprocess')
+PROCESS_TIMEOUT = int(os.environ.get('PROCESS_TIMEOUT', 30))
+HOST_CONCURRENCY = int(os.environ['HOST_CONCURRENCY']) if os.environ.get('HOST_CONCURRENCY') else None
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 4))
+
+
+def main():
+    engine = create_engine(CRAWL_ENGINE, host_concurrency=HOST_CONCURRENCY, max_workers=WORKER_CONCURRENCY)
+    store = JobStore()
+    pool = WorkerPool(engine, store, size=WORKER_CONCURRENCY,
+                      timeout=PROCESS_TIMEOUT, note_index=NoteIndex(), drain_lock=DrainLock(store.path))
+
+    stopped = threading.Event()
+
+    def shutdown(signum, frame):
+        logger.info("Encerrando worker...")
+        pool.stop()
+        stopped.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    pool.start()
+    logger.info(f"Worker iniciado ({WORKER_CONCURRENCY} crawls simultâneos, motor {CRAWL_ENGINE})")
+    stopped.wait()
+
+
+if __name__ == '__main__':
+    main()